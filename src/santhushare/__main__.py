@@ -3,11 +3,15 @@ import logging
 import http.server
 import socketserver
 import threading
+import asyncio
+import concurrent.futures
 import shutil
 import socket
+import sys
 import urllib.parse
 import base64
 import datetime
+import email.utils
 import time
 from io import BytesIO
 
@@ -27,6 +31,24 @@ try:
 except ImportError:
     ANDROID_AVAILABLE = False
 
+# Optional: thumbnails off Android are made with Pillow when it is installed.
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# Optional: brotli variants of compressed responses when the module is installed.
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Optional: xxh3 transfer digests when xxhash is installed, BLAKE2 otherwise.
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 # Constants
 PORT = 8080
 # We will resolve the directory dynamically to handle permission grants at runtime
@@ -63,6 +85,14 @@ def ensure_log_dir():
     except Exception as e:
         logging.error(f"DEBUG: Failed to create log dir {LOG_DIR}: {e}")
 
+
+def app_cache_dir(name):
+    """``name`` inside the app's cache directory, or inside the system temp
+    directory when no Toga app is running (tests, benchmarks, the CLI)."""
+    paths = getattr(getattr(AppManager.get(), 'app', None), 'paths', None)
+    base = str(paths.cache) if paths is not None else os.path.join(tempfile.gettempdir(), 'santhushare')
+    return os.path.join(base, name)
+
 ALLOWED_ROOTS = [
     "/storage/emulated/0",
     "/sdcard",
@@ -75,13 +105,32 @@ ALLOWED_ROOTS = [
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
 
 # --- History / Notification System ---
+# Events from handler threads are buffered here and handed to the UI at most
+# UI_FRAME_RATE times a second, so a burst of thousands of small files costs
+# a few list inserts per frame instead of one loop callback per file.
+HISTORY_LIMIT = 500
+UI_FRAME_RATE = 10
+# An upload with no bytes for this long was abandoned (e.g. a resumable
+# session the browser never came back to) and stops counting toward progress.
+TRANSFER_IDLE = 60
+
+
 class AppManager:
     _instance = None
     
     def __init__(self, app_ref):
         AppManager._instance = self
         self.app = app_ref
-        self.history = [] # List of dicts
+        self.history = collections.deque(maxlen=HISTORY_LIMIT) # Newest first
+        self.lock = threading.Lock()
+        # Events not yet shown, oldest first. Only the last HISTORY_LIMIT
+        # could be shown anyway, and with no UI loop nothing drains it.
+        self._new = collections.deque(maxlen=HISTORY_LIMIT)
+        self._flush_scheduled = False
+        # Transfer key -> [bytes done, bytes expected, last activity]
+        self.transfers = {}
+        self._progress_dirty = False
+        self._progress_published = 0
         
     @classmethod
     def get(cls):
@@ -89,19 +138,73 @@ class AppManager:
 
     def add_history(self, title, subtitle, icon=None):
         item = {"title": title, "subtitle": subtitle, "icon": icon}
-        self.history.insert(0, item)
-        # Verify if running on UI thread or schedule
-        if hasattr(self.app, 'loop'):
-            self.app.loop.call_soon_threadsafe(self.app.update_history_ui)
-    
-    def update_progress(self, value):
-        # Value 0 to 100
-        def _update():
-            if hasattr(self.app, 'progress_bar'):
-                self.app.progress_bar.value = value
-        # Toga thread safety
-        if hasattr(self.app, 'main_window'):
-            self.app.loop.call_soon_threadsafe(_update)
+        with self.lock:
+            self.history.appendleft(item)
+            self._new.append(item)
+            self._schedule_flush()
+        EVENTS.publish('history', item)
+
+    # Progress is the bytes moved so far over the bytes expected, across
+    # every upload and archive download in flight.
+    def transfer_started(self, key, total, done=0):
+        with self.lock:
+            if key not in self.transfers:
+                self.transfers[key] = [done, total, time.monotonic()]
+                self._progress_dirty = True
+                self._schedule_flush()
+        self._publish_progress(True)
+
+    def transfer_bytes(self, key, nbytes):
+        with self.lock:
+            t = self.transfers.get(key)
+            if t is None: return
+            t[0] += nbytes
+            t[2] = time.monotonic()
+            self._progress_dirty = True
+            self._schedule_flush()
+        self._publish_progress()
+
+    def transfer_finished(self, key):
+        with self.lock:
+            if self.transfers.pop(key, None) is None: return
+            self._progress_dirty = True
+            self._schedule_flush()
+        self._publish_progress(True)
+
+    def progress(self):
+        cutoff = time.monotonic() - TRANSFER_IDLE
+        with self.lock:
+            for key in [k for k, t in self.transfers.items() if t[2] < cutoff]:
+                del self.transfers[key]
+            done = sum(t[0] for t in self.transfers.values())
+            total = sum(t[1] for t in self.transfers.values())
+        return min(100, done * 100 // total) if total else 0
+
+    def _publish_progress(self, force=False):
+        # Byte counts arrive far more often than anyone can watch them.
+        now = time.monotonic()
+        if not EVENTS.subscribers or (not force and now - self._progress_published < EVENTS_PROGRESS_INTERVAL):
+            return
+        self._progress_published = now
+        EVENTS.publish('progress', {"percent": self.progress(), "transfers": len(self.transfers)})
+
+    def _schedule_flush(self):
+        # Called with self.lock held.
+        if self._flush_scheduled or not hasattr(self.app, 'loop'): return
+        self._flush_scheduled = True
+        self.app.loop.call_soon_threadsafe(self.app.loop.call_later, 1 / UI_FRAME_RATE, self._flush)
+
+    def _flush(self):
+        # Runs on the UI loop.
+        with self.lock:
+            self._flush_scheduled = False
+            new = list(self._new)
+            self._new.clear()
+            dirty, self._progress_dirty = self._progress_dirty, False
+        if new:
+            self.app.update_history_ui(new)
+        if dirty and hasattr(self.app, 'progress_bar'):
+            self.app.progress_bar.value = self.progress()
         
     def send_notification(self, title, content):
         if not ANDROID_AVAILABLE:
@@ -208,6 +311,337 @@ function initGame(){
 }
 """
 
+UPLOAD_SCRIPT = """
+// Files go up as numbered chunks over several parallel requests. Sessions are
+// remembered in localStorage, so re-selecting the same files after a dropped
+// connection or a page reload only sends the chunks the server is missing.
+var UPLOAD_CONCURRENCY = 4, UPLOAD_CHUNK = 8*1024*1024, UPLOAD_RETRIES = 6;
+function api(method, url, body, onprogress) {
+    return new Promise(function(resolve, reject) {
+        var xhr = new XMLHttpRequest();
+        xhr.open(method, url);
+        if (onprogress) xhr.upload.onprogress = onprogress;
+        xhr.onload = function() {
+            var data = null;
+            try { data = JSON.parse(xhr.responseText); } catch (e) {}
+            if (xhr.status >= 200 && xhr.status < 300) return resolve(data);
+            var err = new Error((data && data.error) || ('HTTP ' + xhr.status));
+            err.status = xhr.status;
+            reject(err);
+        };
+        xhr.onerror = function() { reject(new Error('Network error')); };
+        if (body && !(body instanceof Blob)) {
+            xhr.setRequestHeader('Content-Type', 'application/json');
+            body = JSON.stringify(body);
+        }
+        xhr.send(body || null);
+    });
+}
+function sleep(ms) { return new Promise(function(r) { setTimeout(r, ms); }); }
+async function withRetry(fn) {
+    for (var attempt = 0; ; attempt++) {
+        try { return await fn(); }
+        catch (e) {
+            // Client errors will not fix themselves; everything else is retried with backoff.
+            if (attempt >= UPLOAD_RETRIES || (e.status >= 400 && e.status < 500 && e.status !== 408)) throw e;
+            await sleep(Math.min(30000, 500 * Math.pow(2, attempt)));
+        }
+    }
+}
+function Limiter(n) { this.free = n; this.waiting = []; }
+Limiter.prototype.run = async function(fn) {
+    if (this.free > 0) this.free--;
+    else await new Promise(r => this.waiting.push(r));
+    try { return await fn(); }
+    finally { var next = this.waiting.shift(); if (next) next(); else this.free++; }
+};
+async function openSession(file) {
+    var key = 'upload:' + file.name + ':' + file.size + ':' + file.lastModified;
+    var sid = localStorage.getItem(key);
+    if (sid) {
+        try { return {key: key, s: await api('GET', '/api/upload/' + sid)}; }
+        catch (e) { if (e.status !== 404) throw e; }
+    }
+    var s = await api('POST', '/api/upload', {name: file.name, size: file.size, chunk_size: UPLOAD_CHUNK});
+    localStorage.setItem(key, s.id);
+    return {key: key, s: s};
+}
+async function uploadFile(file, limiter, progress, candidate) {
+    if (candidate && await limiter.run(() => alreadyThere(file, progress))) {
+        progress.done += file.size; progress.report(); return;
+    }
+    var o = await limiter.run(() => withRetry(() => openSession(file)));
+    var s = o.s, have = new Set(s.received), pending = [];
+    for (var i = 0; i < s.chunks; i++) {
+        var start = i * s.chunk_size, blob = file.slice(start, Math.min(file.size, start + s.chunk_size));
+        if (have.has(i)) { progress.done += blob.size; continue; }
+        pending.push(limiter.run(((idx, blob) => withRetry(function() {
+            var tag = s.id + ':' + idx;
+            return api('PUT', '/api/upload/' + s.id + '?index=' + idx, blob, function(e) {
+                progress.inflight[tag] = e.loaded; progress.report();
+            }).then(function() {
+                delete progress.inflight[tag]; progress.done += blob.size; progress.report();
+            }, function(e) { delete progress.inflight[tag]; throw e; });
+        })).bind(null, i, blob)));
+    }
+    progress.report();
+    await Promise.all(pending);
+    await limiter.run(() => withRetry(() => api('POST', '/api/upload/' + s.id + '/finish')));
+    localStorage.removeItem(o.key);
+}
+// Files whose SHA-256 the server already has are not sent again. Only a file
+// the size of one already there can be a duplicate, so the server is asked
+// about sizes first and just those files are hashed, each inside the upload
+// limiter so the hashing overlaps other uploads. SubtleCrypto only exists in
+// secure contexts (https, localhost) and cannot hash a file in pieces, so it
+// is kept to small files; the rest go through the streaming SHA-256 below.
+var HASH_MAX = 256*1024*1024, HASH_SLICE = 4*1024*1024, SUBTLE_MAX = 32*1024*1024;
+var K256 = [
+    0x428a2f98, 0x71374491, 0xb5c0fbcf, 0xe9b5dba5, 0x3956c25b, 0x59f111f1, 0x923f82a4, 0xab1c5ed5,
+    0xd807aa98, 0x12835b01, 0x243185be, 0x550c7dc3, 0x72be5d74, 0x80deb1fe, 0x9bdc06a7, 0xc19bf174,
+    0xe49b69c1, 0xefbe4786, 0x0fc19dc6, 0x240ca1cc, 0x2de92c6f, 0x4a7484aa, 0x5cb0a9dc, 0x76f988da,
+    0x983e5152, 0xa831c66d, 0xb00327c8, 0xbf597fc7, 0xc6e00bf3, 0xd5a79147, 0x06ca6351, 0x14292967,
+    0x27b70a85, 0x2e1b2138, 0x4d2c6dfc, 0x53380d13, 0x650a7354, 0x766a0abb, 0x81c2c92e, 0x92722c85,
+    0xa2bfe8a1, 0xa81a664b, 0xc24b8b70, 0xc76c51a3, 0xd192e819, 0xd6990624, 0xf40e3585, 0x106aa070,
+    0x19a4c116, 0x1e376c08, 0x2748774c, 0x34b0bcb5, 0x391c0cb3, 0x4ed8aa4a, 0x5b9cca4f, 0x682e6ff3,
+    0x748f82ee, 0x78a5636f, 0x84c87814, 0x8cc70208, 0x90befffa, 0xa4506ceb, 0xbef9a3f7, 0xc67178f2];
+function Sha256() {
+    this.h = [0x6a09e667, 0xbb67ae85, 0x3c6ef372, 0xa54ff53a, 0x510e527f, 0x9b05688c, 0x1f83d9ab, 0x5be0cd19];
+    this.w = new Int32Array(64); this.buf = new Uint8Array(64); this.fill = 0; this.len = 0;
+}
+Sha256.prototype.block = function(p, o) {
+    var w = this.w, h = this.h, i;
+    for (i = 0; i < 16; i++) w[i] = p[o+4*i] << 24 | p[o+4*i+1] << 16 | p[o+4*i+2] << 8 | p[o+4*i+3];
+    for (i = 16; i < 64; i++) {
+        var x = w[i-15], y = w[i-2];
+        w[i] = ((x >>> 7 | x << 25) ^ (x >>> 18 | x << 14) ^ x >>> 3)
+             + ((y >>> 17 | y << 15) ^ (y >>> 19 | y << 13) ^ y >>> 10) + w[i-7] + w[i-16] | 0;
+    }
+    var a = h[0], b = h[1], c = h[2], d = h[3], e = h[4], f = h[5], g = h[6], k = h[7];
+    for (i = 0; i < 64; i++) {
+        var t1 = k + ((e >>> 6 | e << 26) ^ (e >>> 11 | e << 21) ^ (e >>> 25 | e << 7))
+               + (e & f ^ ~e & g) + K256[i] + w[i] | 0;
+        var t2 = ((a >>> 2 | a << 30) ^ (a >>> 13 | a << 19) ^ (a >>> 22 | a << 10))
+               + (a & b ^ a & c ^ b & c) | 0;
+        k = g; g = f; f = e; e = d + t1 | 0; d = c; c = b; b = a; a = t1 + t2 | 0;
+    }
+    h[0] = h[0] + a | 0; h[1] = h[1] + b | 0; h[2] = h[2] + c | 0; h[3] = h[3] + d | 0;
+    h[4] = h[4] + e | 0; h[5] = h[5] + f | 0; h[6] = h[6] + g | 0; h[7] = h[7] + k | 0;
+};
+Sha256.prototype.update = function(data) {
+    var i = 0;
+    this.len += data.length;
+    if (this.fill) {
+        while (this.fill < 64 && i < data.length) this.buf[this.fill++] = data[i++];
+        if (this.fill < 64) return;
+        this.block(this.buf, 0); this.fill = 0;
+    }
+    for (; i + 64 <= data.length; i += 64) this.block(data, i);
+    while (i < data.length) this.buf[this.fill++] = data[i++];
+};
+Sha256.prototype.hex = function() {
+    var bits = this.len * 8, pad = new Uint8Array((this.fill < 56 ? 64 : 128) - this.fill);
+    var view = new DataView(pad.buffer);
+    pad[0] = 0x80;
+    view.setUint32(pad.length - 8, Math.floor(bits / 4294967296));
+    view.setUint32(pad.length - 4, bits >>> 0);
+    this.update(pad);
+    return this.h.map(x => (x >>> 0).toString(16).padStart(8, '0')).join('');
+};
+async function sha256Hex(file, onprogress) {
+    if (file.size <= SUBTLE_MAX && window.crypto && crypto.subtle) {
+        var buf = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+        return Array.from(new Uint8Array(buf), b => b.toString(16).padStart(2, '0')).join('');
+    }
+    var h = new Sha256();
+    for (var off = 0; off < file.size; off += HASH_SLICE) {
+        h.update(new Uint8Array(await file.slice(off, off + HASH_SLICE).arrayBuffer()));
+        if (onprogress) onprogress(Math.min(file.size, off + HASH_SLICE));
+    }
+    return h.hex();
+}
+async function dedupCandidates(files) {
+    var asked = files.filter(f => f.size <= HASH_MAX);
+    if (!asked.length) return new Set();
+    try {
+        var res = await api('POST', '/api/have', {files: asked.map(f => ({name: f.name, size: f.size}))});
+    } catch (e) { return new Set(); }
+    return new Set(asked.filter((f, i) => res.files[i].status === 'candidate'));
+}
+async function alreadyThere(file, progress) {
+    var tag = file.name + ':' + file.size;
+    progress.hashing[tag] = 0; progress.report();
+    try {
+        var sha256 = await sha256Hex(file, function(n) {
+            progress.hashing[tag] = n / file.size; progress.report();
+        });
+        var res = await api('POST', '/api/have', {link: true, files: [{name: file.name, size: file.size, sha256: sha256}]});
+        return res.files[0].status !== 'missing';
+    } catch (e) { return false; }
+    finally { delete progress.hashing[tag]; progress.report(); }
+}
+async function uploadFiles(files, onprogress) {
+    var limiter = new Limiter(UPLOAD_CONCURRENCY), total = 0;
+    files = Array.from(files);
+    for (var f of files) total += f.size;
+    var progress = {done: 0, inflight: {}, hashing: {}, report: function() {
+        var sent = this.done, checking = Object.keys(this.hashing).map(k =>
+            k.slice(0, k.lastIndexOf(':')) + ' ' + (this.hashing[k] * 100).toFixed(0) + '%');
+        for (var k in this.inflight) sent += this.inflight[k];
+        onprogress(total ? sent / total * 100 : 100, checking.join(', '));
+    }};
+    progress.report();
+    var candidates = await dedupCandidates(files);
+    await Promise.all(files.map(f => uploadFile(f, limiter, progress, candidates.has(f))));
+}
+"""
+
+BROWSE_SCRIPT = """
+// Rows are fetched from /api/list one page at a time as the list scrolls into
+// view, so the first rows appear at once however large the directory is.
+var PAGE = 200, state = {cursor: null, done: false, loading: false, gen: 0};
+var rows = document.getElementById('rows'), more = document.getElementById('more');
+var sortSel = document.getElementById('sort');
+var THUMB_EXT = /\\.(jpe?g|png|webp|gif|bmp|hei[cf]|mp4|m4v|mkv|mov|webm|3gp)$/i;
+function entryPath(name) { return DIR.replace(/\\/$/, '') + '/' + name; }
+// Search hits carry a full path; listing rows are relative to DIR.
+function rowPath(e) { return e.path || entryPath(e.name); }
+function fmtSize(n) { return (n/1024).toFixed(1) + ' KB'; }
+function makeRow(e) {
+    var li = document.createElement('li'), label = document.createElement('span');
+    var actions = document.createElement('span'), q = encodeURIComponent(rowPath(e));
+    var box = document.createElement('input');
+    li.dataset.name = e.name;
+    box.type = 'checkbox';
+    box.value = rowPath(e);
+    box.checked = picked.has(box.value);
+    box.onchange = function() { box.checked ? picked.add(box.value) : picked.delete(box.value); updatePicked(); };
+    li.appendChild(box);
+    if (!e.dir && THUMB_EXT.test(e.name)) {
+        // Native lazy loading only requests previews for rows near the viewport.
+        var img = document.createElement('img');
+        img.loading = 'lazy'; img.width = 48; img.height = 48; img.alt = '';
+        img.style.objectFit = 'cover'; img.style.verticalAlign = 'middle';
+        img.src = '/thumb?path=' + q;
+        img.onerror = function() {
+            // A 202 means the preview is still rendering: ask again shortly.
+            var tries = +(img.dataset.tries || 0);
+            fetch(img.src, {method: 'HEAD'}).then(function(r) {
+                if ((r.status != 202 && !r.ok) || tries >= 10) { img.remove(); return; }
+                img.dataset.tries = tries + 1;
+                setTimeout(function() { img.src = '/thumb?path=' + q + '&try=' + (tries + 1); },
+                           r.ok ? 0 : 1000);
+            }, function() { img.remove(); });
+        };
+        li.appendChild(img);
+    }
+    label.textContent = (e.dir ? '📁 ' : '📄 ') + (e.path || e.name);
+    if (!e.dir || e.files != null) {
+        var small = document.createElement('small');
+        small.textContent = ' (' + fmtSize(e.size) + (e.dir ? ', ' + e.files + ' files' : '') + ')';
+        label.appendChild(small);
+    }
+    actions.innerHTML = e.dir
+        ? "<a href='/browse?path=" + q + "'>Open</a> | <a href='/zip?path=" + q + "'>Zip</a>"
+        : "<a href='/download?path=" + q + "'>Download</a>";
+    li.appendChild(label); li.appendChild(actions);
+    return li;
+}
+async function loadMore() {
+    if (state.loading || state.done) return;
+    state.loading = true;
+    var gen = state.gen, parts = sortSel.value.split(':');
+    var url = query
+        ? '/search?q=' + encodeURIComponent(query) + '&limit=' + PAGE
+        : '/api/list?path=' + encodeURIComponent(DIR) + '&sort=' + parts[0] + '&order=' + parts[1] + '&limit=' + PAGE;
+    if (state.cursor) url += '&cursor=' + encodeURIComponent(state.cursor);
+    try {
+        var res = await fetch(url), data = await res.json();
+        if (gen !== state.gen) return;
+        if (!res.ok) throw new Error(data.error || res.status);
+        var frag = document.createDocumentFragment();
+        (data.entries || data.results).forEach(e => frag.appendChild(makeRow(e)));
+        rows.appendChild(frag);
+        state.cursor = data.next;
+        state.done = !data.next;
+        var count = query ? (data.total == null ? rows.children.length : data.total) + ' matches' + (data.ready ? '' : ' so far (indexing…)')
+                          : data.total + ' items';
+        more.textContent = state.done ? count : 'Loading…';
+    } catch (err) {
+        more.textContent = 'Error: ' + err.message;
+        state.done = true;
+    } finally {
+        if (gen === state.gen) state.loading = false;
+    }
+    // Keep filling while the sentinel is still on screen.
+    if (!state.done && more.getBoundingClientRect().top < window.innerHeight) loadMore();
+}
+// Selected paths go out as one tar: POST /batch redirects to the download.
+var picked = new Set(), getBtn = document.getElementById('get'), allBox = document.getElementById('all');
+function updatePicked() {
+    getBtn.disabled = !picked.size;
+    getBtn.textContent = 'Download selected (' + picked.size + ')';
+}
+allBox.onchange = function() {
+    rows.querySelectorAll('input[type=checkbox]').forEach(function(box) {
+        box.checked = allBox.checked;
+        allBox.checked ? picked.add(box.value) : picked.delete(box.value);
+    });
+    updatePicked();
+};
+getBtn.onclick = function() {
+    var form = document.createElement('form');
+    form.method = 'POST';
+    form.action = '/batch';
+    picked.forEach(function(p) {
+        var input = document.createElement('input');
+        input.type = 'hidden'; input.name = 'path'; input.value = p;
+        form.appendChild(input);
+    });
+    document.body.appendChild(form);
+    form.submit();
+    form.remove();
+};
+function resetListing() {
+    state = {cursor: null, done: false, loading: false, gen: state.gen + 1};
+    rows.innerHTML = '';
+    picked.clear(); allBox.checked = false; updatePicked();
+    localStorage.setItem('sort', sortSel.value);
+    loadMore();
+}
+sortSel.value = localStorage.getItem('sort') || 'name:asc';
+sortSel.onchange = resetListing;
+// Typing in the search box swaps the listing for /search hits across all storage.
+var query = '', findBox = document.getElementById('find'), findTimer = null;
+findBox.oninput = function() {
+    clearTimeout(findTimer);
+    findTimer = setTimeout(function() { query = findBox.value.trim(); resetListing(); }, 250);
+};
+new IntersectionObserver(function(entries) { if (entries[0].isIntersecting) loadMore(); }).observe(more);
+loadMore();
+// Live updates over /events: files landing in this folder are patched into
+// the list and transfer progress shows, so nobody needs to reload.
+if (window.EventSource) {
+    var live = document.getElementById('live'), events = new EventSource('/events');
+    events.addEventListener('file', function(ev) {
+        var e = JSON.parse(ev.data);
+        if (query || e.dir !== DIR.replace(/\\/$/, '')) return;
+        for (var li of Array.from(rows.children)) if (li.dataset.name === e.name) li.remove();
+        rows.insertBefore(makeRow({name: e.name, dir: false, size: e.size, mtime: e.mtime}), rows.firstChild);
+    });
+    events.addEventListener('progress', function(ev) {
+        var p = JSON.parse(ev.data);
+        live.textContent = p.transfers ? 'Transferring… ' + p.percent + '%' : '';
+    });
+    events.addEventListener('history', function(ev) {
+        var h = JSON.parse(ev.data);
+        if (!live.textContent || live.textContent.indexOf('Transferring') !== 0) live.textContent = h.title + ': ' + h.subtitle;
+    });
+    // Missed more than the server keeps: start the listing over.
+    events.addEventListener('resync', function() { if (!query) resetListing(); });
+}
+"""
+
 HTML_LAYOUT = f"""<!DOCTYPE html>
 <html lang="en">
 <head><meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
@@ -259,6 +693,7 @@ window.onload = function() {{
     <script>{GAME_SCRIPT}</script>
 </div>
 
+<script>{UPLOAD_SCRIPT}</script>
 <script>
 var form = document.getElementById('upload-form');
 var pbox = document.getElementById('progress_box');
@@ -272,23 +707,17 @@ form.addEventListener('submit', function(e) {{
         alert("Please select files before transferring.");
         return;
     }}
-    var fd = new FormData(form);
-    var xhr = new XMLHttpRequest();
-    xhr.upload.onprogress = function(e) {{
-        if(e.lengthComputable) {{
-            var p = (e.loaded/e.total)*100;
-            pb.value = p;
-            pct.innerText = p.toFixed(0) + '%';
-            pbox.style.display='block';
-        }}
-    }};
-    xhr.onload = function() {{
+    pbox.style.display='block';
+    uploadFiles(fileInput.files, function(p, checking) {{
+        pb.value = p;
+        pct.innerText = p.toFixed(0) + '%' + (checking ? ' (checking ' + checking + ')' : '');
+    }}).then(function() {{
         pbox.style.display='none';
-        if(xhr.status===200) alert('Transfer Complete!');
-        else alert('Error: '+xhr.responseText);
-    }};
-    xhr.open('POST', '/');
-    xhr.send(fd);
+        alert('Transfer Complete!');
+    }}, function(err) {{
+        pbox.style.display='none';
+        alert('Error: ' + err.message + ' (select the same files again to resume)');
+    }});
 }});
 </script>
 </body></html>
@@ -296,310 +725,4121 @@ form.addEventListener('submit', function(e) {{
 
 # --- HTTP Handler ---
 import zipfile
-try:
-    import cgi
-except Exception:
-    cgi = None
 import re
+import tempfile
+import mmap
+import json
+import secrets
+import collections
+import html
+import bisect
+import hashlib
+import weakref
+import struct
+import zlib
+import tarfile
+import array
+import copy
 
-def parse_multipart_rfile(fp, headers):
-    try:
-        content_type = headers.get('Content-Type', '')
-        logging.error(f"DEBUG: CT: {content_type}")
-        
-        if 'multipart/form-data' not in content_type:
-            logging.error("DEBUG: Not multipart")
-            return {}
-            
-        boundary_match = re.search(r'boundary=([^;]+)', content_type)
-        if not boundary_match:
-            boundary_match = re.search(r'boundary=(.+)', content_type)
-        
-        if not boundary_match:
-            logging.error("DEBUG: No boundary found")
-            return {}
-            
-        boundary = boundary_match.group(1).strip('"')
-        logging.error(f"DEBUG: Boundary: {boundary}")
-        
-        boundary_bytes = b'--' + boundary.encode()
-        
+# Request bodies are consumed in windows of this size, so memory use stays
+# flat no matter how large an upload is.
+UPLOAD_CHUNK_SIZE = 256 * 1024
+MAX_PART_HEADER_SIZE = 16 * 1024
+MAX_FIELD_SIZE = 1024 * 1024
+
+
+class MultipartError(ValueError):
+    pass
+
+
+class Part:
+    def __init__(self, name, filename=None, file=None, value=None):
+        self.name = name
+        self.filename = filename
+        self.file = file
+        self.value = value
+        self.size = 0
+
+
+class UploadFile:
+    """Destination file for one uploaded part, written as the body streams in.
+
+    Bytes go to a hidden temporary name beside ``path`` that replaces it only
+    once the part is complete (see UploadStorage). With ``expected`` digests
+    ({algorithm: bytes}) a part that hashes differently is dropped instead.
+    """
+
+    def __init__(self, path, on_close=None, size=None, storage=None, on_write=None, expected=None):
+        self.path = path
+        self.size = 0
+        self.on_close = on_close
+        self.on_write = on_write
+        self.expected = expected or {}
+        # SHA-256 is always kept, for the deduplication index.
+        self.hashes = StreamDigests({'sha-256', *self.expected})
+        self.storage = storage or UPLOAD_STORAGE
+        self.tmp_path = os.path.join(os.path.dirname(path), UPLOAD_TMP_PREFIX + secrets.token_hex(8))
+        self._f = open(self.tmp_path, 'wb')
+        self.allocated = size if self.storage.preallocate(self._f, size) else 0
+
+    @property
+    def sha256(self):
+        return self.hashes.hashers['sha-256']
+
+    def write(self, data):
+        self._f.write(data)
+        self.hashes.update(data)
+        self.size += len(data)
+        if self.on_write: self.on_write(len(data))
+
+    def close(self):
+        if self._f.closed: return
         try:
-            cl = int(headers.get('Content-Length', 0))
-        except:
-            cl = 0
-            
-        logging.error(f"DEBUG: CL: {cl}")
-        if cl == 0: return {}
+            self.hashes.verify(self.expected)
+        except DigestMismatch:
+            self.abort()
+            raise
+        # A size hint that overshot leaves preallocated space past the data.
+        if self.allocated > self.size: self._f.truncate(self.size)
+        self.storage.commit(self._f, self.tmp_path, self.path, self.size)
+        remember_digests(self.path, self.hashes.digests())
+        logging.error(f"DEBUG: Streamed {self.size} bytes to {self.path}")
+        if self.on_close: self.on_close(self)
 
-        body = fp.read(cl)
-        logging.error(f"DEBUG: Read {len(body)} bytes")
-        
-        parts = body.split(boundary_bytes)
-        logging.error(f"DEBUG: Split into {len(parts)} parts")
-        
-        result = {}
-        
-        class Part:
-            def __init__(self, filename=None, data=b'', value=None): 
-                self.filename = filename 
-                self.file = BytesIO(data) 
-                self.value = value
-
-        for i, part in enumerate(parts):
-            if not part or part == b'--' or part == b'--\r\n' or part == b'--\n':
-                continue
-            
-            # Clean up leading CRLF/LF
-            if part.startswith(b'\r\n'): part = part[2:]
-            elif part.startswith(b'\n'): part = part[1:]
-            
-            if part.endswith(b'\r\n'): part = part[:-2]
-            elif part.endswith(b'\n'): part = part[:-1]
-            if part.endswith(b'--'): part = part[:-2] # End of body
-            
-            try:
-                if b'\r\n\r\n' in part:
-                    header_bytes, content_bytes = part.split(b'\r\n\r\n', 1)
-                elif b'\n\n' in part:
-                    header_bytes, content_bytes = part.split(b'\n\n', 1)
-                else:
+    def abort(self):
+        # Drop a partially received file; whatever was at path stays intact.
+        self._f.close()
+        try: os.remove(self.tmp_path)
+        except OSError: pass
+
+
+def _parse_part_headers(header_bytes):
+    name = None
+    filename = None
+    for line in header_bytes.decode('utf-8', errors='ignore').splitlines():
+        if 'content-disposition' in line.lower():
+            m_name = re.search(r'\bname="([^"]*)"', line)
+            if m_name: name = m_name.group(1)
+            m_filename = re.search(r'filename="([^"]*)"', line)
+            if m_filename: filename = m_filename.group(1)
+    return name, filename
+
+
+def parse_multipart_rfile(fp, headers, file_factory=None, chunk_size=UPLOAD_CHUNK_SIZE, on_field=None,
+                          file_fields=None):
+    """Incrementally parse a multipart/form-data body read from ``fp``.
+
+    The body is scanned for boundaries one ``chunk_size`` window at a time and
+    each file part is written to ``file_factory(filename)`` as it arrives, so
+    every byte is written exactly once and never buffered whole. Without a
+    factory, file parts are spooled to temporary files. With ``file_fields``,
+    file parts under any other field name are read past and dropped.
+    ``on_field(part)`` is called as each plain field completes. Returns a dict
+    of field name -> ``Part`` (or a list of parts for repeated names).
+    """
+    content_type = headers.get('Content-Type', '')
+    if 'multipart/form-data' not in content_type:
+        raise MultipartError("Not multipart/form-data")
+
+    boundary_match = re.search(r'boundary=("[^"]+"|[^;]+)', content_type)
+    if not boundary_match:
+        raise MultipartError("No boundary found")
+    boundary = boundary_match.group(1).strip().strip('"').encode()
+
+    try:
+        remaining = int(headers.get('Content-Length', 0))
+    except ValueError:
+        raise MultipartError("Invalid Content-Length")
+
+    spool = file_factory is None
+    if spool:
+        file_factory = lambda filename: tempfile.SpooledTemporaryFile(max_size=chunk_size)
+
+    # The opening delimiter may start the body; every later one follows CRLF.
+    first_delim = b'--' + boundary
+    delim = b'\r\n' + first_delim
+
+    result = {}
+    buf = bytearray()
+    state = 'preamble'
+    part = None
+    field = None
+    eof = False
+    need_more = True
+
+    def add_result(p):
+        if p.name in result:
+            if isinstance(result[p.name], list): result[p.name].append(p)
+            else: result[p.name] = [result[p.name], p]
+        else:
+            result[p.name] = p
+
+    try:
+        while state != 'done':
+            if need_more:
+                if eof: raise MultipartError(f"Truncated body ({state})")
+                data = fp.read(min(chunk_size, remaining)) if remaining > 0 else b''
+                remaining -= len(data)
+                buf += data
+                eof = not data or remaining <= 0
+                need_more = False
+
+            if state == 'preamble':
+                idx = buf.find(first_delim)
+                if idx < 0:
+                    del buf[:max(0, len(buf) - len(first_delim))]
+                    need_more = True
                     continue
-            except Exception as e:
-                logging.error(f"DEBUG: Part split error: {e}")
-                continue
+                del buf[:idx + len(first_delim)]
+                state = 'delimiter'
 
-            headers_text = header_bytes.decode('utf-8', errors='ignore')
-            name = None
-            filename = None
-            
-            for line in headers_text.splitlines():
-                if 'content-disposition' in line.lower():
-                    m_name = re.search(r'name="([^"]+)"', line)
-                    if m_name: name = m_name.group(1)
-                    m_filename = re.search(r'filename="([^"]*)"', line)
-                    if m_filename: filename = m_filename.group(1)
-
-            if not name:
-                continue
-                
-            logging.error(f"DEBUG: Found part name={name} filename={filename}")
+            if state == 'delimiter':
+                if buf[:2] == b'--':
+                    state = 'done'
+                    break
+                nl = buf.find(b'\n')
+                if nl < 0:
+                    need_more = True
+                    continue
+                # Skip any transport padding up to the end of the delimiter line.
+                del buf[:nl + 1]
+                state = 'headers'
 
-            if filename:
-                p = Part(filename=os.path.basename(filename), data=content_bytes)
-            else:
-                p = Part(value=content_bytes.decode('utf-8', errors='ignore'))
-            
-            if name in result:
-                if isinstance(result[name], list): result[name].append(p)
-                else: result[name] = [result[name], p]
-            else: result[name] = p
-                
-        return result
-    except Exception as e:
-        logging.error(f"DEBUG: Parser Exception: {e}")
-        return {}
+            if state == 'headers':
+                idx, sep = buf.find(b'\r\n\r\n'), 4
+                if idx < 0:
+                    idx, sep = buf.find(b'\n\n'), 2
+                if idx < 0:
+                    if len(buf) > MAX_PART_HEADER_SIZE: raise MultipartError("Part headers too large")
+                    need_more = True
+                    continue
+                name, filename = _parse_part_headers(bytes(buf[:idx]))
+                del buf[:idx + sep]
+                part = Part(name)
+                field = None
+                if filename and (file_fields is None or name in file_fields):
+                    part.filename = os.path.basename(filename.replace('\\', '/'))
+                    part.file = file_factory(part.filename)
+                elif filename is None:
+                    field = bytearray()
+                # Parts without a name, with an empty file input or under an
+                # unexpected file field are discarded.
+                state = 'body'
 
-class SecureHandler(http.server.BaseHTTPRequestHandler):
-    def log_message(self, format, *args):
-        pass
-    
-    def check_auth(self):
-        if not self.server.password: return True
-        auth = self.headers.get('Authorization')
-        if not auth: 
-            self.send_response(401)
-            self.send_header('WWW-Authenticate', 'Basic realm="SanthuShare"')
-            self.end_headers()
-            self.wfile.write(b"Auth Required")
+            if state == 'body':
+                idx = buf.find(delim)
+                end = idx if idx >= 0 else len(buf) - len(delim)
+                if end > 0:
+                    data = bytes(buf[:end])
+                    del buf[:end]
+                    part.size += len(data)
+                    if field is not None:
+                        if len(field) + len(data) > MAX_FIELD_SIZE:
+                            raise MultipartError(f"Field {part.name} too large")
+                        field += data
+                    elif part.file is not None:
+                        part.file.write(data)
+                if idx < 0:
+                    need_more = True
+                    continue
+                del buf[:len(delim)]
+                if field is not None:
+                    part.value = field.decode('utf-8', errors='ignore')
+                    if on_field: on_field(part)
+                if part.file is not None:
+                    if spool: part.file.seek(0)
+                    else: part.file.close()
+                if part.name and (part.filename or field is not None):
+                    add_result(part)
+                part = None
+                state = 'delimiter'
+    except Exception:
+        if part is not None and part.file is not None:
+            getattr(part.file, 'abort', part.file.close)()
+        raise
+
+    # Drain the epilogue so a persistent connection stays in sync.
+    while remaining > 0:
+        data = fp.read(min(chunk_size, remaining))
+        if not data: break
+        remaining -= len(data)
+
+    return result
+
+# The upload form's field, which the cgi-based handler read, and the one the
+# command-line client sends. File parts under other names are not stored.
+UPLOAD_FILE_FIELDS = frozenset({'file', 'files'})
+
+# --- Upload Storage ---
+# Where uploads land and how they get there. The upload dir is probed for
+# writability once and the answer kept; it is probed again only after a write
+# there fails (or, while on the internal fallback, every UPLOAD_DIR_RETRY
+# seconds in case storage permission has been granted since). Files are
+# written under a hidden temporary name, preallocated when the size is known,
+# and renamed into place when complete, so concurrent uploads of one name
+# can't interleave and nobody sees a half-written file.
+UPLOAD_TMP_PREFIX = ".santhushare-tmp-"
+UPLOAD_TMP_STALE = 3600
+UPLOAD_DIR_RETRY = 30
+# Smaller files gain nothing from preallocation.
+PREALLOCATE_MIN = 1024 * 1024
+# 'none' leaves flushing to the OS; 'file' syncs each file before it is
+# renamed into place; 'batch' syncs finished files together every
+# FSYNC_BATCH_FILES files or FSYNC_BATCH_BYTES bytes, and before an upload
+# request is answered.
+UPLOAD_FSYNC = 'none'
+FSYNC_BATCH_FILES = 64
+FSYNC_BATCH_BYTES = 64 * 1024 * 1024
+
+
+def _fsync_path(path, directory=False):
+    try:
+        fd = os.open(path, os.O_RDONLY | (getattr(os, 'O_DIRECTORY', 0) if directory else 0))
+    except OSError as e:
+        logging.error(f"DEBUG: Cannot open {path} to sync: {e}")
+        return
+    try: os.fsync(fd)
+    except OSError as e:
+        # Some filesystems refuse to sync directories; nothing to be done.
+        if not directory: logging.error(f"DEBUG: fsync of {path} failed: {e}")
+    finally: os.close(fd)
+
+
+class UploadStorage:
+    def __init__(self, fsync=UPLOAD_FSYNC):
+        if fsync not in ('none', 'file', 'batch'):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self._dir = None
+        self._probed = 0
+        self._pending = []
+        self._pending_bytes = 0
+
+    def directory(self):
+        d = self._dir
+        if d is None or (d != TARGET_UPLOAD_DIR and time.time() - self._probed > UPLOAD_DIR_RETRY):
+            with self.lock:
+                if self._dir is d:
+                    self._dir = get_real_upload_dir()
+                    self._probed = time.time()
+                    self._sweep(self._dir)
+                d = self._dir
+        return d
+
+    def invalidate(self):
+        """Probe the upload dir again on next use, after a write there failed."""
+        self._dir = None
+
+    def _sweep(self, directory):
+        # Temp files nobody has written to for a while are left from a crash.
+        cutoff = time.time() - UPLOAD_TMP_STALE
+        try:
+            with os.scandir(directory) as it:
+                stale = [e.path for e in it if e.name.startswith(UPLOAD_TMP_PREFIX)
+                         and e.stat().st_mtime < cutoff]
+        except OSError:
+            return
+        for path in stale:
+            try: os.remove(path)
+            except OSError: pass
+
+    def open(self, name, size=None, on_close=None, on_write=None, expected=None):
+        try:
+            return UploadFile(os.path.join(self.directory(), name), on_close, size, self, on_write, expected)
+        except OSError as e:
+            logging.error(f"DEBUG: Cannot create {name}: {e}, probing upload dir again")
+            self.invalidate()
+            return UploadFile(os.path.join(self.directory(), name), on_close, size, self, on_write, expected)
+
+    def preallocate(self, f, size):
+        """Reserve ``size`` bytes for ``f`` up front; False if that didn't happen."""
+        if not size or size < PREALLOCATE_MIN or not hasattr(os, 'posix_fallocate'):
             return False
         try:
-            m, c = auth.split()
-            if m.lower()!='basic': raise
-            d = base64.b64decode(c).decode().split(':', 1)
-            if d[1] != self.server.password: raise
-        except:
-            self.send_response(401)
-            self.send_header('WWW-Authenticate', 'Basic realm="SanthuShare"')
-            self.end_headers()
-            self.wfile.write(b"Access Denied")
+            os.posix_fallocate(f.fileno(), 0, size)
+            return True
+        except OSError as e:
+            logging.error(f"DEBUG: Preallocating {size} bytes failed: {e}")
             return False
-        return True
 
-    def do_GET(self):
-        if not self.check_auth(): return
-        
-        parsed = urllib.parse.urlparse(self.path)
-        if parsed.path == '/':
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(HTML_LAYOUT.encode('utf-8'))
+    def commit(self, f, tmp, dest, size):
+        """Close the open temp file ``f`` and move it to ``dest``."""
+        if self.fsync == 'file':
+            f.flush()
+            os.fsync(f.fileno())
+        f.close()
+        self.place(tmp, dest, size, synced=True)
+
+    def place(self, src, dest, size=0, synced=False):
+        """Rename the finished file ``src`` to ``dest`` under the fsync policy."""
+        if self.fsync == 'file' and not synced: _fsync_path(src)
+        os.replace(src, dest)
+        publish_file(dest)
+        if self.fsync == 'file':
+            _fsync_path(os.path.dirname(dest), directory=True)
+        elif self.fsync == 'batch':
+            with self.lock:
+                self._pending.append(dest)
+                self._pending_bytes += size
+                due = len(self._pending) >= FSYNC_BATCH_FILES or self._pending_bytes >= FSYNC_BATCH_BYTES
+            if due: self.flush()
+
+    def flush(self):
+        """Sync every file still waiting in the current batch."""
+        with self.lock:
+            pending, self._pending, self._pending_bytes = self._pending, [], 0
+        for path in pending:
+            _fsync_path(path)
+        for d in {os.path.dirname(p) for p in pending}:
+            _fsync_path(d, directory=True)
+
+
+UPLOAD_STORAGE = UploadStorage()
+
+# --- Resumable Upload Sessions ---
+# Files are uploaded as numbered chunks that may arrive in any order, on any
+# number of connections. Each chunk is written straight to its offset in a
+# preallocated .part file, so finishing is a rename rather than a copy.
+UPLOAD_SESSION_DIR = ".santhushare-uploads"
+DEFAULT_UPLOAD_CHUNK = 8 * 1024 * 1024
+MAX_UPLOAD_CHUNK = 64 * 1024 * 1024
+UPLOAD_SESSION_TTL = 24 * 3600
+
+
+class UploadSession:
+    def __init__(self, sid, name, size, chunk_size, received=(), created=None, expected=None):
+        self.id = sid
+        self.name = name
+        self.size = size
+        self.chunk_size = chunk_size
+        self.received = set(received)
+        self.created = created or time.time()
+        # Whole-file digests the client sent, checked on finish.
+        self.expected = expected or {}
+        self.lock = threading.Lock()
+
+    @property
+    def chunk_count(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def chunk_length(self, index):
+        return max(0, min(self.chunk_size, self.size - index * self.chunk_size))
+
+    def to_dict(self):
+        state = {
+            "id": self.id, "name": self.name, "size": self.size,
+            "chunk_size": self.chunk_size, "chunks": self.chunk_count,
+            "received": sorted(self.received),
+        }
+        if self.expected: state["digest"] = format_digests(self.expected)
+        return state
+
+
+class UploadSessionStore:
+    """Upload sessions, persisted beside the upload dir so they survive restarts."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self._made = None
+
+    def _dir(self):
+        d = os.path.join(UPLOAD_STORAGE.directory(), UPLOAD_SESSION_DIR)
+        if d != self._made:
+            os.makedirs(d, exist_ok=True)
+            self._made = d
+        return d
+
+    def part_path(self, session):
+        return os.path.join(self._dir(), session.id + ".part")
+
+    def _state_path(self, sid):
+        return os.path.join(self._dir(), sid + ".json")
+
+    def save(self, session):
+        state = session.to_dict()
+        state["created"] = session.created
+        tmp = self._state_path(session.id) + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp, self._state_path(session.id))
+
+    def create(self, name, size, chunk_size, expected=None):
+        self.expire()
+        session = UploadSession(secrets.token_hex(16), name, size, chunk_size, expected=expected)
+        with open(self.part_path(session), 'wb') as f:
+            if not UPLOAD_STORAGE.preallocate(f, size): f.truncate(size)
+        self.save(session)
+        with self.lock:
+            self.sessions[session.id] = session
+        return session
+
+    def get(self, sid):
+        if not re.fullmatch(r'[0-9a-f]{32}', sid or ''):
+            return None
+        with self.lock:
+            session = self.sessions.get(sid)
+            if session is None:
+                try:
+                    with open(self._state_path(sid)) as f:
+                        state = json.load(f)
+                except (OSError, ValueError):
+                    return None
+                session = UploadSession(sid, state["name"], state["size"], state["chunk_size"],
+                                        state["received"], state.get("created"), parse_digests(state.get("digest")))
+                self.sessions[sid] = session
+            return session
+
+    def remove(self, session, keep_data=False):
+        with self.lock:
+            self.sessions.pop(session.id, None)
+        paths = [self._state_path(session.id)]
+        if not keep_data: paths.append(self.part_path(session))
+        for p in paths:
+            try: os.remove(p)
+            except OSError: pass
+
+    def expire(self):
+        cutoff = time.time() - UPLOAD_SESSION_TTL
+        try:
+            entries = list(os.scandir(self._dir()))
+        except OSError:
             return
-            
-        if parsed.path == '/browse':
-            qs = urllib.parse.parse_qs(parsed.query)
-            path = qs.get('path', ["/storage/emulated/0"])[0]
-            if not os.path.exists(path): path = get_real_upload_dir()
-            
+        for entry in entries:
             try:
-                items = sorted(os.listdir(path))
-            except Exception as e:
-                self.send_error(500, str(e))
-                return
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+                    with self.lock:
+                        self.sessions.pop(entry.name.split('.')[0], None)
+            except OSError:
+                pass
 
-            html = [f"<!DOCTYPE html><html><head><meta charset='utf-8'><style>{CSS_VARS}</style><script>function toggleTheme(){{var b=document.body;b.setAttribute('data-theme',b.getAttribute('data-theme')==='dark'?'light':'dark')}}window.onload=function(){{document.body.setAttribute('data-theme',localStorage.getItem('theme')||'dark')}}</script></head><body>"]
-            html.append(f"<div class='card'><h3>📂 {os.path.basename(path) or 'Root'}</h3>")
-            parent = os.path.dirname(path)
-            if parent != path:
-                html.append(f"<a href='/browse?path={urllib.parse.quote(parent)}'>⬅️ Up Level</a><hr>")
-            
-            html.append("<ul>")
-            for item in items:
-                full = os.path.join(path, item)
-                q = urllib.parse.quote(full)
-                if os.path.isdir(full):
-                    html.append(f"<li><span>📁 {item}</span><span><a href='/browse?path={q}'>Open</a> | <a href='/zip?path={q}'>Zip</a></span></li>")
-                else:
-                    sz = "0B"
-                    try: sz = f"{os.path.getsize(full)/1024:.1f} KB" 
-                    except: pass
-                    html.append(f"<li><span>📄 {item} <small>({sz})</small></span><a href='/download?path={q}'>Download</a></li>")
-            html.append("</ul></div><div class='card'>Current Upload Dir: "+get_real_upload_dir()+"</div><button onclick='toggleTheme()'>Theme</button></body></html>")
-            
-            self.send_response(200)
-            self.send_header('Content-Type', 'text/html; charset=utf-8')
-            self.end_headers()
-            self.wfile.write("".join(html).encode('utf-8'))
+
+UPLOAD_SESSIONS = UploadSessionStore()
+
+
+def is_upload_api(path):
+    """True for /api/upload and /api/upload/..., but not /api/uploads etc."""
+    return path == '/api/upload' or path.startswith('/api/upload/')
+
+
+# --- Upload Deduplication ---
+# The upload directory keeps a persistent SHA-256 index of its files. Clients
+# ask /api/have before sending; content that is already there is linked (or
+# copied locally) under the new name instead of crossing the network again.
+HASH_INDEX_FILE = ".santhushare-index.json"
+HASH_READ_SIZE = 1024 * 1024
+# Seconds between rescans of the directory for files the index lacks.
+HASH_INDEX_RESCAN = 30
+HASH_INDEX_SAVE_DELAY = 2
+MAX_HAVE_FILES = 10000
+
+# One hashing thread, so background indexing never competes with transfers
+# for more than a single stream of disk reads. On Linux (and Android), where
+# nice values are per thread, it also runs at the lowest CPU priority and so
+# only gets the time transfers leave idle.
+HASH_POOL_NICE = 19
+
+
+def _lower_hash_priority():
+    if not sys.platform.startswith(('linux', 'android')): return
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), HASH_POOL_NICE)
+    except (AttributeError, OSError) as e:
+        logging.error(f"DEBUG: Could not lower hashing priority: {e}")
+
+
+HASH_POOL = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='hash', initializer=_lower_hash_priority)
+
+
+def sha256_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_READ_SIZE)
+            if not data: break
+            h.update(data)
+    return h.hexdigest()
+
+
+class HashIndex:
+    """SHA-256 of the files in one upload directory, persisted beside them.
+
+    Entries are keyed by name and only trusted while the file's size and
+    mtime match; files without a current entry are hashed in the background.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.path = os.path.join(directory, HASH_INDEX_FILE)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.by_digest = collections.defaultdict(set)
+        self.queued = set()
+        self.scanned = 0
+        self.save_timer = None
+        try:
+            with open(self.path) as f:
+                for name, (size, mtime_ns, digest) in json.load(f).get("files", {}).items():
+                    self._set(name, size, mtime_ns, digest)
+        except (OSError, ValueError, TypeError) as e:
+            logging.error(f"DEBUG: Starting a new hash index in {directory}: {e}")
+
+    def _set(self, name, size, mtime_ns, digest):
+        self._drop(name)
+        self.files[name] = (size, mtime_ns, digest)
+        self.by_digest[digest].add(name)
+
+    def _drop(self, name):
+        old = self.files.pop(name, None)
+        if old:
+            names = self.by_digest[old[2]]
+            names.discard(name)
+            if not names: del self.by_digest[old[2]]
+
+    def _current(self, name, st):
+        hit = self.files.get(name)
+        return hit is not None and hit[:2] == (st.st_size, st.st_mtime_ns)
+
+    def add(self, name, digest=None):
+        """Record ``name`` with a known ``digest``, or queue it for hashing."""
+        try:
+            st = os.stat(os.path.join(self.directory, name))
+        except OSError:
             return
+        if digest is None:
+            self._queue(name)
+            return
+        with self.lock:
+            self._set(name, st.st_size, st.st_mtime_ns, digest)
+        self._schedule_save()
 
-        if parsed.path == '/download' or parsed.path == '/zip':
-            qs = urllib.parse.parse_qs(parsed.query)
-            path = qs.get('path', [None])[0]
-            if not path or not os.path.exists(path):
-                self.send_error(404)
-                return
-            
-            if parsed.path == '/zip' and os.path.isdir(path):
-                name = os.path.basename(path) + ".zip"
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/zip')
-                self.send_header('Content-Disposition', f'attachment; filename="{name}"')
-                self.end_headers()
-                
-                with zipfile.ZipFile(self.wfile, 'w', zipfile.ZIP_DEFLATED) as z:
-                    for root, dirs, files in os.walk(path):
-                        for file in files:
-                            fn = os.path.join(root, file)
-                            arcname = os.path.relpath(fn, os.path.dirname(path))
-                            z.write(fn, arcname)
-                
-                AppManager.get().add_history("Zipped Folder", f"Served {name}")
-                return
+    def _queue(self, name):
+        with self.lock:
+            if name in self.queued: return
+            self.queued.add(name)
+        HASH_POOL.submit(self._hash, name)
 
-            try:
-                sz = os.path.getsize(path)
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/octet-stream')
-                self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(path)}"')
-                self.send_header('Content-Length', str(sz))
-                self.end_headers()
-                with open(path, 'rb') as f:
-                    shutil.copyfileobj(f, self.wfile)
-                
-                AppManager.get().add_history("File Sent", os.path.basename(path))
-            except Exception as e:
-                pass
+    def _hash(self, name):
+        path = os.path.join(self.directory, name)
+        try:
+            before = os.stat(path)
+            digest = sha256_file(path)
+            after = os.stat(path)
+        except OSError:
             return
+        finally:
+            with self.lock:
+                self.queued.discard(name)
+        if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+            return  # Still being written; the next rescan picks it up.
+        with self.lock:
+            self._set(name, after.st_size, after.st_mtime_ns, digest)
+        self._schedule_save()
 
-    def do_POST(self):
-        if not self.check_auth(): return
-        
+    def refresh(self, force=False):
+        """Forget vanished files and queue unindexed ones, at most every HASH_INDEX_RESCAN seconds."""
+        if not force and time.time() - self.scanned < HASH_INDEX_RESCAN: return
+        self.scanned = time.time()
+        seen, unindexed = set(), []
         try:
-            logging.error("DEBUG: Starting POST request")
-            ct = self.headers.get('Content-Type')
-            files = []
-            
-            if cgi:
-                env = {'REQUEST_METHOD':'POST', 'CONTENT_TYPE':ct}
-                fs = cgi.FieldStorage(fp=self.rfile, headers=self.headers, environ=env)
-                if 'file' in fs:
-                    fl = fs['file']
-                    files = fl if isinstance(fl, list) else [fl]
-            else:
-                 res = parse_multipart_rfile(self.rfile, self.headers)
-                 if 'file' in res:
-                     files = res['file'] if isinstance(res['file'], list) else [res['file']]
-            
-            logging.error(f"DEBUG: Found {len(files)} files to process")
-            count = 0
-            total_files = len(files)
-            for i, item in enumerate(files):
-                pct = int(((i) / total_files) * 50)
-                AppManager.get().update_progress(pct)
-                
-                fname = getattr(item, 'filename', None)
-                if not fname: 
-                    logging.error("DEBUG: Skipped item with no filename")
-                    continue
-                fname = os.path.basename(fname)
-                
-                # Determine destination
-                target_dir = get_real_upload_dir()
-                dest = os.path.join(target_dir, fname)
-                logging.error(f"DEBUG: Attempting to write file to: {dest}")
-                
-                try:
-                    with open(dest, 'wb') as f:
-                        if hasattr(item, 'file'):
-                            item.file.seek(0)
-                            # Optimised large file copy
-                            fsrc = item.file
-                            fdst = f
-                            length = 1024*1024 # 1MB buffer
-                            copied = 0
-                            while True:
-                                buf = fsrc.read(length)
-                                if not buf:
-                                    break
-                                fdst.write(buf)
-                                copied += len(buf)
-                            logging.error(f"DEBUG: Streamed {copied} bytes to {dest}")
-                        else:
-                            content = item.value if isinstance(item.value, bytes) else item.value.encode()
-                            f.write(content)
-                            logging.error(f"DEBUG: Wrote {len(content)} bytes to {dest}")
-                except Exception as e:
-                    logging.error(f"DEBUG: FAILED to write file {dest}: {e}")
-                    raise e
-                
-                count += 1
-                AppManager.get().update_progress(int(((i+1)/total_files)*100))
-                AppManager.get().add_history("File Received", fname)
-                AppManager.get().send_notification("New File Received", f"{fname}")
-            
-            AppManager.get().update_progress(0) # Reset
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.startswith('.') or not entry.is_file(): continue
+                    seen.add(entry.name)
+                    with self.lock:
+                        if not self._current(entry.name, entry.stat()): unindexed.append(entry.name)
+        except OSError as e:
+            logging.error(f"DEBUG: Hash index scan of {self.directory} failed: {e}")
+            return
+        with self.lock:
+            for name in [n for n in self.files if n not in seen]:
+                self._drop(name)
+        for name in unindexed:
+            self._queue(name)
 
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"Success")
-        except Exception as e:
-            logging.error(f"DEBUG: POST Error: {e}")
-            self.send_error(500, str(e))
+    def cached_digest(self, name, size, mtime):
+        """Indexed digest of ``name`` if it matches ``size`` and float ``mtime``."""
+        with self.lock:
+            hit = self.files.get(name)
+        if hit and hit[0] == size and abs(hit[1] / 1e9 - mtime) < 1e-3:
+            return hit[2]
+        return None
 
-class ReusableTCPServer(socketserver.ThreadingTCPServer):
-    allow_reuse_address = True
-    daemon_threads = True
+    def sizes(self):
+        """Sizes of the indexed files; only uploads of these sizes can be duplicates."""
+        with self.lock:
+            return {size for size, _, _ in self.files.values()}
 
-    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
-        print("Initializing ReusableTCPServer with reuse_address=True")
-        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+    def find(self, digest, size, prefer=None):
+        """Name of a file currently holding ``digest`` content (``prefer`` first), or None."""
+        with self.lock:
+            names = sorted(self.by_digest.get(digest, ()), key=lambda n: n != prefer)
+        for name in names:
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            with self.lock:
+                if st.st_size == size and self._current(name, st): return name
+        return None
 
-class ServerThread(threading.Thread):
-    def __init__(self, port, pwd):
-        super().__init__(daemon=True)
-        self.port = port
+    def _schedule_save(self):
+        # Bursts of uploads coalesce into one write of the index.
+        with self.lock:
+            if self.save_timer: return
+            self.save_timer = threading.Timer(HASH_INDEX_SAVE_DELAY, self.save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def save(self):
+        with self.lock:
+            self.save_timer = None
+            state = {"version": 1, "files": {name: list(v) for name, v in self.files.items()}}
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error(f"DEBUG: Could not save hash index: {e}")
+
+    def link(self, src_name, dest_name, digest):
+        """Make ``dest_name`` hold the same content as ``src_name``.
+
+        Hard links cost no space; where the filesystem has none (Android's
+        shared storage), the file is copied locally instead. Linked names
+        stay independent because nothing rewrites an upload target in
+        place: every write lands in a new temp file renamed over the name.
+        """
+        src = os.path.join(self.directory, src_name)
+        dest = os.path.join(self.directory, dest_name)
+        tmp = f"{dest}.{secrets.token_hex(4)}.tmp"
+        try:
+            os.link(src, tmp)
+            how = "linked"
+        except OSError:
+            shutil.copyfile(src, tmp)
+            how = "copied"
+        os.replace(tmp, dest)
+        if os.path.lexists(tmp):
+            # rename() is a no-op when both names are links to one file.
+            os.remove(tmp)
+        publish_file(dest)
+        self.add(dest_name, digest)
+        return how
+
+
+_hash_indexes = {}
+_hash_indexes_lock = threading.Lock()
+
+
+def get_hash_index(directory):
+    with _hash_indexes_lock:
+        index = _hash_indexes.get(directory)
+        if index is None:
+            index = _hash_indexes[directory] = HashIndex(directory)
+        return index
+
+
+# --- Directory Listings ---
+LISTING_CACHE_BYTES = 8 * 1024 * 1024
+# Directories changed this recently (seconds) are not cached: coarse mtime
+# granularity on FUSE storage could otherwise hide a second change.
+LISTING_CACHE_SETTLE = 2
+
+
+def scan_directory(path):
+    """List ``path`` in one os.scandir pass as sorted (name, is_dir, size, mtime) tuples."""
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                is_dir = entry.is_dir()
+                st = entry.stat()
+                entries.append((entry.name, is_dir, 0 if is_dir else st.st_size, st.st_mtime))
+            except OSError:
+                # Broken symlinks and vanished files still get a row.
+                entries.append((entry.name, False, 0, 0))
+    entries.sort()
+    return entries
+
+
+class ListingCache:
+    """LRU of per-path values, each valid for one mtime (or other version key).
+
+    Entries are evicted least-recently-used first once their summed ``cost``
+    exceeds ``max_bytes``. The most recent entry is always kept, even alone
+    over budget, so one very large directory still gets cached.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+
+    def get(self, path, mtime_ns):
+        with self.lock:
+            hit = self.entries.get(path)
+            if hit is None: return None
+            if hit[0] != mtime_ns:
+                self._drop(path)
+                return None
+            self.entries.move_to_end(path)
+            return hit[1]
+
+    def put(self, path, mtime_ns, value, cost):
+        with self.lock:
+            if path in self.entries: self._drop(path)
+            self.entries[path] = (mtime_ns, value, cost)
+            self.size += cost
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self._drop(next(iter(self.entries)))
+
+    def _drop(self, path):
+        self.size -= self.entries.pop(path)[2]
+
+
+LISTING_CACHE = ListingCache(LISTING_CACHE_BYTES)
+
+
+class DirectoryListing:
+    """One scanned directory plus lazily built sort orders for paging."""
+
+    SORT_KEYS = {
+        'name': lambda e: (e[0],),
+        'size': lambda e: (e[2], e[0]),
+        'mtime': lambda e: (e[3], e[0]),
+    }
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.views = {}
+
+    @property
+    def cost(self):
+        # Each sort view adds a list slot and a key tuple per entry.
+        n = len(self.entries)
+        return sum(len(e[0]) for e in self.entries) + 160 * n + 72 * n * len(self.views)
+
+    def view(self, sort):
+        v = self.views.get(sort)
+        if v is None:
+            key = self.SORT_KEYS[sort]
+            entries = self.entries if sort == 'name' else sorted(self.entries, key=key)
+            v = self.views[sort] = (entries, [key(e) for e in entries])
+        return v
+
+
+def get_directory_listing(path, sort=None):
+    """The cached listing of ``path``, with the ``sort`` view built if given.
+
+    Building a view grows the listing, so it is put back at its new cost.
+    """
+    st = os.stat(path)
+    listing = LISTING_CACHE.get(path, st.st_mtime_ns)
+    changed = listing is None
+    if changed: listing = DirectoryListing(scan_directory(path))
+    if sort is not None and sort not in listing.views:
+        listing.view(sort)
+        changed = True
+    if changed and time.time() - st.st_mtime > LISTING_CACHE_SETTLE:
+        LISTING_CACHE.put(path, st.st_mtime_ns, listing, listing.cost)
+    return listing
+
+
+LIST_PAGE_DEFAULT = 200
+LIST_PAGE_MAX = 1000
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        return tuple(json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))))
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def list_page(path, sort='name', order='asc', limit=LIST_PAGE_DEFAULT, cursor=None):
+    """Return one page of ``path`` for /api/list.
+
+    Cursors carry the sort key of the last row sent rather than an offset,
+    so paging stays consistent when files are added or removed meanwhile.
+    """
+    if sort not in DirectoryListing.SORT_KEYS: raise ValueError(f"Unknown sort {sort!r}")
+    if order not in ('asc', 'desc'): raise ValueError(f"Unknown order {order!r}")
+    limit = max(1, min(int(limit), LIST_PAGE_MAX))
+    entries, keys = get_directory_listing(path, sort).view(sort)
+    after = decode_cursor(cursor) if cursor else None
+
+    try:
+        if order == 'asc':
+            start = bisect.bisect_right(keys, after) if after else 0
+            end = min(start + limit, len(entries))
+            page = entries[start:end]
+            more = end < len(entries)
+        else:
+            end = bisect.bisect_left(keys, after) if after else len(entries)
+            start = max(0, end - limit)
+            page = entries[start:end][::-1]
+            more = start > 0
+    except TypeError:
+        # A cursor issued for a different sort order.
+        raise ValueError("Invalid cursor")
+
+    key = DirectoryListing.SORT_KEYS[sort]
+    rows = [{"name": n, "dir": d, "size": s, "mtime": m} for n, d, s, m in page]
+    # Folder rows get recursive totals from the search index's walker.
+    base = None
+    for row in rows:
+        if not row["dir"]: continue
+        base = base or os.path.realpath(path)
+        total = SEARCH.folder_total(os.path.join(base, row["name"]), row["mtime"])
+        if total: row["size"], row["files"] = total
+    return {
+        "path": path,
+        "total": len(entries),
+        "entries": rows,
+        "next": encode_cursor(key(page[-1])) if more and page else None,
+    }
+
+
+# --- Transfer Digests ---
+# Uploads may carry the digest the sender computed, and are dropped when what
+# arrived hashes differently; downloads carry Repr-Digest (RFC 9530) so the
+# receiver can check the same. Uploads are hashed as the bytes stream past
+# rather than in a second read; downloads keep sendfile, so files are hashed
+# separately on HASH_POOL. The fast algorithm is xxh3-128 when xxhash is
+# installed, else BLAKE2b; SHA-256 is always accepted since uploads compute
+# it for deduplication anyway. Known digests are cached per path and mtime.
+DIGEST_FACTORIES = {
+    'sha-256': hashlib.sha256,
+    'sha-512': hashlib.sha512,
+    'blake2b-256': lambda: hashlib.blake2b(digest_size=32),
+}
+if xxhash is not None:
+    DIGEST_FACTORIES['xxh3-128'] = xxhash.xxh3_128
+FAST_DIGEST = 'xxh3-128' if xxhash is not None else 'blake2b-256'
+# Full downloads of files without a known digest are hashed in the background
+# afterwards, so the first response has none but the body still goes through
+# sendfile. Those digests are persisted in the app cache directory, so that
+# happens once per file version rather than again after every restart.
+DOWNLOAD_DIGESTS = True
+DIGEST_CACHE = ListingCache(4 * 1024 * 1024)
+DIGEST_STORE_MAX = 50000
+
+
+class DigestMismatch(ValueError):
+    """Answered with 422, which clients treat as worth a retry."""
+
+
+def parse_digests(value):
+    """``{algorithm: digest bytes}`` from a Repr-Digest / Content-Digest
+    header (``sha-256=:base64:``) or a legacy Digest one (``SHA-256=base64``).
+
+    Algorithms this server can't compute are left out.
+    """
+    digests = {}
+    for member in (value or '').split(','):
+        alg, sep, encoded = member.strip().partition('=')
+        alg = alg.strip().lower()
+        if not sep or alg not in DIGEST_FACTORIES: continue
+        encoded = encoded.split(';')[0].strip()
+        if encoded.startswith(':') and encoded.endswith(':'): encoded = encoded[1:-1]
+        try:
+            digests[alg] = base64.b64decode(encoded, validate=True)
+        except ValueError:
+            raise ValueError(f"Malformed {alg} digest")
+    return digests
+
+
+def format_digests(digests):
+    return ', '.join(f"{alg}=:{base64.b64encode(value).decode()}:" for alg, value in sorted(digests.items()))
+
+
+def wanted_digest(value):
+    """The algorithm a Want-Repr-Digest header (``sha-256=10, ...``) ranks highest."""
+    best, best_weight = FAST_DIGEST, 0
+    for member in (value or '').split(','):
+        alg, _, weight = member.strip().partition('=')
+        try:
+            weight = int(weight)
+        except ValueError:
+            continue
+        if alg.lower() in DIGEST_FACTORIES and weight > best_weight:
+            best, best_weight = alg.lower(), weight
+    return best
+
+
+class StreamDigests:
+    """Running hashes for a set of algorithms, fed as data streams past."""
+
+    def __init__(self, algorithms):
+        self.hashers = {alg: DIGEST_FACTORIES[alg]() for alg in algorithms}
+
+    def update(self, data):
+        for h in self.hashers.values():
+            h.update(data)
+
+    def digests(self):
+        return {alg: h.digest() for alg, h in self.hashers.items()}
+
+    def verify(self, expected):
+        for alg, value in expected.items():
+            if self.hashers[alg].digest() != value:
+                raise DigestMismatch(f"{alg} digest mismatch")
+
+
+class DigestStore:
+    """Digests of downloaded files, persisted across restarts.
+
+    Entries are keyed by path and only trusted while the file's size and
+    mtime match; the least recently stored go beyond ``max_entries``.
+    """
+
+    def __init__(self, path=None, max_entries=DIGEST_STORE_MAX):
+        self._path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.files = None  # path -> [mtime_ns, size, {alg: hex}], loaded on first use
+        self.save_timer = None
+
+    @property
+    def path(self):
+        return self._path or app_cache_dir('digests.json')
+
+    def _load(self):
+        if self.files is not None: return
+        self.files = collections.OrderedDict()
+        try:
+            with open(self.path) as f:
+                self.files.update(json.load(f).get("files", {}))
+        except (OSError, ValueError, TypeError, AttributeError):
+            pass
+
+    def get(self, path, st):
+        with self.lock:
+            self._load()
+            hit = self.files.get(path)
+        if not hit or hit[:2] != [st.st_mtime_ns, st.st_size]: return {}
+        return {alg: bytes.fromhex(v) for alg, v in hit[2].items() if alg in DIGEST_FACTORIES}
+
+    def put(self, path, st, digests):
+        with self.lock:
+            self._load()
+            self.files.pop(path, None)
+            self.files[path] = [st.st_mtime_ns, st.st_size, {alg: v.hex() for alg, v in digests.items()}]
+            while len(self.files) > self.max_entries:
+                self.files.popitem(last=False)
+            if self.save_timer: return
+            # A burst of downloads coalesces into one write.
+            self.save_timer = threading.Timer(HASH_INDEX_SAVE_DELAY, self.save)
+            self.save_timer.daemon = True
+            self.save_timer.start()
+
+    def save(self):
+        with self.lock:
+            self.save_timer = None
+            state = {"version": 1, "files": dict(self.files or {})}
+        tmp = f"{self.path}.{secrets.token_hex(4)}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error(f"DEBUG: Could not save digest store: {e}")
+
+
+DIGEST_STORE = DigestStore()
+
+
+def cached_digests(path, st):
+    version = (st.st_mtime_ns, st.st_size)
+    digests = DIGEST_CACHE.get(path, version)
+    if digests is None:
+        digests = DIGEST_STORE.get(path, st)
+        if digests: DIGEST_CACHE.put(path, version, digests, len(path) + 64 * len(digests))
+    return digests or {}
+
+
+def remember_digests(path, digests, st=None, persist=False):
+    """Merge ``digests`` of ``path`` into the cache, valid for its current
+    mtime; with ``persist`` also into DIGEST_STORE."""
+    try:
+        st = st or os.stat(path)
+    except OSError:
+        return
+    merged = dict(cached_digests(path, st), **digests)
+    DIGEST_CACHE.put(path, (st.st_mtime_ns, st.st_size), merged, len(path) + 64 * len(merged))
+    if persist: DIGEST_STORE.put(path, st, merged)
+
+
+def known_digests(path, st):
+    """Cached digests of ``path``, plus its SHA-256 from an upload hash index."""
+    digests = cached_digests(path, st)
+    if 'sha-256' not in digests:
+        with _hash_indexes_lock:
+            index = _hash_indexes.get(os.path.dirname(path))
+        digest = index and index.cached_digest(os.path.basename(path), st.st_size, st.st_mtime)
+        if digest: digests = dict(digests, **{'sha-256': bytes.fromhex(digest)})
+    return digests
+
+
+def hash_file(path, algorithms):
+    """Hash ``path`` in one read, for digests that could not be streamed."""
+    hashes = StreamDigests(algorithms)
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(HASH_READ_SIZE)
+            if not data: break
+            hashes.update(data)
+    return hashes
+
+
+# Digests a client asked for that nobody knows yet (segmented pulls only make
+# Range requests, which are never hashed on the way out) are computed on
+# HASH_POOL, one job per file version; a HEAD for the file waits on it.
+_digest_jobs = {}
+_digest_jobs_lock = threading.Lock()
+
+
+def digest_in_background(path, st, algorithms):
+    """Queue hashing of ``path`` and return the job's future.
+
+    The digests are remembered (and persisted) if the file is still the
+    version ``st`` describes when the job is done.
+    """
+    key = (path, st.st_mtime_ns, st.st_size, frozenset(algorithms))
+    with _digest_jobs_lock:
+        job = _digest_jobs.get(key)
+        if job is None:
+            job = _digest_jobs[key] = HASH_POOL.submit(_digest_job, key, st)
+    return job
+
+
+def _digest_job(key, st):
+    path, algorithms = key[0], key[3]
+    try:
+        digests = hash_file(path, algorithms).digests()
+        after = os.stat(path)
+        if (after.st_mtime_ns, after.st_size) == (st.st_mtime_ns, st.st_size):
+            remember_digests(path, digests, st, persist=True)
+        return digests
+    finally:
+        with _digest_jobs_lock:
+            _digest_jobs.pop(key, None)
+
+
+# --- Zip Streaming ---
+# Folder archives are written by hand rather than through zipfile so that
+# each entry can pick its own method and deflate work can run in a thread
+# pool ahead of the socket. zlib releases the GIL, so blocks compress in
+# parallel while the writer sends what is already done.
+ZIP_COMPRESS_LEVEL = 6
+ZIP_WORKERS = min(8, os.cpu_count() or 2)
+ZIP_BLOCK_SIZE = 1024 * 1024
+# Blocks read ahead of the writer, bounding memory at about twice this many MB.
+ZIP_READAHEAD = 2 * ZIP_WORKERS
+# Files with these extensions are already compressed and are stored as-is.
+ZIP_STORED_EXTENSIONS = frozenset(
+    '.jpg .jpeg .png .gif .webp .heic .heif .avif '
+    '.mp4 .m4v .mkv .mov .avi .webm .3gp .mp3 .m4a .aac .ogg .opus .flac '
+    '.zip .gz .tgz .bz2 .xz .zst .7z .rar .apk .jar .docx .xlsx .pptx .epub'.split())
+# Other files are stored when their first ZIP_PROBE_SIZE bytes barely shrink.
+ZIP_PROBE_SIZE = 64 * 1024
+ZIP_PROBE_RATIO = 0.95
+ZIP64_LIMIT = (1 << 32) - 1
+
+# Folders whose bytes are at least this share already-compressed media (by
+# extension) are sent as a stored zip of known size, which can be resumed.
+ZIP_STORED_SHARE = 0.9
+# Optional on-disk cache of built archives; None disables it.
+ZIP_CACHE_DIR = None
+ZIP_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+
+_zip_pool = None
+_zip_pool_lock = threading.Lock()
+
+
+def get_zip_pool():
+    global _zip_pool
+    with _zip_pool_lock:
+        if _zip_pool is None:
+            _zip_pool = concurrent.futures.ThreadPoolExecutor(ZIP_WORKERS, thread_name_prefix='zip')
+        return _zip_pool
+
+
+def walk_files(path):
+    """Yield ``(path, arcname, stat)`` for files under ``path`` in a stable order.
+
+    Files of a directory come before its subdirectories, both sorted by
+    name; arcnames are relative to the parent of ``path``.
+    """
+    base = os.path.dirname(path)
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        logging.error(f"DEBUG: Cannot scan {path}: {e}")
+        return
+    dirs = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                dirs.append(entry.path)
+            elif entry.is_file():
+                yield entry.path, os.path.relpath(entry.path, base), entry.stat()
+        except OSError as e:
+            logging.error(f"DEBUG: Skipping {entry.path}: {e}")
+    for sub in dirs:
+        for fn, arcname, st in walk_files(sub):
+            yield fn, os.path.join(os.path.basename(path), arcname), st
+
+
+def is_compressible(path, f):
+    """Guess whether deflating ``f`` is worth the CPU, from its name and a sample."""
+    if os.path.splitext(path)[1].lower() in ZIP_STORED_EXTENSIONS:
+        return False
+    sample = f.read(ZIP_PROBE_SIZE)
+    f.seek(0)
+    if len(sample) < 512:
+        return True
+    return len(zlib.compress(sample, 1)) < len(sample) * ZIP_PROBE_RATIO
+
+
+def _deflate_block(data, level):
+    # A sync flush ends each block on a byte boundary with no final bit, so
+    # independently compressed blocks concatenate into one raw deflate stream.
+    start = time.thread_time()
+    c = zlib.compressobj(level, zlib.DEFLATED, -15)
+    out = c.compress(data) + c.flush(zlib.Z_SYNC_FLUSH)
+    METRICS.inc('zip_deflate_seconds', value=time.thread_time() - start)
+    METRICS.inc('zip_deflate_in', value=len(data))
+    METRICS.inc('zip_deflate_out', value=len(out))
+    return out
+
+
+# Empty final block (BFINAL=1, fixed Huffman) that closes a block sequence.
+_DEFLATE_END = b'\x03\x00'
+
+
+def _dos_time(mtime):
+    t = time.localtime(max(mtime, 315532800))
+    return ((t.tm_year - 1980) << 9 | t.tm_mon << 5 | t.tm_mday,
+            t.tm_hour << 11 | t.tm_min << 5 | t.tm_sec // 2)
+
+
+class ZipEntry:
+    __slots__ = ('arcname', 'method', 'zip64', 'date', 'time', 'offset', 'crc', 'csize', 'usize')
+
+    def __init__(self, arcname, method, mtime, size, offset):
+        self.arcname = arcname.replace(os.sep, '/').encode('utf-8')
+        self.method = method
+        # Same heuristic as zipfile: sizes are not known until the data is sent.
+        self.zip64 = size * 1.05 > ZIP64_LIMIT
+        self.date, self.time = _dos_time(mtime)
+        self.offset = offset
+        self.crc = self.csize = self.usize = 0
+
+    @property
+    def flags(self):
+        # Sizes and CRC follow the data in a descriptor; names are UTF-8.
+        return 0x08 | (0x800 if not self.arcname.isascii() else 0)
+
+    @property
+    def version(self):
+        return 45 if self.zip64 else 20
+
+    def local_header(self):
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if self.zip64 else b''
+        return struct.pack('<4sHHHHHLLLHH', b'PK\x03\x04', self.version, self.flags, self.method,
+                           self.time, self.date, 0, 0, 0, len(self.arcname), len(extra)) + self.arcname + extra
+
+    def descriptor(self):
+        fmt = '<4sLQQ' if self.zip64 else '<4sLLL'
+        return struct.pack(fmt, b'PK\x07\x08', self.crc, self.csize, self.usize)
+
+    def central_header(self):
+        fields = [v for v in (self.usize, self.csize, self.offset) if v >= ZIP64_LIMIT]
+        extra = struct.pack('<HH%dQ' % len(fields), 1, 8 * len(fields), *fields) if fields else b''
+        clamp = lambda v: min(v, ZIP64_LIMIT)
+        return struct.pack('<4sHHHHHHLLLHHHHHLL', b'PK\x01\x02', self.version, self.version, self.flags,
+                           self.method, self.time, self.date, self.crc, clamp(self.csize), clamp(self.usize),
+                           len(self.arcname), len(extra), 0, 0, 0, 0, clamp(self.offset)) + self.arcname + extra
+
+
+class ZipStreamer:
+    """Write a zip archive to a non-seekable stream.
+
+    Already-compressed files are stored; the rest are deflated in
+    ZIP_BLOCK_SIZE blocks on the shared zip pool, up to ZIP_READAHEAD blocks
+    ahead of the writer. ``level`` 0 stores everything. ``progress``, if
+    given, is called with each count of file bytes consumed.
+    """
+
+    def __init__(self, out, level=ZIP_COMPRESS_LEVEL, progress=None):
+        self.out = out
+        self.level = level
+        self.progress = progress
+        self.offset = 0
+        self.entries = []
+
+    def _write(self, data):
+        self.out.write(data)
+        self.offset += len(data)
+
+    def _jobs(self, files):
+        # Yields the write plan in order; deflate blocks are submitted as
+        # they are yielded, which is what keeps the pool ahead of the writer.
+        pool = get_zip_pool()
+        for path, arcname in files:
+            try:
+                f = open(path, 'rb')
+                st = os.fstat(f.fileno())
+            except OSError as e:
+                logging.error(f"DEBUG: Skipping {path} in zip: {e}")
+                continue
+            deflate = self.level > 0 and is_compressible(path, f)
+            entry = ZipEntry(arcname, zipfile.ZIP_DEFLATED if deflate else zipfile.ZIP_STORED,
+                             st.st_mtime, st.st_size, 0)
+            yield 'start', entry
+            if not deflate:
+                # The writer copies and closes it, so planning can run ahead.
+                yield 'copy', f
+            else:
+                with f:
+                    while True:
+                        data = f.read(ZIP_BLOCK_SIZE)
+                        if not data: break
+                        yield 'block', (data, pool.submit(_deflate_block, data, self.level))
+            yield 'end', entry
+
+    def write_files(self, files):
+        """Add ``(path, arcname)`` pairs, in order."""
+        pending = collections.deque()
+        jobs = self._jobs(files)
+        try:
+            while True:
+                while len(pending) < ZIP_READAHEAD:
+                    job = next(jobs, None)
+                    if job is None: break
+                    pending.append(job)
+                if not pending: break
+                kind, arg = pending.popleft()
+                if kind == 'start':
+                    entry = arg
+                    entry.offset = self.offset
+                    self._write(entry.local_header())
+                    start = self.offset
+                elif kind == 'copy':
+                    with arg:
+                        while True:
+                            data = arg.read(ZIP_BLOCK_SIZE)
+                            if not data: break
+                            entry.crc = zlib.crc32(data, entry.crc)
+                            entry.usize += len(data)
+                            self._write(data)
+                            if self.progress: self.progress(len(data))
+                    METRICS.inc('zip_stored', value=entry.usize)
+                elif kind == 'block':
+                    data, future = arg
+                    entry.crc = zlib.crc32(data, entry.crc)
+                    entry.usize += len(data)
+                    self._write(future.result())
+                    if self.progress: self.progress(len(data))
+                else:
+                    if entry.method == zipfile.ZIP_DEFLATED:
+                        self._write(_DEFLATE_END)
+                    entry.csize = self.offset - start
+                    if not entry.zip64 and max(entry.csize, entry.usize) >= ZIP64_LIMIT:
+                        raise zipfile.LargeZipFile(f"{entry.arcname!r} grew past 4 GiB while zipping")
+                    self._write(entry.descriptor())
+                    self.entries.append(entry)
+        finally:
+            for kind, arg in pending:
+                if kind == 'block': arg[1].cancel()
+                if kind == 'copy': arg.close()
+            jobs.close()
+
+    def write_tree(self, path):
+        """Add every file under directory ``path``, named relative to its parent."""
+        self.write_files((fn, arcname) for fn, arcname, st in walk_files(path))
+
+    def close(self):
+        """Write the central directory."""
+        self._write(central_directory(self.entries, self.offset))
+        self.out.flush()
+
+
+def central_directory(entries, offset):
+    """Central directory and end records for ``entries``, starting at ``offset``."""
+    out = [entry.central_header() for entry in entries]
+    cd_size = sum(len(b) for b in out)
+    count = len(entries)
+    if count >= 0xFFFF or offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        out.append(struct.pack('<4sQHHLLQQQQ', b'PK\x06\x06', 44, 45, 45, 0, 0,
+                               count, count, cd_size, offset))
+        out.append(struct.pack('<4sLQL', b'PK\x06\x07', 0, offset + cd_size, 1))
+    out.append(struct.pack('<4sHHHHLLH', b'PK\x05\x06', 0, 0, min(count, 0xFFFF), min(count, 0xFFFF),
+                           min(cd_size, ZIP64_LIMIT), min(offset, ZIP64_LIMIT), 0))
+    return b''.join(out)
+
+
+# CRC-32s of files already read, keyed by path and valid for one (mtime, size).
+ZIP_CRC_CACHE = ListingCache(4 * 1024 * 1024)
+
+
+def file_crc(path, size, mtime_ns):
+    """CRC-32 of the first ``size`` bytes of ``path``, cached per mtime."""
+    version = (mtime_ns, size)
+    crc = ZIP_CRC_CACHE.get(path, version)
+    if crc is not None: return crc
+    crc = 0
+    with open(path, 'rb') as f:
+        remaining = size
+        while remaining:
+            data = f.read(min(remaining, ZIP_BLOCK_SIZE))
+            if not data: raise OSError(f"{path} shrank while zipping")
+            crc = zlib.crc32(data, crc)
+            remaining -= len(data)
+    ZIP_CRC_CACHE.put(path, version, crc, len(path) + 64)
+    return crc
+
+
+class _CrcFeed:
+    """CRC-32 of the data passed to ``update``, in the shape of a hasher."""
+
+    def __init__(self):
+        self.crc = 0
+
+    def update(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+
+
+class ArchiveLayout:
+    """An archive planned up front as ``(offset, length, kind, arg)`` segments.
+
+    'file' segments are regions of ``self.files[arg][0]`` sent from disk;
+    'bytes' segments carry their data; other kinds are rendered by
+    ``_render`` when reached. Subclasses fill ``files``, ``segments``,
+    ``size``, ``mtime`` and ``signature``, and extend ``_render`` for any
+    kinds of their own.
+    """
+
+    def _render(self, kind, arg):
+        raise ValueError(f"Unknown archive segment kind {kind!r}")
+
+    def _file_started(self, index, whole):
+        """Called before file ``index`` is sent (all of it if ``whole``);
+        may return a hasher-like object to feed the bytes going out."""
+        return None
+
+    def _file_read(self, index, crc):
+        pass
+
+    def write_range(self, handler, start, stop, tee=None, progress=None):
+        """Send archive bytes ``[start, stop)`` through ``handler``.
+
+        With ``tee`` (a writable), file data is read in Python and copied to
+        it as well; otherwise it goes out with ``handler.send_file_range``.
+        ``progress`` is called with the size of each file segment sent.
+        """
+        write = handler.wfile.write
+        for seg_start, length, kind, arg in self.segments:
+            if seg_start + length <= start or seg_start >= stop or not length:
+                continue
+            a, b = max(start, seg_start) - seg_start, min(stop, seg_start + length) - seg_start
+            if kind == 'file':
+                fn = self.files[arg][0]
+                with open(fn, 'rb') as f:
+                    if tee is None:
+                        feed = self._file_started(arg, (a, b) == (0, length))
+                        handler.send_file_range(f, a, b - a, feed)
+                        if progress: progress(b - a)
+                        if feed is not None: self._file_read(arg, feed.crc)
+                        continue
+                    f.seek(a)
+                    crc, remaining = 0, b - a
+                    while remaining:
+                        data = f.read(min(remaining, ZIP_BLOCK_SIZE))
+                        if not data: raise OSError(f"{fn} shrank while sending")
+                        crc = zlib.crc32(data, crc)
+                        if handler.pace: handler.pace(len(data))
+                        write(data)
+                        tee.write(data)
+                        remaining -= len(data)
+                        if progress: progress(len(data))
+                if (a, b) == (0, length):
+                    self._file_read(arg, crc)
+                continue
+            data = arg if kind == 'bytes' else self._render(kind, arg)
+            write(data[a:b])
+            if tee is not None: tee.write(data[a:b])
+
+
+class ZipLayout(ArchiveLayout):
+    """Byte-exact plan of a stored zip of a directory tree.
+
+    Offsets and the total size come from one stat pass, so the archive can be
+    sent with a Content-Length and any byte range of it served on its own.
+    CRCs, which only the descriptors and central directory need, are read
+    lazily on the zip pool and cached.
+    """
+
+    def __init__(self, path):
+        self.files = []
+        self.segments = []
+        self.mtime = 0
+        self.compressed_bytes = self.data_bytes = 0
+        digest = hashlib.sha256(path.encode('utf-8', 'surrogateescape'))
+        offset = 0
+        # The signature is the strong validator for resumes, so it covers
+        # every member's identity, not just the newest mtime.
+        for fn, arcname, st in walk_files(path):
+            entry = ZipEntry(arcname, zipfile.ZIP_STORED, st.st_mtime, st.st_size, offset)
+            entry.csize = entry.usize = st.st_size
+            index = len(self.files)
+            self.files.append((fn, arcname, st, entry))
+            for kind, length, arg in (('bytes', None, entry.local_header()),
+                                      ('file', st.st_size, index),
+                                      ('desc', len(entry.descriptor()), index)):
+                length = len(arg) if length is None else length
+                self.segments.append((offset, length, kind, arg))
+                offset += length
+            digest.update(f"{arcname}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}\n".encode('utf-8', 'surrogateescape'))
+            self.mtime = max(self.mtime, st.st_mtime)
+            self.data_bytes += st.st_size
+            if os.path.splitext(fn)[1].lower() in ZIP_STORED_EXTENSIONS:
+                self.compressed_bytes += st.st_size
+        self.central_offset = offset
+        central_length = len(central_directory([f[3] for f in self.files], offset))
+        self.segments.append((offset, central_length, 'central', None))
+        self.size = offset + central_length
+        digest.update(f"{len(self.files)}".encode())
+        self.signature = digest.hexdigest()[:32]
+        self.crcs = {}
+
+    def _crc(self, index):
+        future = self.crcs.get(index)
+        if future is None:
+            fn, arcname, st, entry = self.files[index]
+            future = self.crcs[index] = get_zip_pool().submit(file_crc, fn, st.st_size, st.st_mtime_ns)
+        return future
+
+    def _entry(self, index):
+        entry = self.files[index][3]
+        entry.crc = self._crc(index).result()
+        return entry
+
+    def _file_started(self, index, whole):
+        # The descriptor right after the file needs its CRC. A known one lets
+        # the file go by sendfile; a file sent whole otherwise gets it from
+        # the bytes going out, so it is read once. Only a partial send reads
+        # it again, alongside, on the zip pool.
+        if index in self.crcs: return None
+        fn, arcname, st, entry = self.files[index]
+        crc = ZIP_CRC_CACHE.get(fn, (st.st_mtime_ns, st.st_size))
+        if crc is not None:
+            self._file_read(index, crc)
+        elif whole:
+            return _CrcFeed()
+        else:
+            self._crc(index)
+        return None
+
+    def _file_read(self, index, crc):
+        if index not in self.crcs:
+            done = self.crcs[index] = concurrent.futures.Future()
+            done.set_result(crc)
+            fn, arcname, st, entry = self.files[index]
+            ZIP_CRC_CACHE.put(fn, (st.st_mtime_ns, st.st_size), crc, len(fn) + 64)
+
+    def _render(self, kind, arg):
+        if kind == 'desc':
+            return self._entry(arg).descriptor()
+        if kind == 'central':
+            return central_directory([self._entry(i) for i in range(len(self.files))], self.central_offset)
+        return super()._render(kind, arg)
+
+    def write_range(self, handler, start, stop, tee=None, progress=None):
+        if stop > self.central_offset:
+            # Files outside the range are not read for sending, so start their
+            # CRCs now; the central directory at the end needs all of them.
+            for seg_start, length, kind, index in self.segments:
+                if kind == 'file' and (seg_start + length <= start or seg_start >= stop):
+                    self._crc(index)
+        super().write_range(handler, start, stop, tee, progress)
+
+
+class ZipCacheWriter:
+    """Writes an archive next to its final cache path and publishes it on commit."""
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp = f"{path}.{secrets.token_hex(4)}.tmp"
+        self.f = open(self.tmp, 'wb')
+
+    def write(self, data):
+        self.f.write(data)
+        return len(data)
+
+    def commit(self):
+        self.f.close()
+        os.replace(self.tmp, self.path)
+        prune_zip_cache()
+
+    def abort(self):
+        self.f.close()
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+class _TeeWriter:
+    def __init__(self, out, copy):
+        self.out = out
+        self.copy = copy
+
+    def write(self, data):
+        self.copy.write(data)
+        return self.out.write(data)
+
+    def flush(self):
+        self.out.flush()
+
+
+def zip_cache_path(key):
+    if not ZIP_CACHE_DIR: return None
+    try:
+        os.makedirs(ZIP_CACHE_DIR, exist_ok=True)
+    except OSError as e:
+        logging.error(f"DEBUG: Zip cache unavailable: {e}")
+        return None
+    return os.path.join(ZIP_CACHE_DIR, key + '.zip')
+
+
+def prune_cache_dir(directory, max_bytes, suffix):
+    """Drop least recently used ``suffix`` files until ``directory`` fits ``max_bytes``.
+
+    Hits are recorded by touching the file, so mtime order is LRU order.
+    Returns the bytes left.
+    """
+    try:
+        with os.scandir(directory) as it:
+            items = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in it if e.name.endswith(suffix))
+    except OSError:
+        return 0
+    total = sum(size for _, size, _ in items)
+    for _, size, path in items:
+        if total <= max_bytes: break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    return total
+
+
+def prune_zip_cache():
+    prune_cache_dir(ZIP_CACHE_DIR, ZIP_CACHE_MAX_BYTES, '.zip')
+
+
+# --- Batch Downloads ---
+# A selection of files and folders goes out as one uncompressed tar whose
+# size is known up front, so it streams with sendfile at link speed, shows
+# progress, and can be resumed like a single file.
+BATCH_MAX_ITEMS = 5000
+BATCH_TTL = 3600
+BATCH_FORM_LIMIT = 4 * 1024 * 1024
+
+
+class TarLayout(ArchiveLayout):
+    """Byte-exact plan of a ustar/pax archive of ``paths`` (files or folders).
+
+    Members are named relative to ``base`` when given, else to each
+    path's parent.
+    """
+
+    def __init__(self, paths, base=None):
+        self.files = []
+        self.segments = []
+        self.mtime = 0
+        digest = hashlib.sha256()
+        offset, pending, names = 0, b'', set()
+        for item in paths:
+            if os.path.isdir(item):
+                found = walk_files(item)
+            else:
+                try:
+                    found = [(item, os.path.basename(item), os.stat(item))]
+                except OSError as e:
+                    logging.error(f"DEBUG: Skipping {item} in batch: {e}")
+                    continue
+            for fn, arcname, st in found:
+                if base: arcname = os.path.relpath(fn, base)
+                arcname = arcname.replace(os.sep, '/')
+                stem, ext = os.path.splitext(arcname)
+                n = 1
+                while arcname in names:
+                    n += 1
+                    arcname = f"{stem} ({n}){ext}"
+                names.add(arcname)
+                info = tarfile.TarInfo(arcname)
+                info.size, info.mtime, info.mode = st.st_size, int(st.st_mtime), 0o644
+                pending += info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+                # Padding and the next header share one write.
+                self.segments.append((offset, len(pending), 'bytes', pending))
+                offset += len(pending)
+                self.segments.append((offset, st.st_size, 'file', len(self.files)))
+                offset += st.st_size
+                self.files.append((fn, arcname, st))
+                pending = b'\0' * (-st.st_size % tarfile.BLOCKSIZE)
+                digest.update(f"{fn}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}\n".encode('utf-8', 'surrogateescape'))
+                self.mtime = max(self.mtime, st.st_mtime)
+        pending += b'\0' * (2 * tarfile.BLOCKSIZE)
+        self.segments.append((offset, len(pending), 'bytes', pending))
+        self.size = offset + len(pending)
+        digest.update(f"{len(self.files)}".encode())
+        self.signature = digest.hexdigest()[:32]
+
+
+class BatchRegistry:
+    """Selections posted to /batch, kept briefly so the download is a plain,
+    resumable GET of ``/batch?id=``."""
+
+    def __init__(self, ttl=BATCH_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.batches = {}
+
+    def add(self, paths):
+        batch_id = secrets.token_hex(8)
+        now = time.time()
+        with self.lock:
+            for key in [k for k, (t, _) in self.batches.items() if now - t > self.ttl]:
+                del self.batches[key]
+            self.batches[batch_id] = (now, list(paths))
+        return batch_id
+
+    def get(self, batch_id):
+        with self.lock:
+            hit = self.batches.get(batch_id)
+            if hit is None or time.time() - hit[0] > self.ttl: return None
+            return hit[1]
+
+
+BATCHES = BatchRegistry()
+
+
+# --- Sync Manifests ---
+# /api/manifest lists a subtree as one NDJSON row per file so a client can
+# diff it against its own copy, then /api/fetch sends just the files that
+# differ as one tar. Directory listings come from LISTING_CACHE, so a repeat
+# manifest of an unchanged tree re-reads nothing but directory mtimes.
+MANIFEST_FIELDS = ["path", "size", "mtime", "sha256"]
+MAX_FETCH_FILES = 100000
+
+
+def walk_manifest(root):
+    """Yield ``(relpath, size, mtime, sha256 or None)`` for files under ``root``.
+
+    Paths use '/' and a directory's files come before its subdirectories.
+    Hashes are only reported where the upload hash index already has them.
+    """
+    stack, seen = [('', root)], set()
+    while stack:
+        rel, path = stack.pop()
+        real = os.path.realpath(path)
+        if real in seen: continue  # Symlink loops.
+        seen.add(real)
+        try:
+            listing = get_directory_listing(path)
+        except OSError as e:
+            logging.error(f"DEBUG: Manifest skipping {path}: {e}")
+            continue
+        with _hash_indexes_lock:
+            index = _hash_indexes.get(path)
+        subdirs = []
+        for name, is_dir, size, mtime in listing.entries:
+            if is_dir:
+                subdirs.append((f"{rel}{name}/", os.path.join(path, name)))
+            else:
+                yield rel + name, size, mtime, index.cached_digest(name, size, mtime) if index else None
+        stack.extend(reversed(subdirs))
+
+
+def resolve_fetch_paths(root, names):
+    """Map manifest-relative ``names`` to paths, rejecting any that leave ``root``."""
+    root = os.path.abspath(root)
+    paths = []
+    for name in names:
+        path = os.path.normpath(os.path.join(root, str(name)))
+        if os.path.isabs(str(name)) or os.path.commonpath([root, path]) != root or path == root:
+            raise ValueError(f"Bad path: {name}")
+        paths.append(path)
+    return paths
+
+
+# --- Search ---
+# A background thread walks ALLOWED_ROOTS and keeps every file and folder
+# name with its size and mtime, saved compressed on disk so a restart can
+# answer at once. Later passes stat each directory and rescan only those
+# whose mtime moved. Queries run against an immutable snapshot: one
+# newline-joined lowercase blob for substring search (str.find runs in C),
+# a sorted key list for prefixes and a per-extension id list.
+#
+# The same walk gives recursive folder sizes: each snapshot sums bytes and
+# file counts bottom-up. Listings look them up per row and queue a rescan of
+# any folder whose mtime moved. That rescan only re-sums the folder and its
+# ancestors into a copy of the snapshot; names, search structures and the
+# saved file catch up on the next full pass. A folder's mtime only moves for
+# its direct children, so changes deeper down show in its total only after
+# that pass, up to SEARCH_REFRESH seconds later.
+# None keeps the saved index under the app's cache directory; a lost one is
+# simply rebuilt by the next walk.
+SEARCH_INDEX_FILE = None
+SEARCH_REFRESH = 300
+# While the first walk runs, partial results are published this often.
+SEARCH_PUBLISH_INTERVAL = 5
+# Queued rescans wait this long so a burst of them becomes one pass.
+SEARCH_RESCAN_DELAY = 1
+SEARCH_PAGE_DEFAULT = 100
+SEARCH_PAGE_MAX = 1000
+
+
+class SearchSnapshot:
+    """Read-only query structures over a {dir: (mtime_ns, entries)} map."""
+
+    def __init__(self, dirs):
+        self.dirs = sorted(dirs)
+        self.parents = array.array('i')
+        self.sizes = array.array('q')  # -1 marks a directory
+        self.mtimes = array.array('d')
+        self.names = []
+        for i, d in enumerate(self.dirs):
+            for name, size, mtime in dirs[d][1]:
+                self.parents.append(i)
+                self.names.append(name)
+                self.sizes.append(size)
+                self.mtimes.append(mtime)
+        lower = [n.lower() for n in self.names]
+        self.blob = '\n'.join(lower) + '\n'
+        self.starts = array.array('q')
+        pos = 0
+        for n in lower:
+            self.starts.append(pos)
+            pos += len(n) + 1
+        self.order = sorted(range(len(lower)), key=lower.__getitem__)
+        self.keys = [lower[i] for i in self.order]
+        self.by_ext = collections.defaultdict(list)
+        for i, n in enumerate(lower):
+            ext = os.path.splitext(n)[1]
+            if ext and self.sizes[i] >= 0: self.by_ext[ext[1:]].append(i)
+        # Dir -> (bytes, files, mtime_ns). Sorted order puts every folder
+        # before its children, so walking it backwards sums children first.
+        self.totals = {}
+        for d in reversed(self.dirs):
+            self.totals[d] = self._total(d, dirs[d], self.totals)
+
+    @staticmethod
+    def _total(d, known, totals):
+        nbytes = files = 0
+        for name, size, _ in known[1]:
+            if size >= 0:
+                nbytes += size
+                files += 1
+            else:
+                sub = totals.get(os.path.join(d, name))
+                if sub:
+                    nbytes += sub[0]
+                    files += sub[1]
+        return (nbytes, files, known[0])
+
+    def with_totals(self, dirs, touched):
+        """A copy sharing everything but the totals, which are re-summed for
+        the ``touched`` folders and their ancestors."""
+        clone = copy.copy(self)
+        clone.totals = totals = dict(self.totals)
+        todo = set()
+        for d in touched:
+            while d not in todo:
+                todo.add(d)
+                parent = os.path.dirname(d)
+                if parent == d or parent not in dirs: break
+                d = parent
+        for d in sorted(todo, reverse=True):
+            if d in dirs: totals[d] = self._total(d, dirs[d], totals)
+            else: totals.pop(d, None)
+        return clone
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, i):
+        size = self.sizes[i]
+        path = os.path.join(self.dirs[self.parents[i]], self.names[i])
+        row = {"path": path, "name": self.names[i], "dir": size < 0, "size": max(size, 0), "mtime": self.mtimes[i]}
+        if size < 0 and path in self.totals:
+            row["size"], row["files"] = self.totals[path][:2]
+        return row
+
+    def search(self, q, mode, limit, cursor=0):
+        """Return (ids, next cursor or None, total or None) for one page."""
+        if mode == 'ext':
+            hits = self.by_ext.get(q, [])
+            return hits[cursor:cursor + limit], (cursor + limit if cursor + limit < len(hits) else None), len(hits)
+        if mode == 'prefix':
+            lo = bisect.bisect_left(self.keys, q)
+            hi = bisect.bisect_left(self.keys, q + '\uffff')
+            start = lo + cursor
+            end = min(hi, start + limit)
+            return self.order[start:end], (end - lo if end < hi else None), hi - lo
+        # Substring: the cursor is a blob offset. Counting every match would
+        # cost a Python step per hit, so no total is given.
+        ids, pos = [], cursor
+        while len(ids) < limit:
+            pos = self.blob.find(q, pos)
+            if pos < 0: return ids, None, None
+            i = bisect.bisect_right(self.starts, pos) - 1
+            ids.append(i)
+            pos = self.starts[i + 1] if i + 1 < len(self.starts) else len(self.blob)
+        return ids, (pos if pos < len(self.blob) else None), None
+
+
+class SearchIndex:
+    def __init__(self, roots=ALLOWED_ROOTS, path=SEARCH_INDEX_FILE, refresh=SEARCH_REFRESH):
+        self.roots = roots
+        self._path = path
+        self.refresh_interval = refresh
+        self.dirs = {}  # Only touched by the indexing thread.
+        # Set when subtree rescans changed ``dirs`` ahead of the snapshot.
+        self.dirty = False
+        self.snapshot = SearchSnapshot({})
+        self.ready = False
+        # Folder totals are only trusted once a walk (or a saved index) covers everything.
+        self.complete = False
+        self.updated = 0
+        self.lock = threading.Lock()
+        self._thread = None
+        self._pending = set()
+        self._wake = threading.Event()
+
+    @property
+    def path(self):
+        # Resolved per use: the app, and so its cache path, starts after import.
+        return self._path or app_cache_dir('search-index.json.gz')
+
+    @path.setter
+    def path(self, path):
+        self._path = path
+
+    def start(self):
+        with self.lock:
+            if self._thread: return
+            self._thread = threading.Thread(target=self._run, name='search-index', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        self.load()
+        pending = None
+        while True:
+            try:
+                self.refresh(pending)
+            except Exception as e:
+                logging.error(f"DEBUG: Search index refresh failed: {e}")
+            if not pending: next_full = time.monotonic() + self.refresh_interval
+            if self._wake.wait(max(0, next_full - time.monotonic())):
+                time.sleep(SEARCH_RESCAN_DELAY)
+            with self.lock:
+                self._wake.clear()
+                pending, self._pending = self._pending, set()
+            # Queued folders are rescanned on their own; otherwise a full pass.
+            if time.monotonic() >= next_full: pending = None
+
+    def invalidate(self, path):
+        """Queue ``path`` and the folders below it for a rescan."""
+        with self.lock:
+            self._pending.add(path)
+        self._wake.set()
+
+    def folder_total(self, path, mtime=None):
+        """(bytes, files) under real path ``path`` as of the last walk, or None.
+
+        Given the folder's current ``mtime``, a mismatch queues a rescan; the
+        old total is still returned meanwhile.
+        """
+        total = self.snapshot.totals.get(path) if self.complete else None
+        if total is None: return None
+        if mtime is not None and abs(total[2] / 1e9 - mtime) > 1e-6:
+            self.invalidate(path)
+        return total[:2]
+
+    def _scan(self, path, mtime_ns):
+        entries = []
+        with os.scandir(path) as it:
+            for entry in it:
+                # Hidden entries are skipped: app state, .thumbnails, trash.
+                if entry.name.startswith('.'): continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append((entry.name, -1, entry.stat(follow_symlinks=False).st_mtime))
+                    elif entry.is_file():
+                        st = entry.stat()
+                        entries.append((entry.name, st.st_size, st.st_mtime))
+                except OSError:
+                    pass
+        return (mtime_ns, entries)
+
+    def refresh(self, subtrees=None):
+        """Walk every root, or just ``subtrees`` within them, rescanning only
+        directories whose mtime changed.
+
+        A subtree pass only updates folder totals; the full snapshot is
+        rebuilt and saved by the next full pass.
+        """
+        roots = list(dict.fromkeys(os.path.realpath(r) for r in self.roots if os.path.isdir(r)))
+        tops = roots
+        if subtrees:
+            tops = [p for p in subtrees if any(p == r or p.startswith(r.rstrip(os.sep) + os.sep) for r in roots)]
+        changed, seen, published = False, set(), time.monotonic()
+        for root in tops:
+            stack = [root]
+            while stack:
+                path = stack.pop()
+                if path in seen: continue
+                seen.add(path)
+                try:
+                    mtime_ns = os.stat(path).st_mtime_ns
+                    known = self.dirs.get(path)
+                    if known is None or known[0] != mtime_ns:
+                        self.dirs[path] = known = self._scan(path, mtime_ns)
+                        changed = True
+                except OSError:
+                    continue
+                # Roots nested in other roots (/storage/emulated/0 in /storage)
+                # are walked on their own, since the parent may be unreadable.
+                stack.extend(p for p in (os.path.join(path, n) for n, size, _ in known[1] if size < 0)
+                             if p not in roots)
+                if not self.ready and time.monotonic() - published > SEARCH_PUBLISH_INTERVAL:
+                    self.snapshot = SearchSnapshot(self.dirs)
+                    published = time.monotonic()
+        gone = [d for d in self.dirs if d not in seen]
+        if subtrees:
+            gone = [d for d in gone if any(d == t or d.startswith(t.rstrip(os.sep) + os.sep) for t in tops)]
+        for path in gone:
+            del self.dirs[path]
+            changed = True
+        if subtrees and self.ready:
+            if changed:
+                self.snapshot = self.snapshot.with_totals(self.dirs, seen.union(gone))
+                self.dirty = True
+            return
+        if changed or self.dirty or not self.ready:
+            self.snapshot = SearchSnapshot(self.dirs)
+            self.save()
+            self.dirty = False
+        self.ready = self.complete = True
+        self.updated = time.time()
+        logging.error(f"DEBUG: Search index has {len(self.snapshot)} entries in {len(self.dirs)} folders")
+
+    def load(self):
+        try:
+            with open(self.path, 'rb') as f:
+                state = json.loads(zlib.decompress(f.read()))
+            self.dirs = {d: (v[0], [tuple(e) for e in v[1]]) for d, v in state["dirs"].items()}
+        except (OSError, ValueError, KeyError, TypeError, zlib.error):
+            return
+        self.snapshot = SearchSnapshot(self.dirs)
+        self.complete = True
+
+    def save(self):
+        tmp = f"{self.path}.{secrets.token_hex(4)}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            data = json.dumps({"dirs": self.dirs}, ensure_ascii=False, separators=(',', ':'))
+            with open(tmp, 'wb') as f:
+                f.write(zlib.compress(data.encode('utf-8', 'surrogateescape'), 6))
+            os.replace(tmp, self.path)
+        except OSError as e:
+            logging.error(f"DEBUG: Could not save search index: {e}")
+
+    def search(self, q, mode='auto', limit=SEARCH_PAGE_DEFAULT, cursor=None):
+        """One page of /search results. ``mode`` is prefix, substring, ext or
+        auto ('*.jpg' and '.jpg' mean ext, 'abc*' means prefix)."""
+        self.start()
+        q = q.strip().lower().replace('\n', '')
+        if mode == 'auto':
+            if q.startswith(('*.', '.')): mode = 'ext'
+            elif q.endswith('*'): mode = 'prefix'
+            else: mode = 'substring'
+        if mode not in ('prefix', 'substring', 'ext'): raise ValueError(f"Unknown mode {mode!r}")
+        q = q.lstrip('*.') if mode == 'ext' else q.rstrip('*') if mode == 'prefix' else q
+        if not q: raise ValueError("Empty query")
+        limit = max(1, min(int(limit), SEARCH_PAGE_MAX))
+        cursor = int(cursor) if cursor else 0
+        if cursor < 0: raise ValueError("Invalid cursor")
+        snapshot = self.snapshot
+        ids, nxt, total = snapshot.search(q, mode, limit, cursor)
+        return {
+            "q": q, "mode": mode, "results": [snapshot.row(i) for i in ids],
+            "next": None if nxt is None else str(nxt), "total": total,
+            "indexed": len(snapshot), "ready": self.ready, "updated": self.updated,
+        }
+
+
+SEARCH = SearchIndex()
+
+
+# --- Thumbnails ---
+# /thumb renders small JPEG previews on a bounded pool and keeps them in a
+# size-capped on-disk LRU keyed by path, size, mtime and edge length, so a
+# gallery costs kilobytes per row and repeat visits cost a file read.
+# A preview not ready within THUMB_WAIT seconds is answered with 202 and the
+# page asks again, rather than parking a request worker on the render.
+# None keeps the cache in "thumbs" under the app's cache directory.
+THUMB_CACHE_DIR = None
+THUMB_CACHE_BYTES = 64 * 1024 * 1024
+THUMB_WORKERS = 2
+THUMB_SIZE = 256
+THUMB_MAX_SIZE = 512
+THUMB_QUALITY = 80
+THUMB_WAIT = 1
+THUMB_IMAGE_EXTENSIONS = frozenset('.jpg .jpeg .png .webp .gif .bmp .heic .heif'.split())
+THUMB_VIDEO_EXTENSIONS = frozenset('.mp4 .m4v .mkv .mov .webm .3gp'.split())
+
+
+def _android_thumbnail(path, size, video):
+    ThumbnailUtils = jclass('android.media.ThumbnailUtils')
+    if Build.VERSION.SDK_INT >= 29:
+        f, dims = jclass('java.io.File')(path), jclass('android.util.Size')(size, size)
+        bitmap = (ThumbnailUtils.createVideoThumbnail(f, dims, None) if video
+                  else ThumbnailUtils.createImageThumbnail(f, dims, None))
+    elif video:
+        bitmap = ThumbnailUtils.createVideoThumbnail(path, 1)  # MINI_KIND
+    else:
+        # Decode at the largest power-of-two reduction that still covers size.
+        BitmapFactory = jclass('android.graphics.BitmapFactory')
+        opts = BitmapFactory.Options()
+        opts.inJustDecodeBounds = True
+        BitmapFactory.decodeFile(path, opts)
+        sample = 1
+        while min(opts.outWidth, opts.outHeight) // (sample * 2) >= size:
+            sample *= 2
+        opts.inJustDecodeBounds = False
+        opts.inSampleSize = sample
+        bitmap = BitmapFactory.decodeFile(path, opts)
+    if bitmap is None: return None
+    try:
+        out = jclass('java.io.ByteArrayOutputStream')()
+        bitmap.compress(jclass('android.graphics.Bitmap$CompressFormat').JPEG, THUMB_QUALITY, out)
+        return bytes(out.toByteArray())
+    finally:
+        bitmap.recycle()
+
+
+def _pillow_thumbnail(path, size):
+    with Image.open(path) as img:
+        img.draft('RGB', (size, size))  # Lets JPEG decode at reduced scale.
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((size, size))
+        out = BytesIO()
+        img.convert('RGB').save(out, 'JPEG', quality=THUMB_QUALITY)
+        return out.getvalue()
+
+
+def make_thumbnail(path, size):
+    """JPEG bytes of a preview of ``path`` no larger than ``size``, or None."""
+    ext = os.path.splitext(path)[1].lower()
+    video = ext in THUMB_VIDEO_EXTENSIONS
+    if not video and ext not in THUMB_IMAGE_EXTENSIONS:
+        return None
+    if ANDROID_AVAILABLE:
+        return _android_thumbnail(path, size, video)
+    if Image is not None and not video:
+        return _pillow_thumbnail(path, size)
+    return None
+
+
+class ThumbnailService:
+    """Generates thumbnails on a bounded pool and caches them on disk.
+
+    Concurrent requests for the same thumbnail share one job.
+    """
+
+    def __init__(self, directory=THUMB_CACHE_DIR, max_bytes=THUMB_CACHE_BYTES, workers=THUMB_WORKERS):
+        self._directory = directory
+        self.max_bytes = max_bytes
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers, thread_name_prefix='thumb')
+        self.lock = threading.Lock()
+        self.jobs = {}
+        self.written = max_bytes  # Forces a prune on the first write.
+
+    @property
+    def directory(self):
+        # Resolved per use: the app, and so its cache path, starts after import.
+        return self._directory or app_cache_dir('thumbs')
+
+    def key(self, path, st, size):
+        ident = f"{path}\0{st.st_size}\0{st.st_mtime_ns}\0{size}".encode('utf-8', 'surrogateescape')
+        return hashlib.sha1(ident).hexdigest()
+
+    def get(self, path, size, wait=THUMB_WAIT):
+        """``(key, jpeg bytes or None)`` for ``path`` at ``size``.
+
+        Raises concurrent.futures.TimeoutError if the preview is still being
+        rendered after ``wait`` seconds; the render carries on regardless.
+        """
+        st = os.stat(path)
+        key = self.key(path, st, size)
+        cached = os.path.join(self.directory, key + '.jpg')
+        try:
+            with open(cached, 'rb') as f:
+                data = f.read()
+            os.utime(cached)
+            return key, data
+        except OSError:
+            pass
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None:
+                job = self.jobs[key] = self.pool.submit(self._build, key, path, size)
+        return key, job.result(wait)
+
+    def _build(self, key, path, size):
+        try:
+            data = make_thumbnail(path, size)
+            # Empty files remember that no preview can be made.
+            self._store(key, data or b'')
+            return data
+        except Exception as e:
+            logging.error(f"DEBUG: Thumbnail of {path} failed: {e}")
+            return None
+        finally:
+            with self.lock:
+                self.jobs.pop(key, None)
+
+    def _store(self, key, data):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp = os.path.join(self.directory, f"{key}.{secrets.token_hex(4)}.tmp")
+            with open(tmp, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, os.path.join(self.directory, key + '.jpg'))
+        except OSError as e:
+            logging.error(f"DEBUG: Could not cache thumbnail: {e}")
+            return
+        with self.lock:
+            self.written += len(data) + 512
+            if self.written < self.max_bytes // 8: return
+            self.written = 0
+        prune_cache_dir(self.directory, self.max_bytes, '.jpg')
+
+
+THUMBNAILS = ThumbnailService()
+
+
+# --- Response Compression ---
+# Pages built into the app are encoded and compressed once, at import, and
+# carry a content-hash ETag: a reload is a 304 and a first load over a slow
+# link moves a fraction of the bytes. Dynamic text and JSON bodies of at
+# least COMPRESS_MIN_SIZE are compressed per response when the client
+# accepts it, at a cheaper level.
+COMPRESS_MIN_SIZE = 1024
+COMPRESS_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def compress_bytes(data, encoding, best=False):
+    if encoding == 'br':
+        return brotli.compress(data, quality=11 if best else BROTLI_QUALITY)
+    # wbits 31 writes a gzip wrapper with a zero mtime, so output is stable.
+    c = zlib.compressobj(9 if best else COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def accepted_encodings(value):
+    """The ENCODINGS an Accept-Encoding header allows, most preferred first."""
+    prefs = {}
+    for item in (value or '').split(','):
+        name, _, params = item.partition(';')
+        m = re.search(r'q\s*=\s*([0-9.]+)', params)
+        try: prefs[name.strip().lower()] = float(m.group(1)) if m else 1.0
+        except ValueError: prefs[name.strip().lower()] = 0.0
+    star = prefs.get('*', 0.0)
+    allowed = [e for e in ENCODINGS if prefs.get(e, star) > 0]
+    return sorted(allowed, key=lambda e: -prefs.get(e, star))
+
+
+def etag_matches(value, etag):
+    """Weak comparison of an If-None-Match header against ``etag``."""
+    if not value: return False
+    if value.strip() == '*': return True
+    strip = lambda t: t.strip()[2:] if t.strip().startswith('W/') else t.strip()
+    return strip(etag) in {strip(t) for t in value.split(',')}
+
+
+class StaticPage:
+    """A fixed response body, held pre-encoded in every content coding."""
+
+    def __init__(self, body, content_type):
+        if isinstance(body, str): body = body.encode('utf-8')
+        self.content_type = content_type
+        self.etag = f'W/"{hashlib.sha256(body).hexdigest()[:24]}"'
+        self.variants = {None: body}
+        for encoding in ENCODINGS:
+            data = compress_bytes(body, encoding, best=True)
+            if len(data) < len(body): self.variants[encoding] = data
+
+    def select(self, accept_encoding):
+        for encoding in accepted_encodings(accept_encoding):
+            if encoding in self.variants: return encoding, self.variants[encoding]
+        return None, self.variants[None]
+
+
+STATIC_PAGES = {'/': StaticPage(HTML_LAYOUT, 'text/html; charset=utf-8')}
+
+class _NullWriter:
+    def write(self, data):
+        return len(data)
+
+    def flush(self):
+        pass
+
+
+# Requests asking for more ranges than this get the whole file instead.
+MAX_RANGES = 16
+# Zero-copy file responses: sendfile where the OS has it, else mmap windows.
+USE_SENDFILE = hasattr(os, 'sendfile')
+SENDFILE_CHUNK = 8 * 1024 * 1024
+MMAP_WINDOW = 64 * 1024 * 1024
+
+
+def parse_range_header(value, size):
+    """Parse a ``Range: bytes=...`` header against a representation of ``size`` bytes.
+
+    Returns a sorted list of inclusive ``(start, end)`` pairs with overlapping
+    and adjacent ranges merged, ``[]`` if none of them is satisfiable, or
+    ``None`` if the header should be ignored and the full body sent.
+    """
+    unit, _, spec = value.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        return None
+    ranges = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item: continue
+        first, dash, last = item.partition('-')
+        if not dash: return None
+        first, last = first.strip(), last.strip()
+        try:
+            if first:
+                start = int(first)
+                end = int(last) if last else None
+                if start < 0 or (end is not None and end < start): return None
+                if end is None: end = size - 1
+            else:
+                suffix = int(last)
+                if suffix < 0: return None
+                if suffix == 0: continue
+                start, end = max(0, size - suffix), size - 1
+        except ValueError:
+            return None
+        if start >= size: continue
+        ranges.append((start, min(end, size - 1)))
+    if len(ranges) > MAX_RANGES:
+        return None
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(value, etag, mtime):
+    if not value:
+        return True
+    value = value.strip()
+    if value.startswith(('"', 'W/')):
+        # If-Range requires a strong comparison, so weak tags never match.
+        return value == etag
+    try:
+        return int(email.utils.parsedate_to_datetime(value).timestamp()) == int(mtime)
+    except (TypeError, ValueError):
+        return False
+
+
+class ServerStats:
+    """Connection counters shared by every handler of one server."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.closed = 0
+        self.requests = 0
+        self.reused = 0
+
+    @property
+    def active(self):
+        return self.connections - self.closed
+
+    def connection_opened(self):
+        with self.lock:
+            self.connections += 1
+
+    def connection_closed(self):
+        with self.lock:
+            self.closed += 1
+
+    def request_served(self, reused):
+        with self.lock:
+            self.requests += 1
+            if reused: self.reused += 1
+
+    def summary(self):
+        return f"{self.requests} requests over {self.connections} connections ({self.reused} reused)"
+
+
+
+# --- Metrics ---
+# Each thread records into its own shard, so the hot paths never take a lock;
+# /metrics merges the shards when it is read. A thread's shard is folded into
+# the retired totals when the thread exits.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_ROUTES = frozenset({'/', '/browse', '/download', '/zip', '/batch', '/thumb', '/metrics',
+                           '/api/list', '/api/have', '/api/manifest', '/api/fetch', '/api/upload', '/api/info',
+                           '/search', '/events'})
+# Long-lived streams: counted, but their lifetime is not a request latency,
+# so they stay out of the histogram and show as an open-streams gauge instead.
+STREAM_ROUTES = frozenset({'/events'})
+# Seconds of history used for the throughput figures.
+THROUGHPUT_WINDOW = 5
+
+
+def route_label(path):
+    """Bounded route name for metric labels."""
+    if path in METRIC_ROUTES: return path
+    if path.startswith('/api/upload/'): return '/api/upload/:id'
+    return 'other'
+
+
+class _Shard:
+    __slots__ = ('counters', 'histograms', '__weakref__')
+
+    def __init__(self):
+        self.counters = collections.defaultdict(int)
+        self.histograms = {}
+
+
+class Metrics:
+    """Counters and latency histograms keyed by ``(name, labels)``."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.shards = set()
+        self.retired = _Shard()
+        self.started = time.time()
+        self.samples = collections.deque(maxlen=64)
+
+    def _shard(self):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = _Shard()
+            # The token dies with the thread's locals and retires the shard.
+            self.local.token = token = type('ShardToken', (), {})()
+            weakref.finalize(token, self._retire, shard)
+            with self.lock:
+                self.shards.add(shard)
+        return shard
+
+    def _retire(self, shard):
+        with self.lock:
+            self.shards.discard(shard)
+            self._merge(self.retired, shard)
+
+    @staticmethod
+    def _merge(into, shard):
+        for key, value in shard.counters.copy().items():
+            into.counters[key] += value
+        for key, h in shard.histograms.copy().items():
+            total = into.histograms.setdefault(key, [0] * len(h))
+            for i, v in enumerate(list(h)):
+                total[i] += v
+
+    def inc(self, name, labels=(), value=1):
+        self._shard().counters[(name, labels)] += value
+
+    def observe(self, name, labels, value):
+        hists = self._shard().histograms
+        h = hists.get((name, labels))
+        if h is None:
+            # Bucket counts, then +Inf, sum and count.
+            h = hists[(name, labels)] = [0] * (len(LATENCY_BUCKETS) + 3)
+        h[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        h[-2] += value
+        h[-1] += 1
+
+    def snapshot(self):
+        """Merged ``(counters, histograms)`` across all threads."""
+        total = _Shard()
+        with self.lock:
+            self._merge(total, self.retired)
+            shards = list(self.shards)
+        for shard in shards:
+            self._merge(total, shard)
+        return total.counters, total.histograms
+
+    def throughput(self, counters):
+        """Bytes per second ``(in, out)`` over the last THROUGHPUT_WINDOW seconds."""
+        now = time.monotonic()
+        sample = (now, sum(v for (n, _), v in counters.items() if n == 'bytes_received'),
+                  sum(v for (n, _), v in counters.items() if n == 'bytes_sent'))
+        with self.lock:
+            self.samples.append(sample)
+            while len(self.samples) > 2 and now - self.samples[1][0] >= THROUGHPUT_WINDOW:
+                self.samples.popleft()
+            first = self.samples[0]
+        elapsed = now - first[0]
+        if elapsed <= 0: return 0.0, 0.0
+        return (sample[1] - first[1]) / elapsed, (sample[2] - first[2]) / elapsed
+
+    def report(self, stats=None):
+        """Everything as one JSON-ready dict."""
+        counters, histograms = self.snapshot()
+        bytes_in, bytes_out = self.throughput(counters)
+        routes = collections.defaultdict(lambda: {"requests": 0, "bytes_sent": 0, "bytes_received": 0})
+        for (name, labels), value in counters.items():
+            if name == 'requests':
+                route = routes[labels[0]]
+                route["requests"] += value
+                codes = route.setdefault("codes", {})
+                codes[labels[2]] = codes.get(labels[2], 0) + value
+            elif name in ('bytes_sent', 'bytes_received'):
+                routes[labels[0]][name] += value
+        for (name, labels), h in histograms.items():
+            if name == 'request_seconds':
+                routes[labels[0]]["latency"] = {
+                    "count": h[-1], "sum": round(h[-2], 6),
+                    "p50": histogram_quantile(h, 0.5), "p95": histogram_quantile(h, 0.95)}
+        report = {
+            "uptime": round(time.time() - self.started, 1),
+            "threads": threading.active_count(),
+            "bytes_sent": sum(r["bytes_sent"] for r in routes.values()),
+            "bytes_received": sum(r["bytes_received"] for r in routes.values()),
+            "download_bps": round(bytes_out), "upload_bps": round(bytes_in),
+            "event_streams": len(EVENTS.subscribers),
+            "zip": {"deflate_in": counters.get(('zip_deflate_in', ()), 0),
+                    "deflate_out": counters.get(('zip_deflate_out', ()), 0),
+                    "deflate_seconds": round(counters.get(('zip_deflate_seconds', ()), 0), 3),
+                    "stored": counters.get(('zip_stored', ()), 0)},
+            "routes": dict(routes),
+        }
+        if stats is not None:
+            report.update(connections=stats.connections, active_connections=stats.active,
+                          requests=stats.requests, reused=stats.reused)
+        return report
+
+    def prometheus(self, stats=None):
+        """Prometheus text exposition format (0.0.4)."""
+        counters, histograms = self.snapshot()
+        out = []
+
+        def family(name, kind, rows):
+            out.append(f"# TYPE santhushare_{name} {kind}")
+            out.extend(f"santhushare_{name}{labels} {value}" for labels, value in rows)
+
+        def fmt(**labels):
+            return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}' if labels else ''
+
+        family('requests_total', 'counter', sorted(
+            (fmt(route=l[0], method=l[1], code=l[2]), v) for (n, l), v in counters.items() if n == 'requests'))
+        rows = []
+        for (name, labels), h in sorted(histograms.items()):
+            if name != 'request_seconds': continue
+            cumulative = 0
+            for le, count in zip(LATENCY_BUCKETS + ('+Inf',), h):
+                cumulative += count
+                rows.append((f'_bucket{fmt(route=labels[0], le=le)}', cumulative))
+            rows.append((f'_sum{fmt(route=labels[0])}', h[-2]))
+            rows.append((f'_count{fmt(route=labels[0])}', h[-1]))
+        out.append("# TYPE santhushare_request_duration_seconds histogram")
+        out.extend(f"santhushare_request_duration_seconds{r} {v}" for r, v in rows)
+        for name in ('bytes_sent', 'bytes_received'):
+            family(f'{name}_total', 'counter', sorted(
+                (fmt(route=l[0]), v) for (n, l), v in counters.items() if n == name))
+        family('zip_deflate_bytes_total', 'counter', [
+            (fmt(stage='in'), counters.get(('zip_deflate_in', ()), 0)),
+            (fmt(stage='out'), counters.get(('zip_deflate_out', ()), 0))])
+        family('zip_deflate_seconds_total', 'counter', [('', counters.get(('zip_deflate_seconds', ()), 0))])
+        family('zip_stored_bytes_total', 'counter', [('', counters.get(('zip_stored', ()), 0))])
+        family('threads', 'gauge', [('', threading.active_count())])
+        family('event_streams', 'gauge', [('', len(EVENTS.subscribers))])
+        family('uptime_seconds', 'gauge', [('', round(time.time() - self.started, 1))])
+        if stats is not None:
+            family('connections_total', 'counter', [('', stats.connections)])
+            family('active_connections', 'gauge', [('', stats.active)])
+        return '\n'.join(out) + '\n'
+
+
+def histogram_quantile(h, q):
+    """Upper bucket bound holding quantile ``q`` of histogram ``h`` (None if empty)."""
+    target, seen = q * h[-1], 0
+    if not h[-1]: return None
+    for le, count in zip(LATENCY_BUCKETS, h):
+        seen += count
+        if seen >= target: return le
+    return float('inf')
+
+
+METRICS = Metrics()
+
+
+class _CountingWriter:
+    """Pass-through response writer that counts bytes written."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.count = 0
+
+    def write(self, data):
+        self.count += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
+
+class _StreamBody:
+    """Body writer for responses of unknown length.
+
+    Small writes are coalesced and, for HTTP/1.1 clients, framed with
+    Transfer-Encoding: chunked; otherwise the body is delimited by closing
+    the connection.
+    """
+
+    def __init__(self, wfile, chunked, buffer_size=64 * 1024, pace=None):
+        self.wfile = wfile
+        self.chunked = chunked
+        self.buffer_size = buffer_size
+        self.pace = pace
+        self.buf = bytearray()
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= self.buffer_size:
+            self.flush()
+        return len(data)
+
+    def flush(self):
+        if not self.buf: return
+        if self.pace: self.pace(len(self.buf))
+        if self.chunked:
+            self.wfile.write(b'%x\r\n' % len(self.buf) + self.buf + b'\r\n')
+        else:
+            self.wfile.write(self.buf)
+        self.buf.clear()
+
+    def close(self):
+        self.flush()
+        if self.chunked: self.wfile.write(b'0\r\n\r\n')
+
+
+# --- Live Events ---
+# /events is a Server-Sent Events stream of history entries, files landing in
+# the upload dir and transfer progress, so open pages patch themselves rather
+# than reload. Publishing never blocks: each subscriber has a bounded queue
+# and is cut off when it falls too far behind; the browser reconnects with
+# Last-Event-ID and catches up from a short backlog (or is told to resync).
+# On the asyncio engine a stream is written from the event loop, so an idle
+# page costs a socket, not a worker thread.
+EVENTS_BACKLOG = 256
+EVENTS_QUEUE = 512
+# A comment line this often keeps idle streams from being dropped by NATs.
+EVENTS_KEEPALIVE = 15
+EVENTS_PROGRESS_INTERVAL = 0.5
+EVENTS_PING = b": ping\n\n"
+
+
+class EventSubscription:
+    def __init__(self, loop=None):
+        self.queue = collections.deque()
+        self.closed = False
+        self.loop = loop
+        # Waited on from a handler thread, or from the loop on the asyncio engine.
+        self.ready = asyncio.Event() if loop else threading.Event()
+
+    def put(self, message):
+        if len(self.queue) >= EVENTS_QUEUE:
+            self.closed = True
+        else:
+            self.queue.append(message)
+        if self.ready.is_set(): return
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self.ready.set)
+            except RuntimeError:
+                self.closed = True  # The loop is gone.
+        else:
+            self.ready.set()
+
+    def drain(self):
+        self.ready.clear()
+        out = []
+        while self.queue:
+            out.append(self.queue.popleft())
+        return b''.join(out)
+
+    def wait(self, timeout):
+        self.ready.wait(timeout)
+
+    async def wait_async(self, timeout):
+        try:
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+class EventHub:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seq = 0
+        self.backlog = collections.deque(maxlen=EVENTS_BACKLOG)  # (id, encoded event)
+        self.subscribers = set()
+
+    def publish(self, kind, data):
+        with self.lock:
+            self.seq += 1
+            message = f"id: {self.seq}\nevent: {kind}\ndata: {json.dumps(data)}\n\n".encode()
+            self.backlog.append((self.seq, message))
+            subscribers = list(self.subscribers)
+        for sub in subscribers:
+            sub.put(message)
+
+    def subscribe(self, last_id=None, loop=None):
+        """A new subscription, first replaying what came after ``last_id``."""
+        sub = EventSubscription(loop)
+        sub.put(b"retry: 3000\n\n")
+        with self.lock:
+            try:
+                last = int(last_id) if last_id else None
+            except ValueError:
+                last = None
+            if last is not None:
+                if last < self.seq and (not self.backlog or self.backlog[0][0] > last + 1):
+                    sub.put(f"id: {self.seq}\nevent: resync\ndata: {{}}\n\n".encode())
+                else:
+                    for seq, message in self.backlog:
+                        if seq > last: sub.put(message)
+            self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        with self.lock:
+            self.subscribers.discard(sub)
+
+
+EVENTS = EventHub()
+
+
+def publish_file(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return
+    EVENTS.publish('file', {"path": path, "dir": os.path.dirname(path), "name": os.path.basename(path),
+                            "size": st.st_size, "mtime": st.st_mtime})
+
+
+# --- Transfer Scheduling ---
+# Bulk transfers (downloads, archives, uploads) are paced through token
+# buckets: one global, and one per client IP that gets an even share of the
+# global rate among clients currently transferring. Rates are bytes per
+# second; 0 means unlimited. While any interactive request (pages, listings,
+# thumbnails, API calls) is in flight, each bulk slice steps aside for at
+# least SCHED_YIELD, limits or not, so those requests get the CPU, disk and
+# link first; with a limit set, slices are also charged
+# SCHED_INTERACTIVE_WEIGHT times their size, leaving part of the budget to
+# them. With no interactive request in flight, unlimited bulk transfers never
+# wait.
+SCHED_SLICE = 512 * 1024
+SCHED_INTERACTIVE_WEIGHT = 2
+SCHED_YIELD = 0.002
+# /api/manifest streams a whole tree, so it counts as bulk; /thumb and the
+# rest of the API are interactive.
+BULK_ROUTES = ('/download', '/zip', '/batch', '/api/fetch', '/api/manifest')
+
+
+class TokenBucket:
+    """Token bucket in debt form: ``take`` always succeeds and returns how
+    long the caller should sleep to stay within ``rate``."""
+
+    def __init__(self, rate=0):
+        self.lock = threading.Lock()
+        self.rate = 0
+        self.tokens = 0
+        self.stamp = time.monotonic()
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        with self.lock:
+            burst = max(rate // 4, SCHED_SLICE)
+            # Buckets coming out of unlimited mode start full.
+            self.tokens = min(self.tokens, burst) if self.rate else burst
+            self.rate, self.burst = rate, burst
+            self.stamp = time.monotonic()
+
+    def take(self, n):
+        with self.lock:
+            if not self.rate: return 0
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate) - n
+            self.stamp = now
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class TransferScheduler:
+    """Paces bulk transfers per client, weighted towards interactive requests."""
+
+    def __init__(self, global_rate=0, client_rate=0):
+        self.lock = threading.Lock()
+        self.global_bucket = TokenBucket()
+        self.clients = {}  # ip -> [TokenBucket, active transfers]
+        self.interactive = 0
+        self.configure(global_rate, client_rate)
+
+    def configure(self, global_rate, client_rate):
+        with self.lock:
+            self.global_rate, self.client_rate = int(global_rate), int(client_rate)
+            self._rebalance()
+
+    def _rebalance(self):
+        self.global_bucket.set_rate(self.global_rate)
+        share = self.global_rate // len(self.clients) if self.global_rate and self.clients else 0
+        rate = min(r for r in (share, self.client_rate, float('inf')) if r)
+        for bucket, _ in self.clients.values():
+            bucket.set_rate(0 if rate == float('inf') else int(rate))
+
+    def begin_bulk(self, ip):
+        """Register a bulk transfer for ``ip``; returns its ``pace(nbytes)`` callable."""
+        with self.lock:
+            client = self.clients.get(ip)
+            if client is None:
+                client = self.clients[ip] = [TokenBucket(), 0]
+                self._rebalance()
+            client[1] += 1
+        return _BulkPace(self, client[0])
+
+    def end_bulk(self, ip):
+        with self.lock:
+            client = self.clients.get(ip)
+            if client is None: return
+            client[1] -= 1
+            if client[1] <= 0:
+                del self.clients[ip]
+                self._rebalance()
+
+    def begin_interactive(self):
+        with self.lock:
+            self.interactive += 1
+
+    def end_interactive(self):
+        with self.lock:
+            self.interactive -= 1
+
+    def delay(self, bucket, n):
+        """Seconds a bulk transfer on ``bucket`` should wait before ``n`` more bytes."""
+        if not self.interactive:
+            return max(self.global_bucket.take(n), bucket.take(n))
+        # Unlimited buckets ignore the weight, but the yield still applies.
+        n *= SCHED_INTERACTIVE_WEIGHT
+        return max(self.global_bucket.take(n), bucket.take(n), SCHED_YIELD)
+
+
+class _BulkPace:
+    """``pace(nbytes)`` callable of one bulk transfer.
+
+    Calling it sleeps as long as the scheduler asks; ``delay`` returns the
+    wait instead, for callers on an event loop.
+    """
+
+    def __init__(self, scheduler, bucket):
+        self.scheduler = scheduler
+        self.bucket = bucket
+
+    def delay(self, n):
+        return self.scheduler.delay(self.bucket, n)
+
+    def __call__(self, n):
+        delay = self.delay(n)
+        if delay: time.sleep(delay)
+
+
+SCHEDULER = TransferScheduler()
+
+
+class _PacedReader:
+    """Request body reader that paces what it returns."""
+
+    def __init__(self, rfile, pace):
+        self.rfile = rfile
+        self.pace = pace
+
+    def read(self, n=-1):
+        data = self.rfile.read(n)
+        self.pace(len(data))
+        return data
+
+    def readline(self, limit=-1):
+        data = self.rfile.readline(limit)
+        self.pace(len(data))
+        return data
+
+
+# Persistent connections: idle (or stalled) clients are dropped after
+# KEEPALIVE_TIMEOUT seconds and every connection is closed after
+# MAX_KEEPALIVE_REQUESTS so one client cannot hold a worker forever.
+KEEPALIVE_TIMEOUT = 30
+MAX_KEEPALIVE_REQUESTS = 100
+
+
+class SecureHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, the body
+    # waits for the client's delayed ACK (~40 ms) on every kept-alive request.
+    disable_nagle_algorithm = True
+    connection_requests = 0
+    connection_header_sent = False
+    body_queue = None  # the asyncio engine's writer, which may still be sending
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        self.server.stats.connection_opened()
+        try:
+            super().handle()
+        finally:
+            self.server.stats.connection_closed()
+
+    def handle_one_request(self):
+        self.connection_requests += 1
+        self.pace = None
+        self.transfer = None
+        self.route = None
+        self.status_code = 0
+        self.sent_direct = 0
+        try:
+            super().handle_one_request()
+        finally:
+            # A body queued on the asyncio loop is still in flight here.
+            if self.body_queue: self.body_queue.defer(self.end_request)
+            else: self.end_request()
+
+    def end_request(self):
+        if self.transfer == 'bulk':
+            SCHEDULER.end_bulk(self.client_address[0])
+        elif self.transfer == 'interactive':
+            SCHEDULER.end_interactive()
+        if self.route: self.record_metrics()
+
+    def record_metrics(self):
+        sent = self.sent_direct
+        if isinstance(self.wfile, _CountingWriter):
+            sent += self.wfile.count
+            self.wfile = self.wfile.raw
+        labels = (self.route,)
+        METRICS.inc('requests', (self.route, self.command, str(self.status_code)))
+        if self.route not in STREAM_ROUTES:
+            METRICS.observe('request_seconds', labels, time.monotonic() - self.started)
+        METRICS.inc('bytes_sent', labels, sent)
+        METRICS.inc('bytes_received', labels, int(self.headers.get('Content-Length', 0) or 0))
+
+    def parse_request(self):
+        if not super().parse_request(): return False
+        path = urllib.parse.urlparse(self.path).path
+        self.started = time.monotonic()
+        self.route = route_label(path)
+        self.wfile = _CountingWriter(self.wfile)
+        bulk = (path in BULK_ROUTES or (self.command == 'POST' and path == '/')
+                or (self.command in ('PUT', 'PATCH') and path.startswith('/api/upload/')))
+        if path == '/events':
+            pass  # Open for as long as the page is; it must not hold bulk transfers back.
+        elif bulk:
+            self.transfer = 'bulk'
+            self.pace = SCHEDULER.begin_bulk(self.client_address[0])
+        else:
+            self.transfer = 'interactive'
+            SCHEDULER.begin_interactive()
+        return True
+
+    def send_response(self, code, message=None):
+        self.status_code = code
+        super().send_response(code, message)
+        self.server.stats.request_served(self.connection_requests > 1)
+        self.connection_header_sent = False
+
+    def send_header(self, keyword, value):
+        if keyword.lower() == 'connection': self.connection_header_sent = True
+        super().send_header(keyword, value)
+
+    def send_body(self, body, content_type='text/plain; charset=utf-8', code=200, headers=(), validate=False, compress=True):
+        """Send a complete body, compressed when it is worth it.
+
+        With ``validate``, the body gets a content-hash ETag and a client
+        that already has it gets a 304 instead.
+        """
+        if isinstance(body, str): body = body.encode('utf-8')
+        headers = list(headers)
+        if validate and code == 200:
+            etag = f'W/"{hashlib.sha1(body).hexdigest()[:24]}"'
+            headers += [('ETag', etag), ('Cache-Control', 'private, no-cache')]
+            if self.not_modified(etag, headers): return
+        if compress and len(body) >= COMPRESS_MIN_SIZE and content_type.startswith(COMPRESSIBLE_TYPES):
+            headers.append(('Vary', 'Accept-Encoding'))
+            encodings = accepted_encodings(self.headers.get('Accept-Encoding'))
+            if encodings:
+                body = compress_bytes(body, encodings[0])
+                headers.append(('Content-Encoding', encodings[0]))
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_modified(self, etag, headers=()):
+        """Answer 304 if the request's If-None-Match already names ``etag``."""
+        if not etag_matches(self.headers.get('If-None-Match'), etag): return False
+        self.send_response(304)
+        for key, value in headers:
+            if key.lower() in ('etag', 'cache-control', 'vary'): self.send_header(key, value)
+        self.end_headers()
+        return True
+
+    def send_static(self, page):
+        headers = [('ETag', page.etag), ('Cache-Control', 'private, no-cache'), ('Vary', 'Accept-Encoding')]
+        if self.not_modified(page.etag, headers): return
+        encoding, body = page.select(self.headers.get('Accept-Encoding'))
+        if encoding: headers.append(('Content-Encoding', encoding))
+        self.send_body(body, page.content_type, headers=headers, compress=False)
+
+    def start_stream(self, content_type, headers=()):
+        """Start a 200 response of unknown length and return the body writer.
+
+        HTTP/1.1 clients get chunked encoding and keep their connection;
+        older clients get a close-delimited body. Call ``close()`` on the
+        returned writer when done.
+        """
+        chunked = self.request_version >= 'HTTP/1.1'
+        if not chunked: self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        for key, value in headers:
+            self.send_header(key, value)
+        if chunked: self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        return _StreamBody(self.wfile, chunked, pace=self.pace)
+
+    def check_auth(self):
+        if not self.server.password: return True
+        auth = self.headers.get('Authorization')
+        ok = False
+        if auth:
+            try:
+                m, c = auth.split()
+                ok = m.lower() == 'basic' and base64.b64decode(c).decode().split(':', 1)[1] == self.server.password
+            except Exception:
+                ok = False
+        if ok: return True
+
+        self.close_if_body_unread()
+        self.send_body(b"Access Denied" if auth else b"Auth Required", code=401,
+                       headers=[('WWW-Authenticate', 'Basic realm="SanthuShare"')])
+        return False
+
+    def close_if_body_unread(self):
+        # An unread request body would be parsed as the next pipelined request.
+        if int(self.headers.get('Content-Length', 0) or 0) or self.headers.get('Transfer-Encoding'):
+            self.close_connection = True
+
+    def do_GET(self):
+        if not self.check_auth(): return
+        
+        parsed = urllib.parse.urlparse(self.path)
+        if is_upload_api(parsed.path):
+            self.handle_upload_api(parsed)
+            return
+
+        if parsed.path in STATIC_PAGES:
+            self.send_static(STATIC_PAGES[parsed.path])
+            return
+            
+        if parsed.path == '/api/list':
+            qs = urllib.parse.parse_qs(parsed.query)
+            path = qs.get('path', ["/storage/emulated/0"])[0]
+            try:
+                self.send_json(list_page(
+                    path,
+                    sort=qs.get('sort', ['name'])[0],
+                    order=qs.get('order', ['asc'])[0],
+                    limit=qs.get('limit', [LIST_PAGE_DEFAULT])[0],
+                    cursor=qs.get('cursor', [None])[0],
+                ), validate=True)
+            except ValueError as e:
+                self.send_json({"error": str(e)}, 400)
+            except OSError as e:
+                self.send_json({"error": str(e)}, 404)
+            return
+
+        if parsed.path == '/api/info':
+            # What a scripted client needs before pushing (see santhushare.client).
+            self.send_json({"upload_dir": UPLOAD_STORAGE.directory(),
+                            "chunk_size": DEFAULT_UPLOAD_CHUNK, "max_chunk_size": MAX_UPLOAD_CHUNK})
+            return
+
+        if parsed.path == '/search':
+            qs = urllib.parse.parse_qs(parsed.query)
+            try:
+                self.send_json(SEARCH.search(
+                    qs.get('q', [''])[0],
+                    mode=qs.get('mode', ['auto'])[0],
+                    limit=qs.get('limit', [SEARCH_PAGE_DEFAULT])[0],
+                    cursor=qs.get('cursor', [None])[0],
+                ))
+            except ValueError as e:
+                self.send_json({"error": str(e)}, 400)
+            return
+
+        if parsed.path == '/events':
+            self.send_events()
+            return
+
+        if parsed.path == '/metrics':
+            qs = urllib.parse.parse_qs(parsed.query)
+            if qs.get('format', [''])[0] == 'json' or 'application/json' in self.headers.get('Accept', ''):
+                self.send_json(METRICS.report(self.server.stats))
+            else:
+                self.send_body(METRICS.prometheus(self.server.stats), 'text/plain; version=0.0.4; charset=utf-8')
+            return
+
+        if parsed.path == '/thumb':
+            qs = urllib.parse.parse_qs(parsed.query)
+            path = qs.get('path', [''])[0]
+            try:
+                size = min(max(int(qs.get('size', [THUMB_SIZE])[0]), 32), THUMB_MAX_SIZE)
+                key, data = THUMBNAILS.get(path, size)
+            except concurrent.futures.TimeoutError:
+                self.send_body(b"Preview pending", code=202,
+                               headers=[('Retry-After', '1'), ('Cache-Control', 'no-store')])
+                return
+            except (OSError, ValueError):
+                data = None
+            if not data:
+                self.send_body(b"No preview", code=404)
+                return
+            headers = [('ETag', f'"{key}"'), ('Cache-Control', 'private, max-age=86400')]
+            if self.not_modified(f'"{key}"', headers): return
+            self.send_body(data, 'image/jpeg', headers=headers)
+            return
+
+        if parsed.path == '/api/manifest':
+            qs = urllib.parse.parse_qs(parsed.query)
+            path = qs.get('path', [''])[0]
+            if not os.path.isdir(path):
+                self.send_json({"error": "Not a directory"}, 404)
+                return
+            body = self.start_stream('application/x-ndjson')
+            if self.command == 'HEAD': return
+            body.write(json.dumps({"root": path, "fields": MANIFEST_FIELDS}).encode() + b'\n')
+            for row in walk_manifest(path):
+                body.write(json.dumps(row, ensure_ascii=False).encode('utf-8', 'surrogateescape') + b'\n')
+            body.close()
+            return
+
+        if parsed.path == '/browse':
+            qs = urllib.parse.parse_qs(parsed.query)
+            path = qs.get('path', ["/storage/emulated/0"])[0]
+            if not os.path.exists(path): path = UPLOAD_STORAGE.directory()
+            
+            if not os.path.isdir(path):
+                self.send_error(404)
+                return
+
+            page = [f"<!DOCTYPE html><html><head><meta charset='utf-8'><style>{CSS_VARS}</style><script>function toggleTheme(){{var b=document.body;b.setAttribute('data-theme',b.getAttribute('data-theme')==='dark'?'light':'dark')}}window.onload=function(){{document.body.setAttribute('data-theme',localStorage.getItem('theme')||'dark')}}</script></head><body>"]
+            page.append(f"<div class='card'><h3>📂 {html.escape(os.path.basename(path)) or 'Root'}</h3>")
+            parent = os.path.dirname(path)
+            if parent != path:
+                page.append(f"<a href='/browse?path={urllib.parse.quote(parent)}'>⬅️ Up Level</a><hr>")
+            
+            page.append("<input type='search' id='find' placeholder='Search all files (name, prefix*, *.ext)'>")
+            page.append("<select id='sort'><option value='name:asc'>Name</option><option value='name:desc'>Name (Z-A)</option>"
+                        "<option value='mtime:desc'>Newest</option><option value='mtime:asc'>Oldest</option>"
+                        "<option value='size:desc'>Largest</option><option value='size:asc'>Smallest</option></select>")
+            page.append("<div><label><input type='checkbox' id='all'> All</label> "
+                        "<button id='get' disabled>Download selected (0)</button></div>")
+            page.append("<small id='live'></small><ul id='rows'></ul><div id='more'>Loading…</div>")
+            page.append("</div><div class='card'>Current Upload Dir: "+UPLOAD_STORAGE.directory()+"</div><button onclick='toggleTheme()'>Theme</button>")
+            dir_js = json.dumps(path).replace('</', '<\\/')
+            page.append(f"<script>var DIR = {dir_js};{BROWSE_SCRIPT}</script></body></html>")
+            
+            self.send_body("".join(page), 'text/html; charset=utf-8', validate=True)
+            return
+
+        if parsed.path == '/batch':
+            qs = urllib.parse.parse_qs(parsed.query)
+            paths = BATCHES.get(qs['id'][0]) if 'id' in qs else qs.get('path', [])[:BATCH_MAX_ITEMS]
+            if not paths:
+                self.send_error(404)
+                return
+            self.send_batch(paths)
+            return
+
+        if parsed.path == '/download' or parsed.path == '/zip':
+            qs = urllib.parse.parse_qs(parsed.query)
+            path = qs.get('path', [None])[0]
+            if not path or not os.path.exists(path):
+                self.send_error(404)
+                return
+            
+            if parsed.path == '/zip' and os.path.isdir(path):
+                try:
+                    level = int(qs.get('level', [ZIP_COMPRESS_LEVEL])[0])
+                except ValueError:
+                    level = ZIP_COMPRESS_LEVEL
+                try:
+                    self.send_zip(path, min(max(level, 0), 9))
+                except Exception as e:
+                    # The body is cut short, so the connection cannot be reused.
+                    self.close_connection = True
+                    logging.error(f"DEBUG: Zip of {path} failed: {e}")
+                return
+
+            try:
+                self.send_file(path)
+            except Exception as e:
+                self.close_connection = True
+                logging.error(f"DEBUG: Download of {path} failed: {e}")
+            return
+
+        # Unknown paths must still get a response on a persistent connection.
+        self.send_error(404)
+
+    def send_events(self):
+        """Stream /events until the client goes away.
+
+        On the asyncio engine only the headers are sent here; the server
+        picks up ``self.events`` and writes the stream from its loop.
+        """
+        # The body runs until the connection closes.
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        if self.command == 'HEAD': return
+        asynchronous = isinstance(self.server, AsyncHTTPServer)
+        sub = EVENTS.subscribe(self.headers.get('Last-Event-ID'), self.server.loop if asynchronous else None)
+        if asynchronous:
+            self.events = sub
+            return
+        try:
+            while not sub.closed:
+                self.wfile.write(sub.drain() or EVENTS_PING)
+                self.wfile.flush()
+                sub.wait(EVENTS_KEEPALIVE)
+        except OSError:
+            pass
+        finally:
+            EVENTS.unsubscribe(sub)
+
+    def do_HEAD(self):
+        # Same headers as GET, but any body writes are discarded.
+        wfile = self.wfile
+        try:
+            self.do_GET()
+        finally:
+            self.wfile = wfile
+
+    def end_headers(self):
+        # Connection headers go last, once send_error and the handlers have
+        # had their say on whether this connection is closed.
+        if self.connection_requests >= MAX_KEEPALIVE_REQUESTS:
+            self.close_connection = True
+        if self.close_connection:
+            if not self.connection_header_sent: self.send_header('Connection', 'close')
+        elif self.request_version >= 'HTTP/1.1':
+            self.send_header('Keep-Alive', f'timeout={KEEPALIVE_TIMEOUT}, max={MAX_KEEPALIVE_REQUESTS}')
+        super().end_headers()
+        if self.command == 'HEAD':
+            self.wfile = _NullWriter()
+
+    def send_zip(self, path, level):
+        """Send directory ``path`` as a zip.
+
+        Mostly-media folders (and ``level`` 0) get a stored archive of exact
+        size with Range support; others are deflated as a stream. With
+        ZIP_CACHE_DIR set, built archives are kept and later served as files.
+        """
+        name = os.path.basename(path) + ".zip"
+        disposition = ('Content-Disposition', f'attachment; filename="{name}"')
+        layout = ZipLayout(path)
+        stored = level == 0 or layout.compressed_bytes >= layout.data_bytes * ZIP_STORED_SHARE
+        key = f"{layout.signature}-{0 if stored else level}"
+        etag = f'"zip-{key}"'
+
+        cached = zip_cache_path(key)
+        if cached and os.path.exists(cached):
+            os.utime(cached)
+            self.send_file(cached, 'application/zip', etag=etag, name=name)
+            return
+
+        if not stored:
+            # No Content-Length, but the layout's stat pass gives the bytes to
+            # read: sent as a hint and used for the app's progress bar.
+            body = self.start_stream('application/zip', [disposition, ('X-Uncompressed-Length', str(layout.data_bytes))])
+            if self.command == 'HEAD': return
+            cache = ZipCacheWriter(cached) if cached else None
+            manager = AppManager.get()
+            manager.transfer_started(self, layout.data_bytes)
+            try:
+                z = ZipStreamer(_TeeWriter(body, cache) if cache else body, level,
+                                progress=lambda n: manager.transfer_bytes(self, n))
+                z.write_files((fn, arcname) for fn, arcname, st, entry in layout.files)
+                z.close()
+                body.close()
+            except BaseException:
+                if cache: cache.abort()
+                raise
+            finally:
+                manager.transfer_finished(self)
+            if cache: cache.commit()
+            AppManager.get().add_history("Zipped Folder", f"Served {name}")
+            return
+
+        if self.send_layout(layout, name, 'application/zip', etag, cached):
+            AppManager.get().add_history("Zipped Folder", f"Served {name}")
+
+    def send_layout(self, layout, name, content_type, etag, cached=None):
+        """Send a planned ArchiveLayout with Content-Length and single-range support.
+
+        Returns True when the end of the archive was sent.
+        """
+        size = layout.size
+        ranges = None
+        range_header = self.headers.get('Range')
+        # Only the ETag validates a resume: the newest member mtime misses a
+        # file replaced by an older one, or one removed.
+        if range_header and if_range_matches(self.headers.get('If-Range'), etag, None):
+            ranges = parse_range_header(range_header, size)
+        if ranges == []:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        if ranges and len(ranges) > 1:
+            ranges = None
+        start, end = ranges[0] if ranges else (0, size - 1)
+
+        self.send_response(206 if ranges else 200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(layout.mtime, usegmt=True))
+        self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+        self.send_header('Content-Type', content_type)
+        if ranges: self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if self.command == 'HEAD': return False
+
+        cache = ZipCacheWriter(cached) if cached and not ranges else None
+        manager = AppManager.get()
+        manager.transfer_started(self, end - start + 1)
+        try:
+            layout.write_range(self, start, end + 1, cache, progress=lambda n: manager.transfer_bytes(self, n))
+        except BaseException:
+            if cache: cache.abort()
+            raise
+        finally:
+            manager.transfer_finished(self)
+        if cache: cache.commit()
+        return end == size - 1
+
+    def send_batch(self, paths, base=None):
+        """Send the chosen files and folders as one tar."""
+        layout = TarLayout(paths, base)
+        if not layout.files:
+            self.send_error(404)
+            return
+        name = f"santhushare-{len(layout.files)}-files.tar"
+        try:
+            if self.send_layout(layout, name, 'application/x-tar', f'"tar-{layout.signature}"'):
+                AppManager.get().add_history("Batch Sent", f"{len(layout.files)} files in {name}")
+        except Exception as e:
+            self.close_connection = True
+            logging.error(f"DEBUG: Batch download failed: {e}")
+
+    def send_file(self, path, content_type='application/octet-stream', etag=None, name=None):
+        """Send ``path`` honouring Range / If-Range, as 200, 206 or 416."""
+        st = os.stat(path)
+        size = st.st_size
+        etag = etag or f'"{st.st_mtime_ns:x}-{size:x}"'
+        last_modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        name = name or os.path.basename(path)
+
+        ranges = None
+        range_header = self.headers.get('Range')
+        if range_header and self.command in ('GET', 'HEAD') and if_range_matches(self.headers.get('If-Range'), etag, st.st_mtime):
+            ranges = parse_range_header(range_header, size)
+
+        if ranges == []:
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{size}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        # A file with no known digest is hashed on HASH_POOL once a full
+        # download of it is done, so the body keeps going through sendfile
+        # and later responses for this version, even after a restart, carry
+        # the digest.
+        digests = known_digests(path, st)
+        want = self.headers.get('Want-Repr-Digest')
+        hash_after = not digests and DOWNLOAD_DIGESTS and ranges is None and self.command == 'GET'
+        if want and DOWNLOAD_DIGESTS and wanted_digest(want) not in digests:
+            # Asked for by a client that may only ever fetch ranges; a HEAD
+            # is how it asks for the digest once it has every segment.
+            hash_after = False
+            job = digest_in_background(path, st, {wanted_digest(want)})
+            if self.command == 'HEAD':
+                try:
+                    digests = dict(digests, **job.result(KEEPALIVE_TIMEOUT))
+                except (concurrent.futures.TimeoutError, OSError):
+                    pass
+
+        with open(path, 'rb') as f:
+            if ranges is None:
+                self.send_response(200)
+            else:
+                self.send_response(206)
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('ETag', etag)
+            self.send_header('Last-Modified', last_modified)
+            self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+            if digests:
+                self.send_header('Repr-Digest', format_digests(digests))
+                if 'sha-256' in digests:
+                    self.send_header('Digest', 'SHA-256=' + base64.b64encode(digests['sha-256']).decode())
+
+            if ranges is None or len(ranges) == 1:
+                start, end = ranges[0] if ranges else (0, size - 1)
+                self.send_header('Content-Type', content_type)
+                if ranges: self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+                self.send_header('Content-Length', str(end - start + 1))
+                self.end_headers()
+                if self.command != 'HEAD':
+                    self.send_file_range(f, start, end - start + 1)
+                    if hash_after: digest_in_background(path, st, {wanted_digest(want)})
+            else:
+                boundary = os.urandom(12).hex()
+                heads = [
+                    (f"\r\n--{boundary}\r\nContent-Type: {content_type}\r\n"
+                     f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode()
+                    for start, end in ranges
+                ]
+                tail = f"\r\n--{boundary}--\r\n".encode()
+                length = sum(len(h) for h in heads) + sum(e - s + 1 for s, e in ranges) + len(tail)
+                self.send_header('Content-Type', f'multipart/byteranges; boundary={boundary}')
+                self.send_header('Content-Length', str(length))
+                self.end_headers()
+                if self.command == 'HEAD': return
+                for head, (start, end) in zip(heads, ranges):
+                    self.wfile.write(head)
+                    self.send_file_range(f, start, end - start + 1)
+                self.wfile.write(tail)
+
+        if self.command != 'HEAD' and (ranges is None or ranges[-1][1] == size - 1):
+            AppManager.get().add_history("File Sent", name)
+
+    def send_file_range(self, f, offset, length, hashes=None):
+        """Write ``length`` bytes of ``f`` starting at ``offset`` to the client.
+
+        Uses the kernel's sendfile to go straight from the file descriptor to
+        the socket when possible, otherwise writes memoryview slices of a
+        memory-mapped window, so file data is never copied into Python objects.
+        Bulk requests go out in SCHED_SLICE slices paced by the scheduler.
+        With ``hashes`` (a zip CRC feed, say) the mapped path is used and fed too.
+        """
+        if hashes is None and hasattr(self.wfile, 'sendfile'):
+            # The asyncio engine sends and paces the range from its loop, so
+            # this worker is free as soon as it is queued.
+            self.wfile.sendfile(f, offset, length, self.pace)
+            self.sent_direct += length
+            return
+        if not self.pace:
+            self._send_file_range(f, offset, length, hashes)
+            return
+        end = offset + length
+        while offset < end:
+            n = min(SCHED_SLICE, end - offset)
+            self.pace(n)
+            self._send_file_range(f, offset, n, hashes)
+            offset += n
+
+    def _send_file_range(self, f, offset, length, hashes=None):
+        if length <= 0: return
+        sock = getattr(self, 'connection', None)
+        if hashes is None and USE_SENDFILE and sock is not None:
+            self.wfile.flush()
+            while length > 0:
+                sent = sock.sendfile(f, offset, min(length, SENDFILE_CHUNK))
+                if not sent: raise ConnectionError("sendfile made no progress")
+                # sendfile bypasses wfile, so it is counted here.
+                self.sent_direct += sent
+                offset += sent
+                length -= sent
+            return
+
+        end = offset + length
+        while offset < end:
+            # Map bounded windows so multi-GB files work on 32-bit devices too.
+            base = offset - offset % mmap.ALLOCATIONGRANULARITY
+            window = min(MMAP_WINDOW, end - base)
+            with mmap.mmap(f.fileno(), window, access=mmap.ACCESS_READ, offset=base) as mm:
+                with memoryview(mm) as view:
+                    pos = offset - base
+                    while pos < window:
+                        step = min(window - pos, 1024 * 1024)
+                        self.wfile.write(view[pos:pos + step])
+                        if hashes: hashes.update(view[pos:pos + step])
+                        pos += step
+            offset = base + window
+
+    def do_PUT(self):
+        if not self.check_auth(): return
+        parsed = urllib.parse.urlparse(self.path)
+        if not is_upload_api(parsed.path):
+            self.close_if_body_unread()
+            self.send_json({"error": "Not found"}, 404)
+            return
+        self.handle_upload_api(parsed)
+
+    do_PATCH = do_PUT
+    do_DELETE = do_PUT
+
+    def send_json(self, obj, code=200, validate=False):
+        self.send_body(json.dumps(obj), 'application/json', code, validate=validate)
+
+    def read_json(self, limit=64 * 1024):
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        if length > limit:
+            self.close_connection = True  # The body is left unread.
+            raise ValueError("Request body too large")
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def handle_upload_api(self, parsed):
+        # POST /api/upload                 create a session: {name, size, chunk_size,
+        #                                  optional sha256 (hex) or digest (Repr-Digest syntax)}
+        # GET  /api/upload/<id>            session state, including received chunks
+        # PUT  /api/upload/<id>?index=N    store chunk N (PATCH is accepted too); a
+        #                                  Content-Digest header is checked against it
+        # POST /api/upload/<id>/finish     move the completed file into place
+        # DELETE /api/upload/<id>          abandon the session
+        parts = parsed.path.strip('/').split('/')[2:]
+        try:
+            if not parts:
+                if self.command != 'POST':
+                    self.send_json({"error": "Method not allowed"}, 405)
+                    return
+                req = self.read_json()
+                name = os.path.basename(str(req.get('name', '')).replace('\\', '/'))
+                size = int(req.get('size', -1))
+                chunk_size = int(req.get('chunk_size') or DEFAULT_UPLOAD_CHUNK)
+                if not name or size < 0 or not 0 < chunk_size <= MAX_UPLOAD_CHUNK:
+                    self.send_json({"error": "Invalid upload"}, 400)
+                    return
+                expected = parse_digests(req.get('digest') or self.headers.get('Repr-Digest'))
+                if req.get('sha256'): expected['sha-256'] = bytes.fromhex(str(req['sha256']))
+                session = UPLOAD_SESSIONS.create(name, size, chunk_size, expected)
+                logging.error(f"DEBUG: Upload session {session.id} for {name} ({size} bytes)")
+                self.send_json(session.to_dict(), 201)
+                return
+
+            session = UPLOAD_SESSIONS.get(parts[0])
+            if session is None:
+                self.close_if_body_unread()
+                self.send_json({"error": "Unknown upload"}, 404)
+                return
+
+            action = parts[1] if len(parts) > 1 else None
+            if self.command == 'GET' and action is None:
+                self.send_json(session.to_dict())
+            elif self.command in ('PUT', 'PATCH') and action is None:
+                qs = urllib.parse.parse_qs(parsed.query)
+                self.receive_chunk(session, int(qs.get('index', ['-1'])[0]))
+            elif self.command == 'POST' and action == 'finish':
+                self.finish_upload(session)
+            elif self.command == 'DELETE' and action is None:
+                UPLOAD_SESSIONS.remove(session)
+                AppManager.get().transfer_finished(session.id)
+                self.send_json({"id": session.id, "aborted": True})
+            else:
+                self.send_json({"error": "Method not allowed"}, 405)
+        except DigestMismatch as e:
+            self.close_connection = True
+            self.send_json({"error": str(e)}, 422)
+        except (ValueError, KeyError) as e:
+            self.close_connection = True
+            self.send_json({"error": str(e)}, 400)
+        except Exception as e:
+            logging.error(f"DEBUG: Upload API error: {e}")
+            self.close_connection = True
+            self.send_json({"error": str(e)}, 500)
+
+    def receive_chunk(self, session, index):
+        length = session.chunk_length(index)
+        if not 0 <= index < session.chunk_count or int(self.headers.get('Content-Length', -1)) != length:
+            self.close_connection = True
+            self.send_json({"error": f"Chunk {index} must be {length} bytes"}, 400)
+            return
+
+        check = parse_digests(self.headers.get('Content-Digest'))
+        hashes = StreamDigests(check) if check else None
+        manager = AppManager.get()
+        manager.transfer_started(session.id, session.size, sum(map(session.chunk_length, list(session.received))))
+        # A resent chunk was counted the first time round.
+        counted = 0 if index in session.received else 1
+        written = 0
+        try:
+            with open(UPLOAD_SESSIONS.part_path(session), 'r+b') as f:
+                f.seek(index * session.chunk_size)
+                remaining = length
+                while remaining > 0:
+                    data = self.rfile.read(min(UPLOAD_CHUNK_SIZE, remaining))
+                    if not data: raise ConnectionError(f"Chunk {index} of {session.id} truncated")
+                    if self.pace: self.pace(len(data))
+                    f.write(data)
+                    if hashes: hashes.update(data)
+                    remaining -= len(data)
+                    written += len(data)
+                    manager.transfer_bytes(session.id, len(data) * counted)
+            # A chunk that fails its check is not marked received, so it gets resent.
+            if hashes: hashes.verify(check)
+        except BaseException:
+            # The chunk will be sent again from the start.
+            manager.transfer_bytes(session.id, -written * counted)
+            raise
+
+        with session.lock:
+            session.received.add(index)
+            UPLOAD_SESSIONS.save(session)
+            done = len(session.received)
+        self.send_json({"index": index, "received": done, "chunks": session.chunk_count})
+
+    def finish_upload(self, session):
+        with session.lock:
+            missing = [i for i in range(session.chunk_count) if i not in session.received]
+            if missing:
+                self.send_json({"error": "Upload incomplete", "missing": missing}, 409)
+                return
+            part = UPLOAD_SESSIONS.part_path(session)
+            hashes = None
+            if session.expected:
+                # Chunks may arrive in any order, so the whole-file check is one read at the end.
+                hashes = hash_file(part, {'sha-256', *session.expected})
+                try:
+                    hashes.verify(session.expected)
+                except DigestMismatch as e:
+                    UPLOAD_SESSIONS.remove(session)
+                    AppManager.get().transfer_finished(session.id)
+                    self.send_json({"error": f"{e}; upload discarded"}, 422)
+                    return
+            target_dir = UPLOAD_STORAGE.directory()
+            dest = os.path.join(target_dir, session.name)
+            UPLOAD_STORAGE.place(part, dest, session.size)
+            UPLOAD_STORAGE.flush()
+            UPLOAD_SESSIONS.remove(session, keep_data=True)
+            if hashes:
+                remember_digests(dest, hashes.digests())
+                get_hash_index(target_dir).add(session.name, hashes.hashers['sha-256'].hexdigest())
+            else:
+                get_hash_index(target_dir).add(session.name)
+
+        logging.error(f"DEBUG: Upload session {session.id} completed: {dest}")
+        AppManager.get().transfer_finished(session.id)
+        AppManager.get().add_history("File Received", session.name)
+        AppManager.get().send_notification("New File Received", f"{session.name}")
+        self.send_json({"name": session.name, "size": session.size})
+
+    def handle_have(self):
+        # POST /api/have {files: [{name, size, sha256}], link: bool}
+        # Each file comes back as "exists" (already there under that name),
+        # "linked"/"copied" (made from identical content under another name,
+        # when link is set), or "missing" (needs uploading). Entries without
+        # sha256 come back "candidate" when a file of that size is there, so
+        # clients only hash what could be a duplicate.
+        try:
+            req = self.read_json(limit=4 * 1024 * 1024)
+            files = req.get('files', [])
+            if not isinstance(files, list) or len(files) > MAX_HAVE_FILES: raise ValueError("Bad file list")
+            wanted = []
+            for item in files:
+                name = os.path.basename(str(item.get('name', '')).replace('\\', '/'))
+                digest = str(item.get('sha256', '')).lower() or None
+                if not name or name.startswith('.') or (digest and not re.fullmatch(r'[0-9a-f]{64}', digest)):
+                    raise ValueError("Bad file entry")
+                wanted.append((name, int(item.get('size', -1)), digest))
+        except (ValueError, TypeError, AttributeError) as e:
+            self.send_json({"error": str(e)}, 400)
+            return
+
+        index = get_hash_index(UPLOAD_STORAGE.directory())
+        index.refresh()
+        sizes = index.sizes() if None in (digest for _, _, digest in wanted) else set()
+        results = []
+        for name, size, digest in wanted:
+            if digest is None:
+                results.append({"name": name, "status": "candidate" if size in sizes else "missing"})
+                continue
+            status = "missing"
+            src = index.find(digest, size, prefer=name)
+            if src == name:
+                status = "exists"
+            elif src and req.get('link'):
+                try:
+                    status = index.link(src, name, digest)
+                    AppManager.get().add_history("File Deduplicated", f"{name} (same as {src})")
+                except OSError as e:
+                    logging.error(f"DEBUG: Could not reuse {src} for {name}: {e}")
+            results.append({"name": name, "status": status})
+        self.send_json({"files": results})
+
+    def do_POST(self):
+        if not self.check_auth(): return
+        parsed = urllib.parse.urlparse(self.path)
+        if is_upload_api(parsed.path):
+            self.handle_upload_api(parsed)
+            return
+
+        if parsed.path == '/api/have':
+            self.handle_have()
+            return
+
+        if parsed.path == '/api/fetch':
+            # POST {root, files: [manifest paths]} -> tar of just those files.
+            try:
+                req = self.read_json(limit=32 * 1024 * 1024)
+                root, names = str(req.get('root', '')), req.get('files', [])
+                if not isinstance(names, list) or not names or len(names) > MAX_FETCH_FILES:
+                    raise ValueError("Bad file list")
+                paths = resolve_fetch_paths(root, names)
+            except (ValueError, TypeError, AttributeError) as e:
+                self.send_json({"error": str(e)}, 400)
+                return
+            if not os.path.isdir(root):
+                self.send_json({"error": "Not a directory"}, 404)
+                return
+            self.send_batch(paths, base=root)
+            return
+
+        if parsed.path == '/batch':
+            # Form post of path=... fields; redirect to a resumable GET.
+            length = int(self.headers.get('Content-Length', 0) or 0)
+            if length > BATCH_FORM_LIMIT:
+                self.close_connection = True
+                self.send_body(b"Selection too large", code=413)
+                return
+            form = urllib.parse.parse_qs(self.rfile.read(length).decode('utf-8', 'surrogateescape'))
+            paths = form.get('path', [])[:BATCH_MAX_ITEMS]
+            if not paths:
+                self.send_body(b"Nothing selected", code=400)
+                return
+            self.send_body(b"", code=303, headers=[('Location', f"/batch?id={BATCHES.add(paths)}")])
+            return
+
+        try:
+            logging.error("DEBUG: Starting POST request")
+            manager = AppManager.get()
+            # Progress runs over the whole body, part headers included.
+            manager.transfer_started(self, int(self.headers.get('Content-Length', 0) or 0))
+            received = []
+
+            def on_received(upload):
+                received.append(upload)
+                target_dir, fname = os.path.split(upload.path)
+                get_hash_index(target_dir).add(fname, upload.sha256.hexdigest())
+                manager.add_history("File Received", fname)
+                manager.send_notification("New File Received", f"{fname}")
+
+            def on_write(n):
+                manager.transfer_bytes(self, n)
+
+            # A sha256 (hex) or digest (Repr-Digest syntax) field applies to the next file.
+            expected = {}
+
+            def on_field(part):
+                try:
+                    if part.name == 'sha256': expected['sha-256'] = bytes.fromhex(part.value.strip())
+                    elif part.name == 'digest': expected.update(parse_digests(part.value))
+                except ValueError:
+                    raise MultipartError(f"Bad {part.name} field")
+
+            def open_dest(fname):
+                logging.error(f"DEBUG: Streaming upload of {fname}")
+                want = dict(expected)
+                expected.clear()
+                return UPLOAD_STORAGE.open(fname, on_close=on_received, on_write=on_write, expected=want)
+
+            rfile = _PacedReader(self.rfile, self.pace) if self.pace else self.rfile
+            parse_multipart_rfile(rfile, self.headers, file_factory=open_dest, on_field=on_field,
+                                  file_fields=UPLOAD_FILE_FIELDS)
+            UPLOAD_STORAGE.flush()
+            logging.error(f"DEBUG: Received {len(received)} files")
+            self.send_body(b"Success")
+        except (MultipartError, DigestMismatch) as e:
+            logging.error(f"DEBUG: Bad upload: {e}")
+            self.close_connection = True
+            self.send_error(422 if isinstance(e, DigestMismatch) else 400, str(e))
+        except Exception as e:
+            logging.error(f"DEBUG: POST Error: {e}")
+            if isinstance(e, OSError): UPLOAD_STORAGE.invalidate()
+            self.send_error(500, str(e))
+        finally:
+            AppManager.get().transfer_finished(self)
+
+class ReusableTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True):
+        print("Initializing ReusableTCPServer with reuse_address=True")
+        self.stats = ServerStats()
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+
+
+# --- asyncio Engine ---
+# Connections live on one event loop with non-blocking sockets, so idle or
+# slow clients cost a coroutine rather than an OS thread. Each parsed request
+# runs the unchanged SecureHandler in a small worker pool, talking to the
+# loop through blocking file-like bridges. Request bodies up to
+# ASYNC_BODY_BUFFER (an upload chunk) are read on the loop before a worker is
+# taken, and file ranges are sent and paced by loop tasks, so a slow client
+# ties up a worker only for streamed bodies: large form uploads, deflated
+# zips and other generated responses. Until those are moved onto the loop
+# too, the threaded engine stays the default and this one is opt-in.
+SERVER_ENGINE = "threaded"
+ASYNC_WORKERS = 16
+ASYNC_READ_LIMIT = 256 * 1024
+ASYNC_WRITE_HIGH_WATER = 1024 * 1024
+ASYNC_BODY_BUFFER = DEFAULT_UPLOAD_CHUNK
+_CONTENT_LENGTH_RE = re.compile(rb'\r\ncontent-length:[ \t]*(\d+)', re.I)
+_EXPECT_CONTINUE_RE = re.compile(rb'\r\nexpect:[ \t]*100-continue', re.I)
+
+
+def _run_on_loop(loop, coro, timeout=KEEPALIVE_TIMEOUT):
+    # A peer that stalls this long is treated like a socket timeout; this also
+    # frees workers if the loop stops underneath them. Waits whose stalls are
+    # timed on the loop itself pass ``timeout=None``.
+    if loop.is_closed() or not loop.is_running():
+        coro.close()
+        raise ConnectionError("Server stopped")
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        future.cancel()
+        raise TimeoutError("Client stalled")
+    except concurrent.futures.CancelledError:
+        raise ConnectionError("Connection closed")
+
+
+async def _within_keepalive(aw):
+    try:
+        return await asyncio.wait_for(aw, KEEPALIVE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise TimeoutError("Client stalled") from None
+
+
+class _AsyncReader:
+    def __init__(self, loop, reader, head):
+        self.loop = loop
+        self.reader = reader
+        self.buf = bytearray(head)
+
+    def _call(self, coro):
+        return _run_on_loop(self.loop, coro)
+
+    async def _read_exactly(self, n):
+        try:
+            return await self.reader.readexactly(n)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+
+    def read(self, n=-1):
+        if n is None or n < 0:
+            data = bytes(self.buf) + self._call(self.reader.read())
+            self.buf.clear()
+            return data
+        data = bytes(self.buf[:n])
+        del self.buf[:n]
+        if len(data) < n:
+            # StreamReader pauses the socket once its buffer is full, so a
+            # handler that stops reading applies backpressure to the client.
+            data += self._call(self._read_exactly(n - len(data)))
+        return data
+
+    def readline(self, limit=-1):
+        idx = self.buf.find(b'\n')
+        if idx < 0 and (limit < 0 or len(self.buf) < limit):
+            try:
+                self.buf += self._call(self.reader.readuntil(b'\n'))
+            except asyncio.IncompleteReadError as e:
+                self.buf += e.partial
+            except asyncio.LimitOverrunError:
+                pass
+            idx = self.buf.find(b'\n')
+        end = len(self.buf) if idx < 0 else idx + 1
+        if limit >= 0: end = min(end, limit)
+        line = bytes(self.buf[:end])
+        del self.buf[:end]
+        return line
+
+    def close(self):
+        pass
+
+
+class _AsyncWriter:
+    """Response bridge from a worker to the loop.
+
+    File ranges are sent by a loop task so the worker can move on; anything
+    written after one queues behind it to keep the body in order, and the
+    worker only waits once more than ASYNC_WRITE_HIGH_WATER is queued.
+    """
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+        self.pending = None  # the last queued body task
+        self.queued = 0
+        self.callbacks = []
+
+    async def _write(self, data):
+        if self.pending is None or self.pending.done():
+            if self.pending: self.pending.result()  # a failed range fails the response
+            self.writer.write(data)
+            await _within_keepalive(self.writer.drain())
+            return
+        self.queued += len(data)
+        self.pending = self.loop.create_task(self._write_after(self.pending, bytes(data)))
+        if self.queued > ASYNC_WRITE_HIGH_WATER:
+            await self.pending
+
+    async def _write_after(self, previous, data):
+        try:
+            await previous
+            self.writer.write(data)
+            await _within_keepalive(self.writer.drain())
+        finally:
+            self.queued -= len(data)
+
+    def write(self, data):
+        # Stalls are timed on the loop, so a long queued range is no timeout.
+        _run_on_loop(self.loop, self._write(data), timeout=None)
+        return len(data)
+
+    async def _sendfile_after(self, previous, f, offset, length, pace):
+        with f:
+            if previous: await previous
+            await _within_keepalive(self.writer.drain())
+            end = offset + length
+            while offset < end:
+                n = min(SCHED_SLICE, end - offset) if pace else end - offset
+                delay = pace.delay(n) if pace else 0
+                if delay: await asyncio.sleep(delay)
+                await _within_keepalive(self.loop.sendfile(self.writer.transport, f, offset, n))
+                offset += n
+
+    async def _queue_sendfile(self, f, offset, length, pace):
+        self.pending = self.loop.create_task(self._sendfile_after(self.pending, f, offset, length, pace))
+
+    def sendfile(self, f, offset, length, pace=None):
+        if length <= 0: return
+        # The handler closes ``f`` once this returns, so the task gets its own.
+        f = os.fdopen(os.dup(f.fileno()), 'rb')
+        try:
+            _run_on_loop(self.loop, self._queue_sendfile(f, offset, length, pace))
+        except BaseException:
+            f.close()
+            raise
+
+    def defer(self, callback):
+        """Run ``callback`` on the loop once the queued body is out (or failed)."""
+        self.callbacks.append(callback)
+
+    async def finish(self):
+        try:
+            if self.pending: await self.pending
+        finally:
+            for callback in self.callbacks:
+                try:
+                    callback()
+                except Exception as e:
+                    logging.error(f"DEBUG: Request cleanup failed: {e}")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class AsyncHTTPServer:
+    """Drop-in for ReusableTCPServer (serve_forever / shutdown / server_close)."""
+
+    def __init__(self, server_address, RequestHandlerClass, workers=ASYNC_WORKERS):
+        self.server_address = server_address
+        self.RequestHandlerClass = RequestHandlerClass
+        self.stats = ServerStats()
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="santhushare-worker")
+        self._stopped = threading.Event()
+        host, port = server_address
+        # Binding here surfaces "address in use" to ServerThread's retry loop.
+        self.server = self.loop.run_until_complete(asyncio.start_server(
+            self._serve_client, host, port, reuse_address=True, limit=ASYNC_READ_LIMIT))
+        self.server_address = self.server.sockets[0].getsockname()[:2]
+        print("Initializing AsyncHTTPServer")
+
+    def serve_forever(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self._stopped.set()
+
+    async def _close(self):
+        self.server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self.loop.stop()
+
+    def shutdown(self):
+        # Cancelling the connection tasks also releases any worker blocked on them.
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop)
+        self._stopped.wait()
+
+    def server_close(self):
+        self.server.close()
+        self.executor.shutdown(wait=False)
+        if not self.loop.is_running():
+            self.loop.close()
+
+    async def _serve_client(self, reader, writer):
+        writer.transport.set_write_buffer_limits(high=ASYNC_WRITE_HIGH_WATER)
+        peer = writer.get_extra_info('peername') or ('', 0)
+        self.stats.connection_opened()
+        served = 0
+        try:
+            while True:
+                # Waiting for the next request happens here, off the worker pool.
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), KEEPALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError,
+                        asyncio.TimeoutError, ConnectionError):
+                    break
+                match = _CONTENT_LENGTH_RE.search(head)
+                length = int(match.group(1)) if match else 0
+                if 0 < length <= ASYNC_BODY_BUFFER and not _EXPECT_CONTINUE_RE.search(head):
+                    # Buffered here, a slow upload chunk never waits on a worker.
+                    try:
+                        head += await self._read_body(reader, length)
+                    except (asyncio.TimeoutError, ConnectionError):
+                        break
+                close, events, body = await self.loop.run_in_executor(
+                    self.executor, self._run_handler, head, reader, writer, peer[:2], served)
+                served += 1
+                try:
+                    await body.finish()
+                except Exception as e:
+                    logging.error(f"DEBUG: Async response failed: {e}")
+                    break
+                if events:
+                    await self._stream_events(writer, events)
+                if close: break
+        except asyncio.CancelledError:
+            # Server shutdown; finish quietly so the stream callback sees a clean exit.
+            pass
+        except Exception as e:
+            logging.error(f"DEBUG: Async connection error: {e}")
+        finally:
+            self.stats.connection_closed()
+            writer.close()
+
+    @staticmethod
+    async def _read_body(reader, length):
+        body = bytearray()
+        while len(body) < length:
+            data = await asyncio.wait_for(reader.read(min(length - len(body), ASYNC_READ_LIMIT)), KEEPALIVE_TIMEOUT)
+            if not data: break  # the handler sees the short body
+            body += data
+        return bytes(body)
+
+    def _run_handler(self, head, reader, writer, client_address, served):
+        # Build the handler without BaseRequestHandler.__init__, which would
+        # expect a blocking socket, then serve exactly one request with it.
+        # The returned writer may still have body parts queued on the loop.
+        handler = self.RequestHandlerClass.__new__(self.RequestHandlerClass)
+        handler.server = self
+        handler.client_address = client_address
+        handler.request = handler.connection = None
+        handler.rfile = _AsyncReader(self.loop, reader, head)
+        handler.wfile = handler.body_queue = _AsyncWriter(self.loop, writer)
+        handler.close_connection = True
+        handler.connection_requests = served
+        try:
+            handler.handle_one_request()
+        except Exception as e:
+            logging.error(f"DEBUG: Async handler error: {e}")
+            return True, None, handler.body_queue
+        return handler.close_connection, getattr(handler, 'events', None), handler.body_queue
+
+    async def _stream_events(self, writer, sub):
+        # /events bodies are written here rather than from a worker thread.
+        try:
+            while not sub.closed:
+                writer.write(sub.drain() or EVENTS_PING)
+                await writer.drain()
+                await sub.wait_async(EVENTS_KEEPALIVE)
+        except ConnectionError:
+            pass
+        finally:
+            EVENTS.unsubscribe(sub)
+
+
+class ServerThread(threading.Thread):
+    def __init__(self, port, pwd, engine=SERVER_ENGINE):
+        super().__init__(daemon=True)
+        self.port = port
         self.pwd = pwd
+        self.engine = engine
         self.httpd = None
     
     def run(self):
@@ -607,9 +4847,13 @@ class ServerThread(threading.Thread):
         retries = 10
         while retries > 0:
             try:
-                self.httpd = ReusableTCPServer(('0.0.0.0', self.port), SecureHandler)
+                if self.engine == "asyncio":
+                    self.httpd = AsyncHTTPServer(('0.0.0.0', self.port), SecureHandler)
+                else:
+                    self.httpd = ReusableTCPServer(('0.0.0.0', self.port), SecureHandler)
                 self.httpd.password = self.pwd
-                print(f"Server started on port {self.port}")
+                print(f"Server started on port {self.port} ({self.engine} engine)")
+                SEARCH.start()
                 self.httpd.serve_forever()
                 break
             except OSError as e:
@@ -626,6 +4870,10 @@ class ServerThread(threading.Thread):
                 logging.error(f"Server Error: {str(e)}")
                 import traceback
                 traceback.print_exc()
+                if self.engine == "asyncio":
+                    logging.error("DEBUG: Falling back to the threaded engine")
+                    self.engine = "threaded"
+                    continue
                 break
     
     def stop(self):
@@ -666,6 +4914,18 @@ class SanthuShare(toga.App):
         
         self.progress_bar = toga.ProgressBar(max=100, value=0, style=Pack(padding_top=10, padding_bottom=10))
 
+        self.stats_label = toga.Label("", style=Pack(padding=5, font_size=10))
+        self.stats_task = None
+
+        # Bandwidth limits in MB/s, 0 for none; applied live.
+        limit_box = toga.Box(style=Pack(direction=ROW, padding=5))
+        self.total_limit = toga.NumberInput(min=0, step=1, value=0, on_change=self.on_limit_change, style=Pack(flex=1))
+        self.client_limit = toga.NumberInput(min=0, step=1, value=0, on_change=self.on_limit_change, style=Pack(flex=1))
+        limit_box.add(toga.Label("Total MB/s", style=Pack(padding=5)))
+        limit_box.add(self.total_limit)
+        limit_box.add(toga.Label("Per device", style=Pack(padding=5)))
+        limit_box.add(self.client_limit)
+
         theme_box = toga.Box(style=Pack(direction=ROW, padding=5))
         theme_spacer = toga.Box(style=Pack(flex=1))
         self.theme_switch = toga.Switch("Dark Mode", on_change=self.on_theme_change)
@@ -684,6 +4944,8 @@ class SanthuShare(toga.App):
         container.add(self.pwd_input)
         container.add(btn_box)
         container.add(self.progress_bar)
+        container.add(self.stats_label)
+        container.add(limit_box)
         container.add(toga.Label("History", style=Pack(padding=5, font_weight='bold')))
         container.add(self.history_list)
         
@@ -699,6 +4961,10 @@ class SanthuShare(toga.App):
         except:
              pass
 
+    def on_limit_change(self, widget):
+        mb = 1024 * 1024
+        SCHEDULER.configure(int((self.total_limit.value or 0) * mb), int((self.client_limit.value or 0) * mb))
+
     def on_start(self, widget):
         pwd = self.pwd_input.value
         if not pwd:
@@ -725,21 +4991,44 @@ class SanthuShare(toga.App):
         self.pwd_input.readonly = True
         
         AppManager.get().add_history("Server Started", f"Listening on {PORT}")
+        self.stats_task = asyncio.ensure_future(self.refresh_stats())
+
+    async def refresh_stats(self):
+        while True:
+            httpd = self.server_thread.httpd if self.server_thread else None
+            if httpd is not None:
+                r = METRICS.report(httpd.stats)
+                self.stats_label.text = (
+                    f"{r['requests']} req · {r['active_connections']} conn · {r['threads']} threads · "
+                    f"↓ {r['download_bps'] / 1048576:.1f} MB/s · ↑ {r['upload_bps'] / 1048576:.1f} MB/s")
+            # Catches uploads that went idle without another event to redraw.
+            self.progress_bar.value = AppManager.get().progress()
+            await asyncio.sleep(2)
 
     def on_stop(self, widget):
+        reason = "Manual Stop"
+        if self.stats_task:
+            self.stats_task.cancel()
+            self.stats_task = None
         if self.server_thread:
             self.server_thread.stop()
+            if self.server_thread.httpd:
+                reason += f" - {self.server_thread.httpd.stats.summary()}"
         self.status.text = "OFFLINE"
         self.status.style.color = 'red'
         self.qr_view.image = None
         self.start_btn.enabled = True
         self.stop_btn.enabled = False
         self.pwd_input.readonly = False
-        AppManager.get().add_history("Server Stopped", "Manual Stop")
+        AppManager.get().add_history("Server Stopped", reason)
 
-    def update_history_ui(self):
-        current_hist = AppManager.get().history
-        self.history_list.data = current_hist
+    def update_history_ui(self, new):
+        # New events arrive oldest first; only the last HISTORY_LIMIT can show.
+        data = self.history_list.data
+        for item in new[-HISTORY_LIMIT:]:
+            data.insert(0, item)
+        while len(data) > HISTORY_LIMIT:
+            data.remove(data[len(data) - 1])
 
     def request_android_permissions(self):
         if not ANDROID_AVAILABLE: return
@@ -0,0 +1,618 @@
+"""Command-line client for a running SanthuShare server.
+
+    python -m santhushare.client ls   http://PHONE:8080 [REMOTE_DIR]
+    python -m santhushare.client push http://PHONE:8080 FILE_OR_DIR...
+    python -m santhushare.client pull http://PHONE:8080 REMOTE_DIR [LOCAL_DIR]
+
+Transfers run over several persistent connections at once. Small files go
+many to a request (a multipart POST / up, an /api/fetch tar down); large ones
+are cut into chunks that travel in parallel (the resumable upload API up,
+Range requests on /download down). Running an interrupted push or pull again
+picks up where it stopped. Data is checked both ways: uploads carry SHA-256
+digests the server verifies, and downloads are checked against the manifest's
+SHA-256 or the file's Repr-Digest. Segmented pulls ask for a SHA-256 the
+server computes in the background if it has none; a file is only left
+unverified when the server cannot produce a digest this client can compute.
+The password comes from -p, $SANTHUSHARE_PASSWORD or a prompt.
+
+Only the standard library is used, so this runs anywhere Python does.
+"""
+import argparse
+import base64
+import concurrent.futures
+import getpass
+import hashlib
+import http.client
+import json
+import os
+import sys
+import tarfile
+import threading
+import time
+import urllib.parse
+
+CONNECTIONS = 4
+# Files this big or bigger are split into chunks; smaller ones are batched.
+LARGE_FILE = 8 * 1024 * 1024
+BATCH_BYTES = 32 * 1024 * 1024
+BATCH_FILES = 500
+SEGMENT_SIZE = 8 * 1024 * 1024
+IO_SIZE = 1024 * 1024
+RETRIES = 4
+TIMEOUT = 60
+BOUNDARY = "santhushare-client-boundary"
+PART_SUFFIX = ".santhushare-part"
+STATE_FILE = os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+                          "santhushare", "push-sessions.json")
+
+
+class ClientError(Exception):
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+# The server answers 422 when data arrived corrupted; that is worth a retry.
+CORRUPT = 422
+
+
+def sha256_digest(data):
+    return "sha-256=:" + base64.b64encode(hashlib.sha256(data).digest()).decode() + ":"
+
+
+# Repr-Digest algorithms downloads can be checked with, most preferred first.
+DIGEST_ALGORITHMS = {
+    "sha-256": hashlib.sha256,
+    "sha-512": hashlib.sha512,
+    "blake2b-256": lambda: hashlib.blake2b(digest_size=32),
+}
+WANT_DIGEST = "sha-256=10"
+
+
+def repr_digest(value):
+    """(algorithm, digest bytes) from a Repr-Digest header, or None."""
+    found = {}
+    for member in (value or "").split(","):
+        alg, _, encoded = member.strip().partition("=")
+        alg = alg.strip().lower()
+        if alg not in DIGEST_ALGORITHMS: continue
+        try:
+            found[alg] = base64.b64decode(encoded.split(";")[0].strip().strip(":"), validate=True)
+        except ValueError:
+            pass
+    return next(((alg, found[alg]) for alg in DIGEST_ALGORITHMS if alg in found), None)
+
+
+def file_digest(path, algorithm="sha-256"):
+    h = DIGEST_ALGORITHMS[algorithm]()
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(IO_SIZE)
+            if not data: return h.digest()
+            h.update(data)
+
+
+def format_size(n):
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024 or unit == "GB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+class Progress:
+    """Byte and file counters, with a live throughput line on a terminal."""
+
+    def __init__(self, total_bytes=0, total_files=0, quiet=False, out=sys.stderr):
+        self.total_bytes = total_bytes
+        self.total_files = total_files
+        self.bytes = 0
+        self.files = 0
+        self.skipped = 0
+        self.live = not quiet and out.isatty()
+        self.out = out
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self._shown = 0
+
+    def add(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+            now = time.monotonic()
+            due = self.live and now - self._shown >= 0.5
+            if due: self._shown = now
+        if due: self._show(now)
+
+    def file_done(self):
+        with self.lock:
+            self.files += 1
+
+    def rate(self):
+        return self.bytes / max(time.monotonic() - self.started, 1e-6)
+
+    def _show(self, now):
+        self.out.write(f"\r{format_size(self.bytes)} / {format_size(self.total_bytes)}  "
+                       f"{self.files}/{self.total_files} files  {format_size(self.rate())}/s   ")
+        self.out.flush()
+
+    def summary(self, verb):
+        if self.live: self.out.write("\n")
+        elapsed = time.monotonic() - self.started
+        line = (f"{verb} {self.files} files, {format_size(self.bytes)} in {elapsed:.1f}s "
+                f"({format_size(self.rate())}/s)")
+        if self.skipped: line += f", {self.skipped} already up to date"
+        return line
+
+
+class SessionState:
+    """Upload session ids of unfinished pushes, so running again resumes them."""
+
+    def __init__(self, path=STATE_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self.sessions = json.load(f)
+        except (OSError, ValueError):
+            self.sessions = {}
+
+    def get(self, key):
+        with self.lock:
+            return self.sessions.get(key)
+
+    def set(self, key, sid):
+        with self.lock:
+            if sid is None: self.sessions.pop(key, None)
+            else: self.sessions[key] = sid
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                tmp = self.path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(self.sessions, f)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"warning: cannot save upload state: {e}", file=sys.stderr)
+
+
+def local_files(paths):
+    """Yield ``(path, size)`` for the files named by ``paths`` and under its folders."""
+    for top in paths:
+        if os.path.isdir(top):
+            for d, subdirs, names in os.walk(top):
+                subdirs.sort()
+                for name in sorted(names):
+                    path = os.path.join(d, name)
+                    if os.path.isfile(path): yield path, os.path.getsize(path)
+        elif os.path.isfile(top):
+            yield top, os.path.getsize(top)
+        else:
+            raise ClientError(f"No such file or directory: {top}")
+
+
+def safe_relpath(rel):
+    """Local path parts for a manifest path, refusing anything that escapes."""
+    parts = rel.split("/")
+    if rel.startswith("/") or any(p in ("", ".", "..") for p in parts):
+        raise ClientError(f"Refusing unsafe path from server: {rel!r}")
+    return parts
+
+
+class Client:
+    """Talks to SecureHandler over one keep-alive connection per worker thread."""
+
+    def __init__(self, url, password, connections=CONNECTIONS, timeout=TIMEOUT):
+        parts = urllib.parse.urlsplit(url if "://" in url else "http://" + url)
+        if parts.scheme != "http" or not parts.hostname:
+            raise ClientError(f"Not an http:// server address: {url}")
+        self.host, self.port = parts.hostname, parts.port or 8080
+        self.auth = "Basic " + base64.b64encode(f"santhushare:{password}".encode()).decode()
+        self.connections = max(1, connections)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._opened = []
+        self._lock = threading.Lock()
+
+    # --- Requests ---
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            with self._lock:
+                self._opened.append(conn)
+        return conn
+
+    def _reset(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    def close(self):
+        with self._lock:
+            for conn in self._opened: conn.close()
+            self._opened.clear()
+
+    def request(self, method, path, body=None, headers=None, params=None):
+        """Send a request on this thread's connection and return the response.
+
+        Error statuses raise ClientError; otherwise the caller must read
+        the whole body before the connection is used again.
+        """
+        if params: path += "?" + urllib.parse.urlencode(params)
+        h = {"Authorization": self.auth}
+        h.update(headers or {})
+        conn = self._conn()
+        try:
+            conn.request(method, path, body=body, headers=h)
+            response = conn.getresponse()
+        except (OSError, http.client.HTTPException):
+            self._reset()
+            raise
+        if response.status == 401:
+            response.read()
+            raise ClientError("Authentication failed, check the password", 401)
+        if response.status >= 400:
+            data = response.read()
+            try:
+                message = json.loads(data)["error"]
+            except (ValueError, KeyError, TypeError):
+                message = data.decode("utf-8", "replace").strip()[:200] or response.reason
+            raise ClientError(f"{method} {path.split('?')[0]}: {response.status} {message}", response.status)
+        return response
+
+    def json(self, method, path, obj=None, params=None):
+        body = None if obj is None else json.dumps(obj).encode()
+        headers = {"Content-Type": "application/json"} if body is not None else None
+        return json.loads(self.request(method, path, body, headers, params).read() or b"null")
+
+    def retry(self, fn):
+        """Call ``fn``, retrying dropped connections and 5xx answers with backoff."""
+        for attempt in range(RETRIES + 1):
+            try:
+                return fn()
+            except ClientError as e:
+                if not (e.status and (e.status >= 500 or e.status == CORRUPT)) or attempt == RETRIES: raise
+            except (OSError, http.client.HTTPException) as e:
+                self._reset()
+                if attempt == RETRIES: raise ClientError(f"Connection failed: {e}")
+            time.sleep(min(10, 0.5 * 2 ** attempt))
+
+    def run_parallel(self, tasks):
+        """Run ``tasks`` across the connection pool; returns the error messages."""
+        errors = []
+        pool = concurrent.futures.ThreadPoolExecutor(self.connections, thread_name_prefix="transfer")
+        try:
+            futures = [pool.submit(self.retry, task) for task in tasks]
+            for future in concurrent.futures.as_completed(futures):
+                try:
+                    future.result()
+                except ClientError as e:
+                    errors.append(str(e))
+        except KeyboardInterrupt:
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+        return errors
+
+    # --- Listing ---
+    def info(self):
+        return self.json("GET", "/api/info")
+
+    def ls(self, path=None):
+        """Yield the entries of remote folder ``path`` (the upload dir by default)."""
+        path = path or self.info()["upload_dir"]
+        cursor = None
+        while True:
+            params = {"path": path, "limit": 1000}
+            if cursor: params["cursor"] = cursor
+            page = self.json("GET", "/api/list", params=params)
+            yield from page["entries"]
+            cursor = page.get("next")
+            if not cursor: return
+
+    def manifest(self, path):
+        """Every file under remote folder ``path`` as (relpath, size, mtime, sha256 or None) rows."""
+        lines = self.request("GET", "/api/manifest", params={"path": path}).read().splitlines()
+        fields = json.loads(lines[0])["fields"]
+        rows = (dict(zip(fields, json.loads(line))) for line in lines[1:] if line.strip())
+        return [(r["path"], r["size"], r["mtime"], r.get("sha256")) for r in rows]
+
+    # --- Push ---
+    def push(self, paths, force=False, progress=None, state=None):
+        """Upload files and folders (flattened: the server keeps base names only)."""
+        info = self.info()
+        state = state or SessionState()
+        files, seen = [], {}
+        for path, size in local_files(paths):
+            name = os.path.basename(path)
+            if name in seen:
+                print(f"warning: skipping {path}, same name as {seen[name]}", file=sys.stderr)
+                continue
+            seen[name] = path
+            files.append((path, name, size))
+
+        remote = {} if force else {rel: size for rel, size, _, _ in self.manifest(info["upload_dir"]) if "/" not in rel}
+        todo = [f for f in files if remote.get(f[1]) != f[2]]
+        progress = progress or Progress()
+        progress.total_files = len(todo)
+        progress.total_bytes = sum(size for _, _, size in todo)
+        progress.skipped += len(files) - len(todo)
+
+        tasks, batch, batch_bytes = [], [], 0
+        for path, name, size in todo:
+            # Quotes and newlines can't go in a multipart filename; JSON is fine.
+            if size >= LARGE_FILE or any(c in name for c in '"\r\n'):
+                tasks += self._push_large(path, name, size, info["chunk_size"], progress, state)
+                continue
+            batch.append((path, name, size))
+            batch_bytes += size
+            if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+                tasks.append(self._push_batch(batch, progress))
+                batch, batch_bytes = [], 0
+        if batch: tasks.append(self._push_batch(batch, progress))
+        return self.run_parallel(tasks)
+
+    def _push_batch(self, files, progress):
+        # Each file is preceded by a sha256 field the server checks it against.
+        # Batched files are small, so each is read once, hashed, then sent.
+        field = f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"sha256\"\r\n\r\n".encode()
+        parts = []
+        for path, name, size in files:
+            head = (f"--{BOUNDARY}\r\nContent-Disposition: form-data; name=\"files\"; filename=\"{name}\"\r\n"
+                    "Content-Type: application/octet-stream\r\n\r\n").encode("utf-8", "surrogateescape")
+            parts.append((head, path, size))
+        tail = f"--{BOUNDARY}--\r\n".encode()
+        length = sum(len(field) + 66 + len(head) + size + 2 for head, _, size in parts) + len(tail)
+
+        def body():
+            for head, path, size in parts:
+                with open(path, "rb") as f:
+                    data = f.read(size)
+                if len(data) != size: raise ClientError(f"{path} changed while being sent")
+                yield field + hashlib.sha256(data).hexdigest().encode() + b"\r\n" + head
+                for i in range(0, size, IO_SIZE):
+                    yield data[i:i + IO_SIZE]
+                yield b"\r\n"
+            yield tail
+
+        def task():
+            headers = {"Content-Type": f"multipart/form-data; boundary={BOUNDARY}", "Content-Length": str(length)}
+            self.request("POST", "/", body(), headers).read()
+            progress.add(sum(size for _, _, size in files))
+            for _ in files: progress.file_done()
+        return task
+
+    def _push_large(self, path, name, size, chunk_size, progress, state):
+        st = os.stat(path)
+        key = f"{self.host}:{self.port}|{os.path.abspath(path)}|{size}|{st.st_mtime_ns}"
+        session = None
+        sid = state.get(key)
+        if sid:
+            try:
+                session = self.json("GET", f"/api/upload/{sid}")
+            except ClientError as e:
+                if e.status != 404: raise
+        if session is None or session["size"] != size or session["name"] != name:
+            session = self.json("POST", "/api/upload", {"name": name, "size": size, "chunk_size": chunk_size})
+            state.set(key, session["id"])
+        missing = set(range(session["chunks"])) - set(session["received"])
+        progress.total_bytes -= size - sum(self._chunk_length(session, i) for i in missing)
+        lock = threading.Lock()
+
+        def finish():
+            self.json("POST", f"/api/upload/{session['id']}/finish")
+            state.set(key, None)
+            progress.file_done()
+
+        def send(index):
+            length = self._chunk_length(session, index)
+            with open(path, "rb") as f:
+                f.seek(index * session["chunk_size"])
+                data = f.read(length)
+            if len(data) != length: raise ClientError(f"{path} changed while being sent")
+            self.request("PUT", f"/api/upload/{session['id']}", data,
+                         {"Content-Type": "application/octet-stream", "Content-Digest": sha256_digest(data)},
+                         {"index": index}).read()
+            progress.add(length)
+            with lock:
+                missing.discard(index)
+                last = not missing
+            if last: finish()
+
+        if not missing: return [finish]
+        return [lambda i=i: send(i) for i in sorted(missing)]
+
+    @staticmethod
+    def _chunk_length(session, index):
+        return max(0, min(session["chunk_size"], session["size"] - index * session["chunk_size"]))
+
+    # --- Pull ---
+    def pull(self, remote, dest, progress=None):
+        """Copy the files under remote folder ``remote`` into local ``dest``."""
+        rows = self.manifest(remote)
+        progress = progress or Progress()
+        todo = []
+        for rel, size, mtime, sha256 in rows:
+            local = os.path.join(dest, *safe_relpath(rel))
+            try:
+                st = os.stat(local)
+                if st.st_size == size and abs(st.st_mtime - mtime) < 1:
+                    progress.skipped += 1
+                    continue
+            except OSError:
+                pass
+            todo.append((rel, local, size, mtime, sha256))
+        progress.total_files = len(todo)
+        progress.total_bytes = sum(row[2] for row in todo)
+
+        tasks, batch, batch_bytes = [], [], 0
+        for rel, local, size, mtime, sha256 in todo:
+            if size >= LARGE_FILE:
+                tasks += self._pull_large(remote.rstrip("/") + "/" + rel, local, size, mtime, sha256, progress)
+                continue
+            batch.append((rel, local, size, mtime, sha256))
+            batch_bytes += size
+            if len(batch) >= BATCH_FILES or batch_bytes >= BATCH_BYTES:
+                tasks.append(self._pull_batch(remote, batch, progress))
+                batch, batch_bytes = [], 0
+        if batch: tasks.append(self._pull_batch(remote, batch, progress))
+        return self.run_parallel(tasks)
+
+    def _pull_batch(self, root, files, progress):
+        pending = {rel: (local, size, mtime, sha256) for rel, local, size, mtime, sha256 in files}
+
+        def task():
+            # On a retry only the files not yet written are asked for again.
+            response = self.request("POST", "/api/fetch", json.dumps({"root": root, "files": sorted(pending)}).encode(),
+                                    {"Content-Type": "application/json"})
+            with tarfile.open(fileobj=response, mode="r|") as tar:
+                for member in tar:
+                    if not member.isfile() or member.name not in pending: continue
+                    local, size, mtime, sha256 = pending[member.name]
+                    os.makedirs(os.path.dirname(local) or ".", exist_ok=True)
+                    src = tar.extractfile(member)
+                    h = hashlib.sha256()
+                    with open(local + PART_SUFFIX, "wb") as f:
+                        while True:
+                            data = src.read(IO_SIZE)
+                            if not data: break
+                            f.write(data)
+                            h.update(data)
+                            progress.add(len(data))
+                    if sha256 and h.hexdigest() != sha256:
+                        os.remove(local + PART_SUFFIX)
+                        self._reset()
+                        raise ClientError(f"{member.name} arrived corrupted", CORRUPT)
+                    os.replace(local + PART_SUFFIX, local)
+                    os.utime(local, (mtime, mtime))
+                    del pending[member.name]
+                    progress.file_done()
+            # Keep the connection in step: the tar stream may end in padding.
+            while response.read(IO_SIZE): pass
+            if pending:
+                raise ClientError(f"Server did not send {len(pending)} files, e.g. {next(iter(pending))}")
+        return task
+
+    def _pull_large(self, remote_path, local, size, mtime, sha256, progress):
+        part, state_path = local + PART_SUFFIX, local + PART_SUFFIX + ".json"
+        segments = -(-size // SEGMENT_SIZE)
+        done = set()
+        try:
+            with open(state_path) as f:
+                state = json.load(f)
+            if (state["size"], state["mtime"]) == (size, mtime) and os.path.getsize(part) == size:
+                done = set(state["done"])
+        except (OSError, ValueError, KeyError):
+            pass
+        if not done:
+            os.makedirs(os.path.dirname(local) or ".", exist_ok=True)
+            with open(part, "wb") as f:
+                f.truncate(size)
+        progress.total_bytes -= sum(min(SEGMENT_SIZE, size - i * SEGMENT_SIZE) for i in done)
+        lock = threading.Lock()
+        expected = [("sha-256", bytes.fromhex(sha256)) if sha256 else None]
+
+        def fetch(index):
+            start = index * SEGMENT_SIZE
+            end = min(size, start + SEGMENT_SIZE) - 1
+            response = self.request("GET", "/download", params={"path": remote_path},
+                                    headers={"Range": f"bytes={start}-{end}", "Want-Repr-Digest": WANT_DIGEST})
+            if response.status != 206 or response.getheader("Content-Range") != f"bytes {start}-{end}/{size}":
+                response.close()
+                self._reset()
+                raise ClientError(f"{remote_path} changed on the server; run again to fetch it afresh")
+            expected[0] = expected[0] or repr_digest(response.getheader("Repr-Digest"))
+            with open(part, "r+b") as f:
+                f.seek(start)
+                while True:
+                    data = response.read(IO_SIZE)
+                    if not data: break
+                    f.write(data)
+                    progress.add(len(data))
+            with lock:
+                done.add(index)
+                finished = len(done) == segments
+                if not finished:
+                    with open(state_path, "w") as f:
+                        json.dump({"size": size, "mtime": mtime, "done": sorted(done)}, f)
+            if finished:
+                # The server hashes the file while the segments come in; a HEAD
+                # waits for that if no segment carried the digest yet.
+                if not expected[0]:
+                    head = self.request("HEAD", "/download", headers={"Want-Repr-Digest": WANT_DIGEST},
+                                        params={"path": remote_path})
+                    head.read()
+                    expected[0] = repr_digest(head.getheader("Repr-Digest"))
+                # Segments arrive out of order, so the check is one read at the end.
+                if expected[0] and file_digest(part, expected[0][0]) != expected[0][1]:
+                    for p in (part, state_path):
+                        try: os.remove(p)
+                        except OSError: pass
+                    raise ClientError(f"{remote_path} arrived corrupted; run again to fetch it afresh")
+                os.replace(part, local)
+                os.utime(local, (mtime, mtime))
+                try: os.remove(state_path)
+                except OSError: pass
+                progress.file_done()
+
+        return [lambda i=i: fetch(i) for i in range(segments) if i not in done]
+
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("server", help="server address, e.g. http://192.168.1.5:8080")
+    common.add_argument("-p", "--password", default=os.environ.get("SANTHUSHARE_PASSWORD"),
+                        help="server password (default: $SANTHUSHARE_PASSWORD, else prompt)")
+    common.add_argument("-j", "--connections", type=int, default=CONNECTIONS,
+                        help=f"parallel connections (default {CONNECTIONS})")
+    common.add_argument("-q", "--quiet", action="store_true", help="no live progress line")
+
+    parser = argparse.ArgumentParser(prog="python -m santhushare.client", description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    ls = commands.add_parser("ls", parents=[common], help="list a remote folder")
+    ls.add_argument("path", nargs="?", help="remote folder (default: the upload folder)")
+    ls.add_argument("-R", "--recursive", action="store_true", help="every file below the folder")
+    push = commands.add_parser("push", parents=[common], help="upload files and folders")
+    push.add_argument("paths", nargs="+")
+    push.add_argument("--force", action="store_true", help="send files the server already has")
+    pull = commands.add_parser("pull", parents=[common], help="download a remote folder")
+    pull.add_argument("remote")
+    pull.add_argument("dest", nargs="?", default=".")
+    args = parser.parse_args(argv)
+
+    password = args.password if args.password is not None else getpass.getpass("Password: ")
+    try:
+        client = Client(args.server, password, args.connections)
+    except ClientError as e:
+        parser.error(str(e))
+    try:
+        if args.command == "ls":
+            if args.recursive:
+                rows = client.manifest(args.path or client.info()["upload_dir"])
+                entries = ({"name": rel, "dir": False, "size": size, "mtime": mtime} for rel, size, mtime, _ in rows)
+            else:
+                entries = client.ls(args.path)
+            for e in entries:
+                stamp = time.strftime("%Y-%m-%d %H:%M", time.localtime(e["mtime"]))
+                print(f"{'-' if e['dir'] else e['size']:>12}  {stamp}  {e['name']}{'/' if e['dir'] else ''}")
+            return 0
+        progress = Progress(quiet=args.quiet)
+        if args.command == "push":
+            errors = client.push(args.paths, args.force, progress)
+        else:
+            errors = client.pull(args.remote, args.dest, progress)
+        print(progress.summary("pushed" if args.command == "push" else "pulled"), file=sys.stderr)
+        for e in errors:
+            print(f"error: {e}", file=sys.stderr)
+        return 1 if errors else 0
+    except ClientError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print("\ninterrupted; run the same command again to resume", file=sys.stderr)
+        return 130
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
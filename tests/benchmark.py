@@ -0,0 +1,596 @@
+"""Local benchmark harness for SanthuShare.
+
+Starts ``ServerThread`` on localhost without the GUI, builds synthetic file
+trees in a temporary directory and measures throughput, p50/p99 latency and
+peak RSS for uploads, downloads, zips, browsing and concurrent clients.
+Results are written as JSON; ``--baseline`` compares a run against an earlier
+result file and exits non-zero when a metric regressed past the tolerance.
+
+    PYTHONPATH=src python -m tests.benchmark --quick --output bench.json
+    PYTHONPATH=src python -m tests.benchmark --baseline bench.json
+
+Run it as a module from the project root: as a plain script, the Briefcase
+runner next to it (tests/santhushare.py) would shadow the app package. Not
+collected by pytest (the name doesn't match ``test_*.py``).
+"""
+import argparse
+import base64
+import contextlib
+import http.client
+import json
+import logging
+import os
+import platform
+import resource
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import santhushare.__main__ as app
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import cgi
+except ImportError:  # removed in Python 3.13
+    cgi = None
+
+KB = 1024
+MB = 1024 * KB
+GB = 1024 * MB
+
+PASSWORD = "bench"
+AUTH = {"Authorization": "Basic " + base64.b64encode(f"bench:{PASSWORD}".encode()).decode()}
+BOUNDARY = "----santhushare-bench"
+
+# Per-profile sizes. "full" is what the numbers in a baseline should come
+# from; "quick" finishes in well under a minute for a sanity check.
+PROFILES = {
+    "full": {
+        "upload_sizes": [1 * KB, 1 * MB, 64 * MB, 2 * GB],
+        "upload_bytes": 256 * MB,    # bytes moved per size, spread over repeats
+        "download_size": 512 * MB,
+        "download_repeats": 5,
+        "zip_files": 5000,
+        "browse_entries": 100_000,
+        "clients": 16,
+        "client_requests": 200,
+    },
+    "quick": {
+        "upload_sizes": [1 * KB, 1 * MB, 16 * MB],
+        "upload_bytes": 32 * MB,
+        "download_size": 32 * MB,
+        "download_repeats": 3,
+        "zip_files": 500,
+        "browse_entries": 10_000,
+        "clients": 4,
+        "client_requests": 50,
+    },
+}
+
+# Metric name suffix -> True if bigger is better. Anything else is ignored
+# by the baseline comparison (counts, sizes, notes).
+DIRECTIONS = {
+    "_mb_s": True,
+    "_per_s": True,
+    "_ms": False,
+    "_rss_mb": False,
+}
+
+
+def human_size(n):
+    for unit, size in (("G", GB), ("M", MB), ("K", KB)):
+        if n >= size and n % size == 0:
+            return f"{n // size}{unit}"
+    return str(n)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of ``values`` (q in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * q // 100))
+    return ordered[min(len(ordered), int(rank)) - 1]
+
+
+def summarize(latencies, nbytes=0, elapsed=None, **extra):
+    """Standard metric dict for a list of per-operation latencies (seconds)."""
+    elapsed = elapsed if elapsed is not None else sum(latencies)
+    result = {
+        "ops": len(latencies),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+    if nbytes:
+        result["bytes"] = nbytes
+        result["throughput_mb_s"] = round(nbytes / MB / elapsed, 2) if elapsed else None
+    result.update(extra)
+    return result
+
+
+# --- Memory ---
+# ru_maxrss only ever grows, so it can't tell one case from the next. A
+# sampler thread polls VmRSS from /proc while a case runs and keeps the
+# highest value; elsewhere the process-wide maximum is the best there is.
+class RSSSampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def current():
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * KB
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def max_rss():
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * KB
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, self.current() or 0)
+
+    def __enter__(self):
+        self.peak = self.current() or 0
+        if self.peak:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self.peak = max(self.peak, self.current() or 0)
+        else:
+            self.peak = self.max_rss()
+
+
+# --- Synthetic data ---
+def fill_file(path, size, block=None):
+    """Write ``size`` bytes of incompressible data without holding it in memory."""
+    block = block or os.urandom(MB)
+    with open(path, "wb") as f:
+        left = size
+        while left:
+            n = min(left, len(block))
+            f.write(block[:n])
+            left -= n
+    return path
+
+
+def multipart_file(path, payload_path, filename):
+    """Build a one-file multipart body on disk; returns (path, headers)."""
+    head = (
+        f"--{BOUNDARY}\r\n"
+        f'Content-Disposition: form-data; name="files"; filename="{filename}"\r\n'
+        "Content-Type: application/octet-stream\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+    with open(path, "wb") as out, open(payload_path, "rb") as src:
+        out.write(head)
+        shutil.copyfileobj(src, out, MB)
+        out.write(tail)
+    headers = {
+        "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+        "Content-Length": str(os.path.getsize(path)),
+    }
+    return path, headers
+
+
+def small_tree(root, count, min_size=1 * KB, max_size=8 * KB):
+    """``count`` small text-ish files spread over 100-file subdirectories."""
+    words = b"santhushare benchmark sample line of moderately compressible text\n"
+    for i in range(count):
+        sub = os.path.join(root, f"d{i // 100:04d}")
+        if i % 100 == 0:
+            os.makedirs(sub, exist_ok=True)
+        size = min_size + (i * 7919) % (max_size - min_size + 1)
+        data = (words * (size // len(words) + 1))[:size - 8] + os.urandom(4).hex().encode()
+        with open(os.path.join(sub, f"f{i:06d}.txt"), "wb") as f:
+            f.write(data)
+    return root
+
+
+def flat_tree(root, count):
+    """``count`` empty files in one directory, for listing benchmarks."""
+    os.makedirs(root, exist_ok=True)
+    for i in range(count):
+        open(os.path.join(root, f"entry-{i:06d}.dat"), "wb").close()
+    return root
+
+
+# --- Server ---
+class _Headless:
+    """Stands in for the Toga app: no loop, so AppManager skips UI updates."""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BenchServer:
+    def __init__(self, workdir, engine):
+        self.upload_dir = os.path.join(workdir, "uploads")
+        os.makedirs(self.upload_dir, exist_ok=True)
+        app.TARGET_UPLOAD_DIR = self.upload_dir
+        app.AppManager(_Headless())
+        self.port = free_port()
+        self.thread = app.ServerThread(self.port, PASSWORD, engine=engine)
+
+    def __enter__(self):
+        self.thread.start()
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+                return self
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError("server did not start")
+                time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        self.thread.stop()
+
+    def connect(self):
+        return http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+
+    def request(self, conn, method, path, body=None, headers=None):
+        """One request on ``conn``; returns (status, body bytes, seconds)."""
+        h = dict(AUTH)
+        h.update(headers or {})
+        start = time.perf_counter()
+        conn.request(method, path, body=body, headers=h)
+        response = conn.getresponse()
+        nbytes = 0
+        while True:
+            chunk = response.read(MB)
+            if not chunk:
+                break
+            nbytes += len(chunk)
+        elapsed = time.perf_counter() - start
+        if response.status >= 400:
+            raise RuntimeError(f"{method} {path} -> {response.status}")
+        return response.status, nbytes, elapsed
+
+    def get(self, conn, route, **params):
+        return self.request(conn, "GET", f"{route}?{urllib.parse.urlencode(params)}")
+
+
+# --- Cases ---
+# Each case takes (server, workdir, profile) and returns {name: metrics};
+# one case can report several rows (e.g. one per upload size).
+CASES = {}
+
+
+def case(name):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+def _repeats(size, budget):
+    return max(1, min(50, budget // size))
+
+
+def _parse_rfile(body_path, headers, dest):
+    def open_dest(fname):
+        return app.UploadFile(os.path.join(dest, fname))
+    with open(body_path, "rb") as fp:
+        app.parse_multipart_rfile(fp, headers, file_factory=open_dest)
+
+
+def _parse_cgi(body_path, headers, dest):
+    # The upload path as it was before the streaming parser: FieldStorage
+    # spools the part to a temp file, then it's copied to its destination.
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "CONTENT_TYPE": headers["Content-Type"],
+        "CONTENT_LENGTH": headers["Content-Length"],
+    }
+    with open(body_path, "rb") as fp:
+        form = cgi.FieldStorage(fp=fp, headers={k.lower(): v for k, v in headers.items()}, environ=environ)
+        items = form["files"]
+        for item in items if isinstance(items, list) else [items]:
+            with open(os.path.join(dest, os.path.basename(item.filename)), "wb") as f:
+                shutil.copyfileobj(item.file, f)
+
+
+@case("upload_parse")
+def bench_upload_parse(server, workdir, profile):
+    """In-process multipart parsing: streaming parser vs the cgi module."""
+    results = {}
+    dest = os.path.join(workdir, "parse-dest")
+    os.makedirs(dest, exist_ok=True)
+    parsers = [("rfile", _parse_rfile), ("cgi", _parse_cgi if cgi else None)]
+    for size in profile["upload_sizes"]:
+        payload = fill_file(os.path.join(workdir, "payload.bin"), size)
+        body, headers = multipart_file(os.path.join(workdir, "body.bin"), payload, "upload.bin")
+        os.remove(payload)
+        repeats = _repeats(size, profile["upload_bytes"])
+        for label, parse in parsers:
+            name = f"upload_parse_{label}_{human_size(size)}"
+            if parse is None:
+                results[name] = {"skipped": "cgi module not available"}
+                continue
+            latencies = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                parse(body, headers, dest)
+                latencies.append(time.perf_counter() - start)
+                os.remove(os.path.join(dest, "upload.bin"))
+            results[name] = summarize(latencies, size * repeats)
+        os.remove(body)
+    return results
+
+
+@case("upload_http")
+def bench_upload_http(server, workdir, profile):
+    """Multipart POST / through the running server."""
+    results = {}
+    conn = server.connect()
+    for size in profile["upload_sizes"]:
+        payload = fill_file(os.path.join(workdir, "payload.bin"), size)
+        body, headers = multipart_file(os.path.join(workdir, "body.bin"), payload, "upload.bin")
+        os.remove(payload)
+        latencies = []
+        for _ in range(_repeats(size, profile["upload_bytes"])):
+            with open(body, "rb") as fp:
+                latencies.append(server.request(conn, "POST", "/", body=fp, headers=headers)[2])
+        results[f"upload_http_{human_size(size)}"] = summarize(latencies, size * len(latencies))
+        os.remove(body)
+    conn.close()
+    return results
+
+
+@case("download")
+def bench_download(server, workdir, profile):
+    """Whole-file GET /download, plus 1 MiB range requests."""
+    size = profile["download_size"]
+    path = fill_file(os.path.join(workdir, "download.bin"), size)
+    conn = server.connect()
+    full = [server.get(conn, "/download", path=path)[2] for _ in range(profile["download_repeats"])]
+    ranges = []
+    query = "/download?" + urllib.parse.urlencode({"path": path})
+    for i in range(100):
+        offset = (i * 7919 * MB) % max(MB, size - MB)
+        headers = {"Range": f"bytes={offset}-{offset + MB - 1}"}
+        ranges.append(server.request(conn, "GET", query, headers=headers)[2])
+    conn.close()
+    os.remove(path)
+    return {
+        "download_full": summarize(full, size * len(full)),
+        "download_range_1M": summarize(ranges, MB * len(ranges)),
+    }
+
+
+@case("zip")
+def bench_zip(server, workdir, profile):
+    """GET /zip over a tree of many small files."""
+    count = profile["zip_files"]
+    root = small_tree(os.path.join(workdir, "zip-tree"), count)
+    conn = server.connect()
+    latencies, nbytes = [], 0
+    for _ in range(3):
+        _, n, elapsed = server.get(conn, "/zip", path=root)
+        latencies.append(elapsed)
+        nbytes += n
+    conn.close()
+    shutil.rmtree(root)
+    total = sum(latencies)
+    return {"zip_small_files": summarize(
+        latencies, nbytes, files=count, files_per_s=round(count * len(latencies) / total, 1),
+    )}
+
+
+@case("browse")
+def bench_browse(server, workdir, profile):
+    """The /browse shell and paging /api/list through a huge directory."""
+    count = profile["browse_entries"]
+    root = flat_tree(os.path.join(workdir, "browse-tree"), count)
+    # Freshly changed directories are not cached; age it past the settle window.
+    os.utime(root, (time.time() - 60,) * 2)
+    conn = server.connect()
+
+    def walk():
+        pages, cursor, seen = [], None, 0
+        while True:
+            params = {"path": root, "limit": app.LIST_PAGE_MAX}
+            if cursor:
+                params["cursor"] = cursor
+            start = time.perf_counter()
+            conn.request("GET", "/api/list?" + urllib.parse.urlencode(params), headers=AUTH)
+            page = json.loads(conn.getresponse().read())
+            pages.append(time.perf_counter() - start)
+            seen += len(page["entries"])
+            cursor = page.get("next")
+            if not cursor:
+                return pages, seen
+
+    cold, seen = walk()
+    warm = []
+    for _ in range(3):
+        warm += walk()[0]
+    if app.LISTING_CACHE.get(os.path.realpath(root), os.stat(root).st_mtime_ns) is None:
+        raise RuntimeError("warm listing was not served from the cache")
+    shell = [server.get(conn, "/browse", path=root)[2] for _ in range(20)]
+    conn.close()
+    shutil.rmtree(root)
+    if seen != count:
+        raise RuntimeError(f"listing returned {seen} of {count} entries")
+    return {
+        "browse_shell": summarize(shell),
+        "browse_list_cold": summarize(cold, entries=count, first_page_ms=round(cold[0] * 1000, 3),
+                                      walk_ms=round(sum(cold) * 1000, 3)),
+        "browse_list_warm": summarize(warm, entries=count),
+    }
+
+
+@case("concurrent")
+def bench_concurrent(server, workdir, profile):
+    """Many keep-alive clients mixing small downloads and listings."""
+    root = small_tree(os.path.join(workdir, "concurrent-tree"), 200, 16 * KB, 256 * KB)
+    files = sorted(os.path.join(d, f) for d, _, names in os.walk(root) for f in names)
+
+    def client(n):
+        conn = server.connect()
+        latencies, nbytes = [], 0
+        for i in range(profile["client_requests"]):
+            if i % 4 == 3:
+                _, size, elapsed = server.get(conn, "/api/list", path=os.path.dirname(files[0]))
+            else:
+                _, size, elapsed = server.get(conn, "/download", path=files[(n * 31 + i) % len(files)])
+            latencies.append(elapsed)
+            nbytes += size
+        conn.close()
+        return latencies, nbytes
+
+    clients = profile["clients"]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(clients) as pool:
+        results = list(pool.map(client, range(clients)))
+    elapsed = time.perf_counter() - start
+    shutil.rmtree(root)
+    latencies = [t for lat, _ in results for t in lat]
+    return {"concurrent_clients": summarize(
+        latencies, sum(n for _, n in results), elapsed=elapsed,
+        clients=clients, req_per_s=round(len(latencies) / elapsed, 1),
+    )}
+
+
+# --- Running and comparing ---
+def run(cases, profile_name, engine, verbose=False):
+    profile = PROFILES[profile_name]
+    workdir = tempfile.mkdtemp(prefix="santhushare-bench-")
+    if not verbose:
+        # The handler logs every request at ERROR level and prints a
+        # notification per upload; neither belongs in the numbers.
+        logging.disable(logging.CRITICAL)
+    results = {}
+    try:
+        with BenchServer(workdir, engine) as server:
+            for name in cases:
+                print(f"running {name} ...", file=sys.stderr, flush=True)
+                with open(os.devnull, "w") as devnull, \
+                        contextlib.redirect_stdout(sys.stdout if verbose else devnull), \
+                        RSSSampler() as rss:
+                    rows = CASES[name](server, workdir, profile)
+                for row in rows.values():
+                    if "skipped" not in row:
+                        row["peak_rss_mb"] = round(rss.peak / MB, 1)
+                results.update(rows)
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "meta": {
+            "profile": profile_name,
+            "engine": engine,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        },
+        "results": results,
+    }
+
+
+def metric_direction(metric):
+    for suffix, higher_is_better in DIRECTIONS.items():
+        if metric.endswith(suffix):
+            return higher_is_better
+    return None
+
+
+def compare(current, baseline, tolerance=0.15, min_ms=2.0):
+    """Return a list of regressions of ``current`` against ``baseline``.
+
+    Each regression is (row, metric, baseline value, current value). Only
+    rows and metrics present in both runs are compared; latencies must also
+    grow by at least ``min_ms`` so sub-millisecond jitter isn't flagged.
+    """
+    regressions = []
+    for row, metrics in sorted(current["results"].items()):
+        base = baseline["results"].get(row)
+        if not base:
+            continue
+        for metric, value in sorted(metrics.items()):
+            higher = metric_direction(metric)
+            old = base.get(metric)
+            if higher is None or not isinstance(value, (int, float)) or not old:
+                continue
+            change = (value - old) / old
+            if metric.endswith("_ms") and value - old < min_ms:
+                continue
+            if (higher and change < -tolerance) or (not higher and change > tolerance):
+                regressions.append((row, metric, old, value))
+    return regressions
+
+
+def print_table(results, out=sys.stdout):
+    for row, metrics in results["results"].items():
+        if "skipped" in metrics:
+            print(f"{row:28} skipped: {metrics['skipped']}", file=out)
+            continue
+        parts = [f"{k}={v}" for k, v in metrics.items() if metric_direction(k) is not None]
+        print(f"{row:28} " + "  ".join(parts), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--quick", action="store_true", help="small sizes for a fast sanity run")
+    parser.add_argument("--case", action="append", choices=sorted(CASES),
+                        help="run only these cases (repeatable)")
+    parser.add_argument("--engine", default=app.SERVER_ENGINE, choices=["asyncio", "threaded"])
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="compare against this results JSON")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed relative slowdown before a metric counts as a regression")
+    parser.add_argument("--min-ms", type=float, default=2.0,
+                        help="ignore latency increases smaller than this many milliseconds")
+    parser.add_argument("--verbose", action="store_true", help="keep server logging and notifications")
+    args = parser.parse_args(argv)
+
+    cases = args.case or list(CASES)
+    results = run(cases, "quick" if args.quick else "full", args.engine, args.verbose)
+    print_table(results)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["meta"].get("profile") != results["meta"]["profile"]:
+            print("warning: baseline was recorded with a different profile", file=sys.stderr)
+        regressions = compare(results, baseline, args.tolerance, args.min_ms)
+        for row, metric, old, new in regressions:
+            print(f"REGRESSION {row} {metric}: {old} -> {new}")
+        if regressions:
+            return 1
+        print(f"no regressions beyond {args.tolerance:.0%}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,3 +1,919 @@
+import asyncio
+import base64
+import concurrent.futures
+import gzip
+import hashlib
+import http.client
+import json
+import mmap
+import os
+import socket
+import tarfile
+import tempfile
+import threading
+import time
+import urllib.parse
+import zipfile
+from io import BytesIO
+
+import pytest
+
+import santhushare.__main__ as santhushare
+from santhushare.__main__ import (
+    HISTORY_LIMIT,
+    AppManager,
+    AsyncHTTPServer,
+    DigestMismatch,
+    EventHub,
+    HashIndex,
+    ListingCache,
+    Metrics,
+    MultipartError,
+    ReusableTCPServer,
+    SearchIndex,
+    SecureHandler,
+    TarLayout,
+    ThumbnailService,
+    TokenBucket,
+    TransferScheduler,
+    UploadFile,
+    UploadSession,
+    UploadStorage,
+    ZipLayout,
+    StaticPage,
+    ZipStreamer,
+    accepted_encodings,
+    etag_matches,
+    list_page,
+    parse_multipart_rfile,
+    parse_range_header,
+    resolve_fetch_paths,
+    scan_directory,
+    walk_manifest,
+)
+
+
 def test_first():
     """An initial test for the app."""
     assert 1 + 1 == 2
+
+
+def multipart_body(boundary, parts):
+    body = b""
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"'
+        if filename is not None:
+            disposition += f'; filename="{filename}"'
+        body += f"--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n".encode() + data + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode()
+
+
+def multipart_headers(boundary, body):
+    return {
+        "Content-Type": f"multipart/form-data; boundary={boundary}",
+        "Content-Length": str(len(body)),
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 256 * 1024])
+def test_parse_multipart_streams_parts(chunk_size):
+    """Parts are split correctly regardless of where window edges fall."""
+    boundary = "----santhu"
+    payload = bytes(range(256)) * 40 + b"\r\n------santh"
+    body = multipart_body(boundary, [
+        ("note", None, b"hello"),
+        ("file", "a.bin", payload),
+        ("file", "dir\\b.txt", b""),
+    ])
+    written = {}
+
+    class Sink(BytesIO):
+        def __init__(self, name):
+            super().__init__()
+            self.name = name
+
+        def close(self):
+            written[self.name] = self.getvalue()
+
+    result = parse_multipart_rfile(
+        BytesIO(body), multipart_headers(boundary, body),
+        file_factory=Sink, chunk_size=chunk_size,
+    )
+
+    assert result["note"].value == "hello"
+    assert [p.filename for p in result["file"]] == ["a.bin", "b.txt"]
+    assert written == {"a.bin": payload, "b.txt": b""}
+
+
+def test_parse_multipart_spools_without_factory():
+    boundary = "xyz"
+    body = multipart_body(boundary, [("file", "a.txt", b"data")])
+    result = parse_multipart_rfile(BytesIO(body), multipart_headers(boundary, body))
+    assert result["file"].file.read() == b"data"
+
+
+def test_parse_multipart_stores_only_expected_file_fields():
+    boundary = "xyz"
+    body = multipart_body(boundary, [("avatar", "evil.sh", b"#!"), ("files", "ok.txt", b"data")])
+    opened = []
+    result = parse_multipart_rfile(BytesIO(body), multipart_headers(boundary, body),
+                                   file_factory=lambda name: opened.append(name) or BytesIO(),
+                                   file_fields=santhushare.UPLOAD_FILE_FIELDS)
+    assert opened == ["ok.txt"]
+    assert list(result) == ["files"]
+
+
+def test_parse_multipart_rejects_truncated_body():
+    boundary = "xyz"
+    body = multipart_body(boundary, [("file", "a.txt", b"data" * 100)])[:-40]
+    with pytest.raises(MultipartError):
+        parse_multipart_rfile(BytesIO(body), multipart_headers(boundary, body))
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("bytes=0-9", [(0, 9)]),
+    ("bytes=90-", [(90, 99)]),
+    ("bytes=-10", [(90, 99)]),
+    ("bytes=0-200", [(0, 99)]),
+    ("bytes=0-4, 3-9, 20-29, 10-12", [(0, 12), (20, 29)]),
+    ("bytes=100-", []),
+    ("bytes=-0", []),
+    ("bytes=9-3", None),
+    ("items=0-9", None),
+    ("bytes=abc", None),
+])
+def test_parse_range_header(header, expected):
+    assert parse_range_header(header, 100) == expected
+
+
+def test_upload_session_chunk_layout():
+    session = UploadSession("0" * 32, "a.bin", 25, 10)
+    assert session.chunk_count == 3
+    assert [session.chunk_length(i) for i in range(3)] == [10, 10, 5]
+    assert UploadSession("0" * 32, "empty", 0, 10).chunk_count == 1
+
+
+def test_threaded_engine_keeps_connection_alive_and_closes_on_error():
+    httpd = ReusableTCPServer(("127.0.0.1", 0), SecureHandler)
+    httpd.password = "secret"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    auth = {"Authorization": "Basic " + base64.b64encode(b"user:secret").decode()}
+    try:
+        conn = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+        start = time.perf_counter()
+        for _ in range(20):
+            conn.request("GET", "/", headers=auth)
+            response = conn.getresponse()
+            response.read()
+            assert response.status == 200 and response.getheader("Keep-Alive")
+        elapsed = time.perf_counter() - start
+        conn.close()
+        assert httpd.stats.reused == 19
+        # A Nagle stall costs ~40 ms per request once the connection is reused.
+        assert elapsed < 20 * 0.02
+
+        # An error response closes the connection and says only that.
+        sock = socket.create_connection(httpd.server_address, timeout=10)
+        sock.sendall(b"BREW / HTTP/1.1\r\nHost: x\r\n\r\n")
+        head = sock.makefile("rb").read().split(b"\r\n\r\n")[0]
+        sock.close()
+        assert head.startswith(b"HTTP/1.1 501")
+        assert head.count(b"Connection: close") == 1 and b"Keep-Alive" not in head
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_async_engine_serves_handler_routes():
+    httpd = AsyncHTTPServer(("127.0.0.1", 0), SecureHandler)
+    httpd.password = "secret"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    try:
+        host, port = httpd.server_address
+        auth = "Basic " + base64.b64encode(b"user:secret").decode()
+        for headers, status in [({}, 401), ({"Authorization": auth}, 200)]:
+            conn = http.client.HTTPConnection(host, port, timeout=10)
+            conn.request("GET", "/", headers=headers)
+            response = conn.getresponse()
+            body = response.read()
+            conn.close()
+            assert response.status == status
+        assert b"SanthuShare" in body
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_async_engine_serves_past_worker_count_of_slow_clients(tmp_path, monkeypatch):
+    monkeypatch.setattr(AppManager, "_instance", None)
+    AppManager(object())
+    monkeypatch.setattr(santhushare, "TARGET_UPLOAD_DIR", str(tmp_path))
+    httpd = AsyncHTTPServer(("127.0.0.1", 0), SecureHandler)
+    httpd.password = "secret"
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host, port = httpd.server_address
+    auth = "Basic " + base64.b64encode(b"user:secret").decode()
+    stalled = []
+    try:
+        # Uploads that send their headers and then stall are buffered on the
+        # loop; 64 is four times the worker pool.
+        for _ in range(64):
+            sock = socket.create_connection((host, port), timeout=10)
+            sock.sendall((f"POST / HTTP/1.1\r\nHost: x\r\nAuthorization: {auth}\r\n"
+                          "Content-Type: multipart/form-data; boundary=xyz\r\n"
+                          "Content-Length: 1000000\r\n\r\n--xyz\r\n").encode())
+            stalled.append(sock)
+        time.sleep(0.5)
+        conn = http.client.HTTPConnection(host, port, timeout=5)
+        conn.request("GET", "/", headers={"Authorization": auth})
+        assert conn.getresponse().status == 200
+        conn.close()
+    finally:
+        for sock in stalled:
+            sock.close()
+        time.sleep(0.2)  # let the workers notice before the loop goes away
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_async_engine_frees_workers_from_stalled_downloads(tmp_path):
+    big = tmp_path / "big.bin"
+    big.write_bytes(os.urandom(32 * 1024 * 1024))
+    httpd = AsyncHTTPServer(("127.0.0.1", 0), SecureHandler, workers=2)
+    httpd.password = "secret"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    host, port = httpd.server_address
+    auth = "Basic " + base64.b64encode(b"user:secret").decode()
+    stalled = []
+    try:
+        # Clients that never read their download: the loop sends the body,
+        # so neither worker stays behind waiting on them.
+        for _ in range(6):
+            sock = socket.create_connection((host, port), timeout=10)
+            sock.sendall((f"GET /download?path={urllib.parse.quote(str(big))} HTTP/1.1\r\n"
+                          f"Host: x\r\nAuthorization: {auth}\r\n\r\n").encode())
+            stalled.append(sock)
+        time.sleep(0.5)
+        conn = http.client.HTTPConnection(host, port, timeout=5)
+        conn.request("GET", "/", headers={"Authorization": auth})
+        assert conn.getresponse().status == 200
+        conn.close()
+    finally:
+        for sock in stalled:
+            sock.close()
+        time.sleep(0.2)
+        httpd.shutdown()
+        httpd.server_close()
+
+
+def test_upload_api_session_create_put_resume_finish(tmp_path, monkeypatch):
+    monkeypatch.setattr(AppManager, "_instance", None)
+    AppManager(object())
+    monkeypatch.setattr(santhushare, "TARGET_UPLOAD_DIR", str(tmp_path))
+    santhushare.UPLOAD_STORAGE.invalidate()
+    httpd = AsyncHTTPServer(("127.0.0.1", 0), SecureHandler)
+    httpd.password = "secret"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    auth = {"Authorization": "Basic " + base64.b64encode(b"user:secret").decode()}
+    data = os.urandom(25_000)
+
+    def call(method, path, body=None):
+        conn = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+        conn.request(method, path, body=body, headers=auth)
+        response = conn.getresponse()
+        result = response.status, response.read()
+        conn.close()
+        return result
+
+    try:
+        status, body = call("POST", "/api/upload", json.dumps({"name": "big.bin", "size": len(data), "chunk_size": 10_000}))
+        assert status == 201
+        sid = json.loads(body)["id"]
+        assert call("PUT", f"/api/upload/{sid}?index=2", data[20_000:])[0] == 200
+        # A client that went away asks what arrived and sends only the rest.
+        state = json.loads(call("GET", f"/api/upload/{sid}")[1])
+        assert state["received"] == [2] and state["chunks"] == 3
+        assert call("POST", f"/api/upload/{sid}/finish")[0] == 409
+        for i in (0, 1):
+            assert call("PUT", f"/api/upload/{sid}?index={i}", data[i * 10_000:(i + 1) * 10_000])[0] == 200
+        assert call("POST", f"/api/upload/{sid}/finish")[0] == 200
+        assert (tmp_path / "big.bin").read_bytes() == data
+        assert call("PUT", "/api/uploadX", b"x")[0] == 404
+        assert call("GET", "/api/uploads")[0] == 404
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+        santhushare.UPLOAD_STORAGE.invalidate()
+
+
+def test_upload_storage_probes_once_and_renames_into_place(tmp_path, monkeypatch):
+    probes = []
+    monkeypatch.setattr(santhushare, "TARGET_UPLOAD_DIR", str(tmp_path))
+    monkeypatch.setattr(santhushare, "get_real_upload_dir", lambda: probes.append(1) or str(tmp_path))
+    storage = UploadStorage(fsync="batch")
+    (tmp_path / "a.bin").write_bytes(b"old")
+
+    first = storage.open("a.bin", size=2 * 1024 * 1024)
+    second = storage.open("a.bin")
+    first.write(b"first")
+    second.write(b"second")
+    assert (tmp_path / "a.bin").read_bytes() == b"old"
+    second.abort()
+    assert (tmp_path / "a.bin").read_bytes() == b"old"
+    first.close()
+    assert (tmp_path / "a.bin").read_bytes() == b"first"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["a.bin"]
+    assert len(probes) == 1
+    assert storage._pending == [str(tmp_path / "a.bin")]
+    storage.flush()
+    assert storage._pending == []
+
+    storage.invalidate()
+    storage.directory()
+    assert len(probes) == 2
+
+
+def test_upload_digests_are_checked_before_the_file_lands(tmp_path, monkeypatch):
+    monkeypatch.setattr(santhushare, "get_real_upload_dir", lambda: str(tmp_path))
+    storage = UploadStorage()
+    data = b"payload" * 1000
+    sha = hashlib.sha256(data).digest()
+    header = santhushare.format_digests({"sha-256": sha})
+    assert santhushare.parse_digests(header + ", md5=:AAAA:") == {"sha-256": sha}
+    assert santhushare.parse_digests("SHA-256=" + base64.b64encode(sha).decode()) == {"sha-256": sha}
+    assert santhushare.wanted_digest("sha-512=3, sha-256=9, bogus=10") == "sha-256"
+
+    good = storage.open("good.bin", expected={"sha-256": sha})
+    good.write(data)
+    good.close()
+    st = os.stat(tmp_path / "good.bin")
+    assert santhushare.cached_digests(str(tmp_path / "good.bin"), st)["sha-256"] == sha
+
+    bad = storage.open("bad.bin", expected={"blake2b-256": b"\0" * 32})
+    bad.write(data)
+    with pytest.raises(DigestMismatch):
+        bad.close()
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["good.bin"]
+
+
+def test_download_digests_survive_a_restart(tmp_path, monkeypatch):
+    (tmp_path / "f.bin").write_bytes(b"abc")
+    path, st = str(tmp_path / "f.bin"), os.stat(tmp_path / "f.bin")
+    sha = hashlib.sha256(b"abc").digest()
+    monkeypatch.setattr(santhushare, "DIGEST_STORE", santhushare.DigestStore(str(tmp_path / "digests.json")))
+    santhushare.remember_digests(path, {"sha-256": sha}, st, persist=True)
+    santhushare.DIGEST_STORE.save()
+
+    restarted = santhushare.DigestStore(str(tmp_path / "digests.json"))
+    monkeypatch.setattr(santhushare, "DIGEST_STORE", restarted)
+    monkeypatch.setattr(santhushare, "DIGEST_CACHE", ListingCache(1024))
+    assert santhushare.cached_digests(path, st) == {"sha-256": sha}
+    (tmp_path / "f.bin").write_bytes(b"abcd")
+    assert restarted.get(path, os.stat(tmp_path / "f.bin")) == {}
+
+
+def test_app_manager_coalesces_events_into_frames(monkeypatch):
+    monkeypatch.setattr(AppManager, "_instance", None)
+    loop = asyncio.new_event_loop()
+
+    class App:
+        def __init__(self):
+            self.loop = loop
+            self.flushes = []
+            self.progress_bar = type("Bar", (), {"value": 0})()
+
+        def update_history_ui(self, new):
+            self.flushes.append(new)
+
+    app = App()
+    manager = AppManager(app)
+
+    def burst():
+        manager.transfer_started("up", 4000)
+        for i in range(HISTORY_LIMIT + 100):
+            manager.add_history("File Received", f"f{i}")
+            manager.transfer_bytes("up", 2)
+
+    thread = threading.Thread(target=burst)
+    thread.start()
+    thread.join()
+    try:
+        loop.run_until_complete(asyncio.sleep(0.3))
+    finally:
+        loop.close()
+    assert len(app.flushes) == 1
+    assert len(app.flushes[0]) == HISTORY_LIMIT
+    assert app.flushes[0][-1]["subtitle"] == f"f{HISTORY_LIMIT + 99}"
+    assert len(manager.history) == HISTORY_LIMIT
+    assert manager.history[0]["subtitle"] == f"f{HISTORY_LIMIT + 99}"
+    assert app.progress_bar.value == 30
+    del app.loop
+    manager.transfer_finished("up")
+    assert manager.progress() == 0
+    for i in range(HISTORY_LIMIT * 3):
+        manager.add_history("File Received", f"g{i}")  # no UI loop drains these
+    assert len(manager._new) == HISTORY_LIMIT
+
+
+def test_static_page_negotiates_encoding_and_etag():
+    page = StaticPage("<p>" + "hello " * 500 + "</p>", "text/html; charset=utf-8")
+    encoding, body = page.select("deflate, gzip;q=0.8")
+    assert encoding == "gzip" and gzip.decompress(body) == page.variants[None]
+    assert page.select("gzip;q=0, identity") == (None, page.variants[None])
+    assert page.select(None)[0] is None
+    assert accepted_encodings("*") == accepted_encodings("br, gzip")
+    assert etag_matches(page.etag.replace("W/", ""), page.etag)
+    assert etag_matches(f'"other", {page.etag}', page.etag)
+    assert etag_matches("*", page.etag)
+    assert not etag_matches('"other"', page.etag)
+
+
+def test_listing_cache_validates_mtime_and_evicts_lru():
+    cache = ListingCache(max_bytes=10)
+    cache.put("/a", 1, "A", 4)
+    cache.put("/b", 1, "B", 4)
+    assert cache.get("/a", 1) == "A"
+    assert cache.get("/b", 2) is None  # directory changed since it was cached
+    cache.put("/b", 2, "B2", 4)
+    cache.put("/c", 1, "C", 4)  # over budget: /a is least recently used
+    assert cache.get("/a", 1) is None
+    assert cache.get("/b", 2) == "B2"
+    assert cache.size == 8
+
+
+def test_listing_cache_keeps_newest_entry_over_budget(tmp_path, monkeypatch):
+    cache = ListingCache(max_bytes=10)
+    cache.put("/a", 1, "A", 4)
+    cache.put("/huge", 1, "H", 50)  # a folder with more entries than the whole budget
+    assert cache.get("/huge", 1) == "H"
+    assert cache.get("/a", 1) is None
+
+    # Sort views built for paging are charged to the cached listing.
+    monkeypatch.setattr(santhushare, "LISTING_CACHE", ListingCache(santhushare.LISTING_CACHE_BYTES))
+    for i in range(10):
+        (tmp_path / f"f{i}").write_bytes(b"x" * i)
+    os.utime(tmp_path, (1, 1))
+    list_page(str(tmp_path))
+    before = santhushare.LISTING_CACHE.size
+    list_page(str(tmp_path), sort="size")
+    assert santhushare.LISTING_CACHE.size == before + 72 * 10
+
+
+def test_scan_directory_single_pass(tmp_path):
+    (tmp_path / "b.txt").write_bytes(b"12345")
+    (tmp_path / "a").mkdir()
+    entries = scan_directory(str(tmp_path))
+    assert [(name, is_dir, size) for name, is_dir, size, _ in entries] == [
+        ("a", True, 0),
+        ("b.txt", False, 5),
+    ]
+
+
+@pytest.mark.parametrize("sort, order", [("name", "asc"), ("name", "desc"), ("size", "desc"), ("mtime", "asc")])
+def test_list_page_cursor_walks_every_entry_once(tmp_path, sort, order):
+    for i in range(25):
+        (tmp_path / f"f{i:02}").write_bytes(b"x" * (i % 7))
+    seen, cursor = [], None
+    while True:
+        page = list_page(str(tmp_path), sort=sort, order=order, limit=10, cursor=cursor)
+        seen += [e["name"] for e in page["entries"]]
+        cursor = page["next"]
+        if cursor is None:
+            break
+    assert sorted(seen) == [f"f{i:02}" for i in range(25)]
+    assert len(seen) == 25
+    if sort == "name":
+        assert seen == sorted(seen, reverse=(order == "desc"))
+
+
+@pytest.mark.parametrize("level", [0, 6])
+def test_zip_streamer_stores_compressed_media_and_deflates_text(tmp_path, level):
+    root = tmp_path / "album"
+    (root / "raw").mkdir(parents=True)
+    (root / "photo.jpg").write_bytes(os.urandom(300_000))
+    (root / "raw" / "notes.txt").write_bytes(b"row of text\n" * 300_000)
+    (root / "raw" / "empty").write_bytes(b"")
+    out = BytesIO()
+    z = ZipStreamer(out, level)
+    z.write_tree(str(root))
+    z.close()
+    with zipfile.ZipFile(BytesIO(out.getvalue())) as zf:
+        assert zf.testzip() is None
+        methods = {i.filename: i.compress_type for i in zf.infolist()}
+        assert zf.read("album/raw/notes.txt") == b"row of text\n" * 300_000
+    assert methods["album/photo.jpg"] == zipfile.ZIP_STORED
+    assert methods["album/raw/notes.txt"] == (zipfile.ZIP_DEFLATED if level else zipfile.ZIP_STORED)
+
+
+@pytest.mark.parametrize("use_sendfile", [True, False])
+def test_send_file_range_sendfile_and_mmap_windows(tmp_path, monkeypatch, use_sendfile):
+    monkeypatch.setattr(santhushare, "USE_SENDFILE", use_sendfile)
+    # Small windows so the mmap path maps several, starting off-alignment.
+    monkeypatch.setattr(santhushare, "MMAP_WINDOW", mmap.ALLOCATIONGRANULARITY)
+    data = os.urandom(3 * mmap.ALLOCATIONGRANULARITY + 123)
+    (tmp_path / "f.bin").write_bytes(data)
+    server_sock, client_sock = socket.socketpair()
+    handler = SecureHandler.__new__(SecureHandler)
+    handler.connection = server_sock
+    handler.wfile = server_sock.makefile("wb")
+    handler.pace = None
+    handler.sent_direct = 0
+    start, length = 1000, len(data) - 2000
+    received = bytearray()
+    reader = threading.Thread(target=lambda: received.extend(client_sock.makefile("rb").read(length)))
+    reader.start()
+    with open(tmp_path / "f.bin", "rb") as f:
+        handler.send_file_range(f, start, length)
+    handler.wfile.flush()
+    reader.join(10)
+    server_sock.close()
+    client_sock.close()
+    assert bytes(received) == data[start:start + length]
+    assert handler.sent_direct == (length if use_sendfile else 0)
+
+
+def test_first_download_keeps_sendfile_and_later_ones_carry_the_digest(tmp_path, monkeypatch):
+    monkeypatch.setattr(AppManager, "_instance", None)
+    AppManager(object())
+    monkeypatch.setattr(santhushare, "USE_SENDFILE", True)
+
+    def no_mmap(*args, **kwargs):
+        raise AssertionError("the body left the sendfile path")
+
+    monkeypatch.setattr(santhushare.mmap, "mmap", no_mmap)
+    data = os.urandom(300_000)
+    (tmp_path / "f.bin").write_bytes(data)
+    httpd = ReusableTCPServer(("127.0.0.1", 0), SecureHandler)
+    httpd.password = "secret"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    auth = {"Authorization": "Basic " + base64.b64encode(b"user:secret").decode()}
+    try:
+        conn = http.client.HTTPConnection(*httpd.server_address, timeout=10)
+        digests = []
+        for _ in range(2):
+            conn.request("GET", "/download?path=" + urllib.parse.quote(str(tmp_path / "f.bin")), headers=auth)
+            response = conn.getresponse()
+            assert response.read() == data
+            digests.append(response.getheader("Repr-Digest"))
+            santhushare.HASH_POOL.submit(lambda: None).result(10)  # the background hash is done
+        conn.close()
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    assert digests[0] is None
+    expected = santhushare.hash_file(str(tmp_path / "f.bin"), {santhushare.FAST_DIGEST}).digests()
+    assert santhushare.parse_digests(digests[1]) == expected
+
+
+class _RangeSink:
+    def __init__(self):
+        self.wfile = BytesIO()
+
+    def send_file_range(self, f, offset, length, hashes=None):
+        f.seek(offset)
+        data = f.read(length)
+        if hashes: hashes.update(data)
+        self.wfile.write(data)
+
+
+def test_zip_layout_size_is_exact_and_ranges_match(tmp_path):
+    root = tmp_path / "cam"
+    (root / "day2").mkdir(parents=True)
+    for i, size in enumerate([0, 1, 70_000, 250_000]):
+        (root / f"IMG_{i}.jpg").write_bytes(os.urandom(size))
+    (root / "day2" / "clip.mp4").write_bytes(os.urandom(400_000))
+    layout = ZipLayout(str(root))
+    full = _RangeSink()
+    layout.write_range(full, 0, layout.size)
+    data = full.wfile.getvalue()
+    assert len(data) == layout.size
+    with zipfile.ZipFile(BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        assert len(zf.namelist()) == 5
+    for start, stop in [(0, 1), (100, 300_000), (layout.size - 40, layout.size)]:
+        part = _RangeSink()
+        ZipLayout(str(root)).write_range(part, start, stop)
+        assert part.wfile.getvalue() == data[start:stop]
+
+
+def test_zip_layout_reads_each_file_once_and_signs_member_identity(tmp_path, monkeypatch):
+    root = tmp_path / "cam"
+    root.mkdir()
+    for i in range(3):
+        (root / f"IMG_{i}.jpg").write_bytes(os.urandom(50_000 + i))
+    monkeypatch.setattr(santhushare, "ZIP_CRC_CACHE", ListingCache(1024 * 1024))
+    monkeypatch.setattr(santhushare, "file_crc", lambda *a: pytest.fail("second read for a CRC"))
+    layout = ZipLayout(str(root))
+    sink = _RangeSink()
+    layout.write_range(sink, 0, layout.size)
+    with zipfile.ZipFile(BytesIO(sink.wfile.getvalue())) as zf:
+        assert zf.testzip() is None
+    # The CRCs are remembered for the next download of the same files.
+    assert len(santhushare.ZIP_CRC_CACHE.entries) == 3
+
+    # Same names, sizes and mtimes, but a different file: a resume must not match.
+    st = os.stat(root / "IMG_1.jpg")
+    replacement = tmp_path / "other.jpg"
+    replacement.write_bytes(os.urandom(st.st_size))
+    os.utime(replacement, ns=(st.st_atime_ns, st.st_mtime_ns))
+    os.replace(replacement, root / "IMG_1.jpg")
+    assert ZipLayout(str(root)).signature != layout.signature
+
+
+def test_tar_layout_streams_selection_with_exact_size(tmp_path):
+    (tmp_path / "dir" / "nested").mkdir(parents=True)
+    (tmp_path / "dir" / "nested" / "deep.txt").write_bytes(b"deep")
+    a = tmp_path / "a.bin"
+    a.write_bytes(os.urandom(1000))
+    (tmp_path / "other").mkdir()
+    (tmp_path / "other" / "a.bin").write_bytes(b"same name")
+    layout = TarLayout([str(a), str(tmp_path / "dir"), str(tmp_path / "other" / "a.bin"), str(tmp_path / "gone")])
+    sink = _RangeSink()
+    layout.write_range(sink, 0, layout.size)
+    data = sink.wfile.getvalue()
+    assert len(data) == layout.size
+    with tarfile.open(fileobj=BytesIO(data)) as tf:
+        assert tf.getnames() == ["a.bin", "dir/nested/deep.txt", "a (2).bin"]
+        assert tf.extractfile("a.bin").read() == a.read_bytes()
+    layout.segments.append((layout.size, 10, "desc", 0))  # a zip-only kind
+    with pytest.raises(ValueError):
+        layout.write_range(_RangeSink(), layout.size, layout.size + 10)
+
+
+def test_hash_index_finds_links_and_persists_content(tmp_path):
+    data = os.urandom(5000)
+    digest = hashlib.sha256(data).hexdigest()
+    (tmp_path / "a.jpg").write_bytes(data)
+    index = HashIndex(str(tmp_path))
+    index.add("a.jpg", digest)
+    assert index.find(digest, len(data)) == "a.jpg"
+    assert index.find(digest, len(data) + 1) is None
+    assert index.link("a.jpg", "copy.jpg", digest) in ("linked", "copied")
+    assert (tmp_path / "copy.jpg").read_bytes() == data
+    assert index.find(digest, len(data), prefer="copy.jpg") == "copy.jpg"
+    index.save()
+    (tmp_path / "a.jpg").unlink()
+    reloaded = HashIndex(str(tmp_path))
+    assert reloaded.find(digest, len(data), prefer="a.jpg") == "copy.jpg"
+    assert reloaded.sizes() == {len(data)}
+
+
+def test_overwriting_a_linked_name_leaves_its_siblings_alone(tmp_path):
+    data = b"shared content"
+    (tmp_path / "a.jpg").write_bytes(data)
+    index = HashIndex(str(tmp_path))
+    index.link("a.jpg", "copy.jpg", hashlib.sha256(data).hexdigest())
+    upload = UploadFile(str(tmp_path / "copy.jpg"))
+    upload.write(b"new upload")
+    upload.close()
+    assert (tmp_path / "copy.jpg").read_bytes() == b"new upload"
+    assert (tmp_path / "a.jpg").read_bytes() == data
+
+
+def test_manifest_walk_and_fetch_paths_stay_inside_root(tmp_path):
+    (tmp_path / "b" / "c").mkdir(parents=True)
+    (tmp_path / "a.jpg").write_bytes(b"1")
+    (tmp_path / "b" / "c" / "d.txt").write_bytes(b"22")
+    (tmp_path / "b" / "loop").symlink_to(tmp_path)
+    rows = list(walk_manifest(str(tmp_path)))
+    assert [(r[0], r[1]) for r in rows] == [("a.jpg", 1), ("b/c/d.txt", 2)]
+    assert resolve_fetch_paths(str(tmp_path), ["b/c/d.txt"]) == [str(tmp_path / "b" / "c" / "d.txt")]
+    for bad in ["../x", "/etc/passwd", "b/../../x", "."]:
+        with pytest.raises(ValueError):
+            resolve_fetch_paths(str(tmp_path), [bad])
+
+
+def test_thumbnail_service_caches_results_on_disk(tmp_path):
+    service = ThumbnailService(str(tmp_path / "cache"), max_bytes=1024 * 1024, workers=1)
+    (tmp_path / "notes.txt").write_text("not an image")
+    assert service.get(str(tmp_path / "notes.txt"), 128)[1] is None
+    assert len(os.listdir(tmp_path / "cache")) == 1  # The miss is remembered too.
+
+    Image = pytest.importorskip("PIL.Image")
+    Image.new("RGB", (800, 600), (200, 30, 30)).save(tmp_path / "photo.jpg")
+    key, data = service.get(str(tmp_path / "photo.jpg"), 128)
+    assert Image.open(BytesIO(data)).size == (128, 96)
+    assert service.get(str(tmp_path / "photo.jpg"), 128) == (key, data)
+
+
+def test_thumbnail_service_answers_before_slow_renders_finish(tmp_path, monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(santhushare, "make_thumbnail", lambda path, size: release.wait(5) and b"jpeg")
+    service = ThumbnailService(str(tmp_path / "cache"), max_bytes=1024 * 1024, workers=1)
+    (tmp_path / "big.jpg").write_bytes(b"x")
+    with pytest.raises(concurrent.futures.TimeoutError):
+        service.get(str(tmp_path / "big.jpg"), 128, wait=0.05)
+    release.set()
+    assert service.get(str(tmp_path / "big.jpg"), 128)[1] == b"jpeg"
+    assert ThumbnailService().directory.startswith(tempfile.gettempdir())
+
+
+def test_token_bucket_returns_wait_for_debt():
+    bucket = TokenBucket(1024 * 1024)
+    assert bucket.take(bucket.burst) == 0
+    assert bucket.take(512 * 1024) == pytest.approx(0.5, abs=0.05)
+    assert TokenBucket(0).take(10 ** 9) == 0
+
+
+def test_scheduler_splits_global_rate_between_active_clients():
+    scheduler = TransferScheduler(global_rate=8_000_000)
+    scheduler.begin_bulk("10.0.0.2")
+    assert scheduler.clients["10.0.0.2"][0].rate == 8_000_000
+    scheduler.begin_bulk("10.0.0.3")
+    assert [c[0].rate for c in scheduler.clients.values()] == [4_000_000, 4_000_000]
+    scheduler.configure(8_000_000, 1_000_000)
+    assert [c[0].rate for c in scheduler.clients.values()] == [1_000_000, 1_000_000]
+    scheduler.end_bulk("10.0.0.3")
+    scheduler.configure(8_000_000, 0)
+    assert list(scheduler.clients) == ["10.0.0.2"]
+    assert scheduler.clients["10.0.0.2"][0].rate == 8_000_000
+
+
+def test_bulk_yields_to_interactive_requests_without_limits(monkeypatch):
+    scheduler = TransferScheduler()
+    pace = scheduler.begin_bulk("10.0.0.2")
+    started = time.monotonic()
+    for _ in range(200):
+        pace(512 * 1024)  # 100 MB with nothing else going on.
+    assert time.monotonic() - started < 0.1
+
+    # A page load in flight makes each slice step aside briefly, not stall.
+    sleeps = []
+    monkeypatch.setattr(santhushare.time, "sleep", sleeps.append)
+    scheduler.begin_interactive()
+    pace(512 * 1024)
+    assert sleeps == [santhushare.SCHED_YIELD] and santhushare.SCHED_YIELD <= 0.005
+
+    # With a limit, interactive requests also weigh bulk slices.
+    sleeps.clear()
+    scheduler.configure(0, 1024 * 1024)
+    pace(512 * 1024)  # Each slice costs twice its size: 1 MB against a 512 KB burst.
+    assert sleeps == [pytest.approx(0.5, abs=0.05)]
+    scheduler.end_interactive()
+    pace(512 * 1024)
+    assert sleeps[-1] == pytest.approx(1.0, abs=0.05)
+
+
+def test_metrics_merge_thread_shards_and_export():
+    metrics = Metrics()
+
+    def work():
+        for _ in range(500):
+            metrics.inc("requests", ("/download", "GET", "200"))
+            metrics.observe("request_seconds", ("/download",), 0.02)
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    metrics.inc("bytes_sent", ("/download",), 1234)
+    report = metrics.report()
+    assert report["routes"]["/download"]["requests"] == 2000
+    assert report["routes"]["/download"]["latency"]["p50"] == 0.025
+    assert report["bytes_sent"] == 1234
+    text = metrics.prometheus()
+    assert 'santhushare_requests_total{route="/download",method="GET",code="200"} 2000' in text
+    assert 'santhushare_request_duration_seconds_bucket{route="/download",le="+Inf"} 2000' in text
+
+
+def test_event_streams_stay_out_of_latency_histogram(monkeypatch):
+    monkeypatch.setattr(santhushare, "METRICS", Metrics())
+    monkeypatch.setattr(santhushare, "EVENTS", EventHub())
+    sub = santhushare.EVENTS.subscribe()
+    for route in ("/events", "/browse"):
+        handler = SecureHandler.__new__(SecureHandler)
+        handler.route, handler.command, handler.status_code = route, "GET", 200
+        handler.started = time.monotonic() - 600  # a stream open for ten minutes
+        handler.sent_direct, handler.wfile, handler.headers = 0, BytesIO(), {}
+        handler.record_metrics()
+    report = santhushare.METRICS.report()
+    assert report["routes"]["/events"]["requests"] == 1
+    assert "latency" not in report["routes"]["/events"]
+    assert report["routes"]["/browse"]["latency"]["count"] == 1
+    assert report["event_streams"] == 1
+    assert "santhushare_event_streams 1" in santhushare.METRICS.prometheus()
+    santhushare.EVENTS.unsubscribe(sub)
+
+
+def test_benchmark_compare_flags_only_real_regressions():
+    from tests.benchmark import compare, percentile
+
+    assert percentile([5, 1, 4, 2, 3], 50) == 3
+    assert percentile(list(range(1, 101)), 99) == 99
+    baseline = {"results": {
+        "download": {"throughput_mb_s": 100.0, "p50_ms": 10.0, "p99_ms": 1.0, "ops": 5},
+        "zip": {"files_per_s": 1000.0},
+    }}
+    current = {"results": {
+        "download": {"throughput_mb_s": 80.0, "p50_ms": 11.0, "p99_ms": 1.5, "ops": 50},
+        "zip": {"files_per_s": 1200.0},
+        "new_case": {"p50_ms": 99.0},
+    }}
+    # Throughput fell 20%; the p99 rise is 50% but only half a millisecond.
+    assert compare(current, baseline, tolerance=0.15) == [("download", "throughput_mb_s", 100.0, 80.0)]
+    assert compare(current, baseline, tolerance=0.25) == []
+
+
+def test_search_index_modes_paging_and_incremental_refresh(tmp_path):
+    root = tmp_path / "root"
+    (root / "Photos" / "2024").mkdir(parents=True)
+    (root / ".hidden").mkdir()
+    for rel in ["Photos/2024/IMG_001.jpg", "Photos/2024/img_002.JPG", "Photos/notes.txt",
+                "report.pdf", ".hidden/secret.jpg"]:
+        (root / rel).write_bytes(b"x" * 10)
+    index = SearchIndex(roots=[str(root)], path=str(tmp_path / "index.gz"))
+    index.start = lambda: None
+    index.refresh()
+
+    hits = index.search("*.jpg")
+    assert hits["mode"] == "ext" and hits["total"] == 2
+    assert {r["name"] for r in hits["results"]} == {"IMG_001.jpg", "img_002.JPG"}
+    assert index.search("img_*")["total"] == 2
+    assert [r["name"] for r in index.search("photo")["results"]] == ["Photos"]
+    assert index.search("photo")["results"][0]["dir"]
+    with pytest.raises(ValueError):
+        index.search("*")
+
+    pages, cursor = [], None
+    while True:
+        page = index.search("o", limit=2, cursor=cursor)
+        pages += [r["path"] for r in page["results"]]
+        if not page["next"]: break
+        cursor = page["next"]
+    assert sorted(pages) == sorted(r["path"] for r in index.search("o", limit=100)["results"])
+    assert len(pages) == len(set(pages)) == 3
+
+    # Only the changed folder is rescanned; a fresh index loads the saved copy.
+    (root / "Photos" / "new.jpg").write_bytes(b"y")
+    scanned = []
+    real_scan = index._scan
+    index._scan = lambda path, mtime: scanned.append(path) or real_scan(path, mtime)
+    index.refresh()
+    assert scanned == [str(root / "Photos")]
+    assert index.search(".jpg")["total"] == 3
+    reloaded = SearchIndex(roots=[str(root)], path=str(tmp_path / "index.gz"))
+    reloaded.load()
+    assert reloaded.search("new.jpg")["results"][0]["path"] == str(root / "Photos" / "new.jpg")
+    assert SearchIndex().path.startswith(tempfile.gettempdir())
+
+
+def test_folder_totals_feed_listings_and_queue_stale_rescans(tmp_path, monkeypatch):
+    root = tmp_path / "root"
+    (root / "a" / "b").mkdir(parents=True)
+    (root / "a" / "one.bin").write_bytes(b"x" * 100)
+    (root / "a" / "b" / "two.bin").write_bytes(b"x" * 20)
+    (root / "c").mkdir()
+    index = SearchIndex(roots=[str(root)], path=str(tmp_path / "index.gz"))
+    index.start = lambda: None
+    assert index.folder_total(str(root / "a")) is None
+    index.refresh()
+    monkeypatch.setattr(santhushare, "SEARCH", index)
+
+    rows = {e["name"]: e for e in santhushare.list_page(str(root))["entries"]}
+    assert (rows["a"]["size"], rows["a"]["files"]) == (120, 2)
+    assert (rows["c"]["size"], rows["c"]["files"]) == (0, 0)
+    assert index.folder_total(str(root)) == (120, 2)
+    assert index.search("b")["results"][0]["files"] == 1
+    assert not index._pending
+
+    # A stale folder keeps its old total until the queued rescan runs.
+    (root / "a" / "new.bin").write_bytes(b"x" * 5)
+    assert santhushare.list_page(str(root))["entries"][0]["size"] == 120
+    assert index._pending == {str(root / "a")}
+    os.utime(tmp_path / "index.gz", ns=(0, 0))
+    index.refresh(index._pending)
+    # Only the totals of the folder and its ancestors moved; the saved file
+    # and the name index wait for the next full pass.
+    assert index.folder_total(str(root / "a")) == (125, 3)
+    assert index.folder_total(str(root)) == (125, 3)
+    assert index.folder_total(str(root / "a" / "b")) == (20, 1)
+    assert os.stat(tmp_path / "index.gz").st_mtime_ns == 0
+    assert index.search("new.bin")["results"] == []
+    index.refresh()
+    assert index.search("new.bin")["results"][0]["size"] == 5
+    assert os.stat(tmp_path / "index.gz").st_mtime_ns != 0
+
+
+def test_event_hub_replays_resyncs_and_drops_slow_subscribers(monkeypatch):
+    hub = EventHub()
+    live = hub.subscribe()
+    for i in range(3):
+        hub.publish("history", {"n": i})
+    out = live.drain().decode()
+    assert out.startswith("retry:") and out.count("event: history") == 3
+
+    # A reconnect gets what came after its last id, or a resync once that has aged out.
+    replay = hub.subscribe(last_id="2").drain().decode()
+    assert replay.count("event: history") == 1 and '"n": 2' in replay
+    monkeypatch.setattr(santhushare, "EVENTS_QUEUE", 5)
+    hub.backlog.clear()
+    hub.publish("file", {})
+    assert "event: resync" in hub.subscribe(last_id="1").drain().decode()
+
+    slow = hub.subscribe()
+    for i in range(10):
+        hub.publish("progress", {})
+    assert slow.closed and len(slow.queue) == 5
+    hub.unsubscribe(slow)
+    assert slow not in hub.subscribers
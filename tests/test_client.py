@@ -0,0 +1,184 @@
+import random
+import threading
+
+import pytest
+
+import santhushare.__main__ as santhushare
+from santhushare import client as cli
+from santhushare.__main__ import AppManager, AsyncHTTPServer, SecureHandler
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr(AppManager, "_instance", None)
+    AppManager(object())
+    monkeypatch.setattr(santhushare, "TARGET_UPLOAD_DIR", str(upload_dir))
+    monkeypatch.setattr(santhushare, "DEFAULT_UPLOAD_CHUNK", 64 * 1024)
+    monkeypatch.setattr(cli, "LARGE_FILE", 100 * 1024)
+    monkeypatch.setattr(cli, "SEGMENT_SIZE", 64 * 1024)
+    santhushare.UPLOAD_STORAGE.invalidate()
+    httpd = AsyncHTTPServer(("127.0.0.1", 0), SecureHandler)
+    httpd.password = "secret"
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    client = cli.Client(f"http://127.0.0.1:{httpd.server_address[1]}", "secret", connections=3)
+    yield client, upload_dir
+    client.close()
+    httpd.shutdown()
+    httpd.server_close()
+    santhushare.UPLOAD_STORAGE.invalidate()
+
+
+def make_tree(root):
+    rnd = random.Random(7)
+    files = {}
+    for rel, size in [("a.txt", 10), ("empty", 0), ("sub/b.bin", 90 * 1024),
+                      ("sub/deeper/c.jpg", 300 * 1024 + 5), ("d.bin", 200 * 1024)]:
+        path = root.joinpath(*rel.split("/"))
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(rnd.randbytes(size))
+        files[rel] = path.read_bytes()
+    return files
+
+
+def fail_once(monkeypatch, client, method, match):
+    """Make the first ``method`` request whose URL contains ``match`` fail."""
+    seen = []
+    real = client.request
+
+    def request(m, path, body=None, headers=None, params=None):
+        url = path + str(params or "") + str(headers or "")
+        if m == method:
+            seen.append(url)
+            if match in url and not getattr(request, "failed", False):
+                request.failed = True
+                raise cli.ClientError("injected failure", 400)
+        return real(m, path, body, headers, params)
+
+    monkeypatch.setattr(client, "request", request)
+    return seen
+
+
+def test_push_uploads_batches_and_chunks_then_skips(server, tmp_path):
+    client, upload_dir = server
+    files = make_tree(tmp_path / "src")
+    progress = cli.Progress(quiet=True)
+    state = cli.SessionState(str(tmp_path / "state.json"))
+    assert client.push([str(tmp_path / "src")], progress=progress, state=state) == []
+    for rel, data in files.items():
+        assert (upload_dir / rel.split("/")[-1]).read_bytes() == data
+    assert progress.files == len(files) and progress.bytes == sum(map(len, files.values()))
+    assert state.sessions == {}
+
+    again = cli.Progress(quiet=True)
+    assert client.push([str(tmp_path / "src")], progress=again, state=state) == []
+    assert again.files == 0 and again.skipped == len(files)
+    assert {e["name"] for e in client.ls()} >= {"a.txt", "c.jpg"}
+
+
+def test_push_resumes_an_interrupted_upload(server, tmp_path, monkeypatch):
+    client, upload_dir = server
+    data = random.Random(3).randbytes(5 * 64 * 1024 + 17)
+    (tmp_path / "big.bin").write_bytes(data)
+    state = cli.SessionState(str(tmp_path / "state.json"))
+    puts = fail_once(monkeypatch, client, "PUT", "'index': 2}")
+
+    errors = client.push([str(tmp_path / "big.bin")], progress=cli.Progress(quiet=True), state=state)
+    assert len(errors) == 1 and not (upload_dir / "big.bin").exists()
+    assert len(state.sessions) == 1
+    sent = len(puts)
+
+    assert client.push([str(tmp_path / "big.bin")], progress=cli.Progress(quiet=True), state=state) == []
+    assert len(puts) - sent == 1
+    assert (upload_dir / "big.bin").read_bytes() == data
+    assert state.sessions == {}
+
+
+def test_corrupted_chunk_is_rejected_and_resent(server, tmp_path, monkeypatch):
+    client, upload_dir = server
+    data = random.Random(5).randbytes(3 * 64 * 1024)
+    (tmp_path / "big.bin").write_bytes(data)
+    real = client.request
+    bodies = []
+
+    def request(method, path, body=None, headers=None, params=None):
+        if method == "PUT" and params == {"index": 1} and 1 not in bodies:
+            body = b"\0" + body[1:]  # Flipped in transit; the digest header still describes the original.
+        if method == "PUT": bodies.append(params["index"])
+        return real(method, path, body, headers, params)
+
+    monkeypatch.setattr(client, "request", request)
+    state = cli.SessionState(str(tmp_path / "state.json"))
+    assert client.push([str(tmp_path / "big.bin")], progress=cli.Progress(quiet=True), state=state) == []
+    assert sorted(bodies) == [0, 1, 1, 2]
+    assert (upload_dir / "big.bin").read_bytes() == data
+
+
+def test_pull_copies_tree_and_resumes_segments(server, tmp_path, monkeypatch):
+    client, _ = server
+    files = make_tree(tmp_path / "remote")
+    dest = tmp_path / "dest"
+    gets = fail_once(monkeypatch, client, "GET", "bytes=65536-")
+
+    errors = client.pull(str(tmp_path / "remote"), str(dest), cli.Progress(quiet=True))
+    assert len(errors) == 1
+    assert len(list(dest.rglob("*" + cli.PART_SUFFIX + ".json"))) == 1
+    sent = len(gets)
+
+    progress = cli.Progress(quiet=True)
+    assert client.pull(str(tmp_path / "remote"), str(dest), progress) == []
+    assert len(gets) - sent == 2  # The manifest and the one missing segment.
+    for rel, data in files.items():
+        local = dest.joinpath(*rel.split("/"))
+        assert local.read_bytes() == data
+        assert abs(local.stat().st_mtime - (tmp_path / "remote").joinpath(*rel.split("/")).stat().st_mtime) < 1
+    assert not [p for p in dest.rglob("*") if cli.PART_SUFFIX in p.name]
+    assert progress.skipped == len(files) - 1
+
+
+def test_pull_verifies_segments_of_a_file_the_server_never_hashed(server, tmp_path, monkeypatch):
+    client, _ = server
+    remote = tmp_path / "remote"
+    remote.mkdir()
+    data = random.Random(9).randbytes(4 * 64 * 1024 + 3)
+    (remote / "big.bin").write_bytes(data)
+    real = client.request
+    flipped = []
+
+    class Flipped:
+        def __init__(self, response):
+            self.response = response
+
+        def read(self, n=-1):
+            chunk = self.response.read(n)
+            if chunk and not flipped:
+                flipped.append(True)
+                chunk = bytes([chunk[0] ^ 1]) + chunk[1:]
+            return chunk
+
+        def __getattr__(self, name):
+            return getattr(self.response, name)
+
+    def request(method, path, body=None, headers=None, params=None):
+        response = real(method, path, body, headers, params)
+        return Flipped(response) if "bytes=65536-" in str(headers) else response
+
+    monkeypatch.setattr(client, "request", request)
+    dest = tmp_path / "dest"
+    errors = client.pull(str(remote), str(dest), cli.Progress(quiet=True))
+    assert len(errors) == 1 and "corrupted" in errors[0]
+    assert not (dest / "big.bin").exists()
+
+    # Asked for by the segments, the server has the digest by now.
+    st = (remote / "big.bin").stat()
+    assert "sha-256" in santhushare.known_digests(str(remote / "big.bin"), st)
+    assert client.pull(str(remote), str(dest), cli.Progress(quiet=True)) == []
+    assert (dest / "big.bin").read_bytes() == data
+
+
+def test_safe_relpath_rejects_escapes():
+    assert cli.safe_relpath("a/b.txt") == ["a", "b.txt"]
+    for bad in ["../x", "/etc/passwd", "a//b", "a/./b"]:
+        with pytest.raises(cli.ClientError):
+            cli.safe_relpath(bad)